@@ -0,0 +1,107 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA = 'replica'
+PIN_KEY = 'db_pin:{user_id}'
+
+# Alias reads are routed to inside a reporting() block (None means default)
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+# Last replica lag check for this process
+_replica_state = {'checked_at': None, 'healthy': False}
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def replica_healthy():
+    """True if the replica answers and lags less than REPLICA_MAX_LAG_SECONDS (checked every few seconds)"""
+    now = time.monotonic()
+    checked_at = _replica_state['checked_at']
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_SECONDS:
+        return _replica_state['healthy']
+
+    try:
+        with connections[REPLICA].cursor() as cursor:
+            # Zero when replay has caught up; NULL (-> 0) on a server that is not a standby
+            cursor.execute(
+                """
+                SELECT COALESCE(
+                    CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                         ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                    END, 0)
+                """
+            )
+            lag = float(cursor.fetchone()[0])
+        healthy = lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logger.warning(f"Replica lag {lag:.1f}s, reading from primary")
+    except Exception as e:
+        logger.warning(f"Replica unavailable, reading from primary: {e}")
+        healthy = False
+
+    _replica_state.update(checked_at=now, healthy=healthy)
+    return healthy
+
+
+def pin_to_primary(user_id):
+    """Keep this user's reads on the primary until the replica has caught up with their write"""
+    if not replica_configured():
+        return
+    try:
+        cache.set(PIN_KEY.format(user_id=user_id), 1, settings.REPLICA_PIN_SECONDS)
+    except Exception as e:
+        logger.warning(f"Не смог закрепить пользователя за основной БД: {e}")
+
+
+def is_pinned(user_id):
+    try:
+        return bool(cache.get(PIN_KEY.format(user_id=user_id)))
+    except Exception:
+        # Without the pin we cannot promise read-your-writes
+        return True
+
+
+def read_db_alias(user_id=None):
+    """Database alias for a read-only workload"""
+    if not replica_configured():
+        return 'default'
+    if user_id is not None and is_pinned(user_id):
+        return 'default'
+    return REPLICA if replica_healthy() else 'default'
+
+
+@contextmanager
+def reporting(user_id=None):
+    """Route reads inside the block to the replica when it is healthy"""
+    token = _read_alias.set(read_db_alias(user_id))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica only inside reporting() blocks.
+
+    Everything else, including every write and all reads of the bot handler,
+    goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bot2',  # Our bot app
     'django_celery_beat',  # For scheduled tasks
 ]
@@ -95,12 +96,59 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'hourlybot_password'),
         'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
         'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Connections are checked before reuse (pooled or persistent)
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'connect_timeout': 10,
         },
+        # Russian full-text search needs a UTF8 database; don't inherit the
+        # server's default encoding for the test database
+        'TEST': {
+            'CHARSET': 'UTF8',
+            'TEMPLATE': 'template0',
+        },
     }
 }
 
+# Connection pooling (psycopg 3). Each process (gunicorn worker, celery
+# prefork child) opens its own pool lazily on first use, so size it per
+# process: DB_POOL_MAX_SIZE x processes must stay below max_connections.
+# With pooling disabled, connections are kept open for DB_CONN_MAX_AGE.
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'True').lower() in ('true', '1', 'yes')
+if DB_POOL_ENABLED:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 4)),
+        # Recycle connections after this many seconds
+        'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+        'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+        # How long a request waits for a free connection before failing
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+# Optional read replica for reporting workloads (summaries, exports,
+# analytics, admin lists). Reads go there only inside
+# bot1.db_router.reporting() blocks and fall back to the primary when the
+# replica lags or is down.
+if os.environ.get('POSTGRES_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['POSTGRES_REPLICA_HOST'],
+        'PORT': os.environ.get('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        'OPTIONS': {
+            **DATABASES['default']['OPTIONS'],
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['bot1.db_router.ReplicaRouter']
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', 5))
+# How long a user's reads stay on the primary after they write
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -146,15 +194,162 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Bot Framework Configuration
 BOT_FRAMEWORK_APP_ID = os.environ.get('BOT_FRAMEWORK_APP_ID', '')
 BOT_FRAMEWORK_APP_PASSWORD = os.environ.get('BOT_FRAMEWORK_APP_PASSWORD', '')
+# The access token is cached in Redis for every process and refreshed this
+# long before it expires
+BOT_TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('BOT_TOKEN_REFRESH_MARGIN_SECONDS', 300))
+# Users the connector answers 403/404 for are deactivated at once; after
+# this many transient failures in a row (about three days of questions)
+# they are deactivated as well. Writing to the bot reactivates them.
+DELIVERY_FAILURE_LIMIT = int(os.environ.get('DELIVERY_FAILURE_LIMIT', 45))
+
+# Readiness probes (/bot/api/health/ready/), refreshed by a background
+# thread in each web process. A queue longer than HEALTH_MAX_QUEUE_DEPTH
+# is reported as a warning.
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.environ.get('HEALTH_PROBE_INTERVAL_SECONDS', 10))
+HEALTH_PROBE_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PROBE_TIMEOUT_SECONDS', 2))
+HEALTH_OPENAI_PROBE_INTERVAL_SECONDS = float(os.environ.get('HEALTH_OPENAI_PROBE_INTERVAL_SECONDS', 300))
+HEALTH_MAX_QUEUE_DEPTH = int(os.environ.get('HEALTH_MAX_QUEUE_DEPTH', 1000))
+
+# UserResponse retention: expired rows are archived to compressed JSONL
+# files, then fully expired monthly partitions are dropped whole and the
+# remaining expired rows are deleted in small batches. Partitions are
+# created ahead of time.
+RESPONSE_RETENTION_DAYS = int(os.environ.get('RESPONSE_RETENTION_DAYS', 30))
+RESPONSE_PARTITIONS_AHEAD = int(os.environ.get('RESPONSE_PARTITIONS_AHEAD', 3))
+RESPONSE_ARCHIVE_DIR = os.environ.get('RESPONSE_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+RESPONSE_ARCHIVE_CHUNK_SIZE = int(os.environ.get('RESPONSE_ARCHIVE_CHUNK_SIZE', 5000))
+RESPONSE_DELETE_BATCH_SIZE = int(os.environ.get('RESPONSE_DELETE_BATCH_SIZE', 1000))
+RESPONSE_DELETE_PAUSE_SECONDS = float(os.environ.get('RESPONSE_DELETE_PAUSE_SECONDS', 0.2))
+RESPONSE_EXPORT_CHUNK_SIZE = int(os.environ.get('RESPONSE_EXPORT_CHUNK_SIZE', 2000))
+
+# Redis for bot state (open question slots, reply buffers)
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Django cache (per-user answers to read commands such as 'status')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'hourlybot',
+    }
+}
+COMMAND_CACHE_TTL_SECONDS = int(os.environ.get('COMMAND_CACHE_TTL_SECONDS', 300))
+
+# Analytics API: reports are cached per time bucket of this many seconds.
+# Requests need 'Authorization: Bearer <ANALYTICS_API_TOKEN>' or a staff session
+ANALYTICS_CACHE_SECONDS = int(os.environ.get('ANALYTICS_CACHE_SECONDS', 300))
+ANALYTICS_API_TOKEN = os.environ.get('ANALYTICS_API_TOKEN', '')
+
+# Full-text search over responses: default lookback and page size
+SEARCH_DEFAULT_DAYS = int(os.environ.get('SEARCH_DEFAULT_DAYS', 30))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+
+# Admin over large tables: below this planner estimate the change list
+# counts exactly; bulk actions are queued as Celery tasks of this many ids
+ADMIN_EXACT_COUNT_THRESHOLD = int(os.environ.get('ADMIN_EXACT_COUNT_THRESHOLD', 10000))
+ADMIN_ACTION_CHUNK_SIZE = int(os.environ.get('ADMIN_ACTION_CHUNK_SIZE', 500))
+
+# Local activity classifier (bot2.classifier)
+CLASSIFIER_BATCH_SIZE = int(os.environ.get('CLASSIFIER_BATCH_SIZE', 2000))
+CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get('CLASSIFIER_MIN_CONFIDENCE', 0.25))
+CLASSIFIER_INTERVAL_SECONDS = int(os.environ.get('CLASSIFIER_INTERVAL_SECONDS', 300))
+
+# How long a sent question stays "open" for replies, in seconds
+OPEN_SLOT_TTL_SECONDS = int(os.environ.get('OPEN_SLOT_TTL_SECONDS', 4 * 60 * 60))
+
+# Scheduled runs take their slot from the schedule, not from the clock when
+# a worker picks them up. A backed-up queue delays a slot up to its window
+# (questions: before the next slot; summary: the evening), after that it
+# is dropped and counted in scheduled_slots_missed_total. Runs later than
+# SCHEDULE_ON_TIME_SECONDS count as late.
+QUESTION_LATENESS_WINDOW_SECONDS = int(os.environ.get('QUESTION_LATENESS_WINDOW_SECONDS', 25 * 60))
+SUMMARY_LATENESS_WINDOW_SECONDS = int(os.environ.get('SUMMARY_LATENESS_WINDOW_SECONDS', 2 * 60 * 60))
+SCHEDULE_ON_TIME_SECONDS = int(os.environ.get('SCHEDULE_ON_TIME_SECONDS', 60))
+
+# Adaptive question frequency (bot2.engagement): every night users who
+# answered less than ENGAGEMENT_MIN_ANSWER_RATE of the questions delivered to
+# them in the last ENGAGEMENT_WINDOW_DAYS move down a tier (every slot -> on
+# the hour -> twice a day). Users asked fewer than ENGAGEMENT_MIN_QUESTIONS
+# times keep their tier; any answer restores every slot.
+ENGAGEMENT_WINDOW_DAYS = int(os.environ.get('ENGAGEMENT_WINDOW_DAYS', 3))
+ENGAGEMENT_MIN_ANSWER_RATE = float(os.environ.get('ENGAGEMENT_MIN_ANSWER_RATE', 0.2))
+ENGAGEMENT_MIN_QUESTIONS = int(os.environ.get('ENGAGEMENT_MIN_QUESTIONS', 5))
+
+# Write-behind mode: replies sent in a burst are buffered in Redis and
+# flushed to Postgres together once the user has been quiet for the
+# debounce window
+RESPONSE_WRITE_BEHIND = os.environ.get('RESPONSE_WRITE_BEHIND', 'False').lower() in ('true', '1', 'yes')
+RESPONSE_WRITE_BEHIND_DEBOUNCE_SECONDS = int(os.environ.get('RESPONSE_WRITE_BEHIND_DEBOUNCE_SECONDS', 20))
+RESPONSE_WRITE_BEHIND_FLUSH_SECONDS = int(os.environ.get('RESPONSE_WRITE_BEHIND_FLUSH_SECONDS', 15))
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
-CELERY_ACCEPT_CONTENT = ['json']
-CELERY_TASK_SERIALIZER = 'json'
-CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+# msgpack is smaller and faster to encode than JSON (measure with the
+# celery_payload_benchmark command). JSON is still accepted, so messages
+# queued by an older release drain during a deploy.
+CELERY_ACCEPT_CONTENT = ['msgpack', 'json']
+CELERY_TASK_SERIALIZER = 'msgpack'
+CELERY_RESULT_SERIALIZER = 'msgpack'
 CELERY_TIMEZONE = 'Asia/Almaty'
 
+# Queues, each consumed by its own worker pool (see start_celery.py):
+#   fanout      - the question ticks, nothing else may delay them
+#   summaries   - daily OpenAI summaries, slow and network bound
+#   maintenance - retention, reconciliation, classification, health
+#   adhoc       - single sends, admin bulk actions, reply buffer flushes
+# Within a queue the Redis transport pops priority 0 first and 9 last;
+# tasks without a route of their own land in adhoc at 5.
+CELERY_TASK_DEFAULT_QUEUE = 'adhoc'
+CELERY_TASK_ROUTES = {
+    'bot2.tasks.send_activity_questions': {'queue': 'fanout', 'priority': 0},
+    'bot2.tasks.send_daily_summary': {'queue': 'summaries'},
+    'bot2.tasks.cleanup_old_responses': {'queue': 'maintenance'},
+    'bot2.tasks.reconcile_daily_stats': {'queue': 'maintenance'},
+    'bot2.tasks.update_engagement_tiers': {'queue': 'maintenance'},
+    'bot2.tasks.classify_responses': {'queue': 'maintenance'},
+    'bot2.tasks.health_check': {'queue': 'maintenance'},
+    'bot2.tasks.flush_reply_buffers': {'queue': 'adhoc', 'priority': 1},
+    'bot2.tasks.send_message_to_user': {'queue': 'adhoc', 'priority': 3},
+    'bot2.tasks.resend_question': {'queue': 'adhoc', 'priority': 3},
+    'bot2.tasks.set_users_active': {'queue': 'adhoc', 'priority': 7},
+    # Everything else; exact names above are matched first
+    '*': {'queue': 'adhoc', 'priority': 5},
+}
+# Idempotent tasks are acknowledged after they finish, so a killed worker
+# means a retry instead of a lost run. Tasks that send messages keep early
+# acks: running them twice would message users twice.
+CELERY_TASK_ANNOTATIONS = {
+    name: {'acks_late': True, 'reject_on_worker_lost': True}
+    for name in (
+        'bot2.tasks.cleanup_old_responses',
+        'bot2.tasks.reconcile_daily_stats',
+        'bot2.tasks.update_engagement_tiers',
+        'bot2.tasks.classify_responses',
+        'bot2.tasks.flush_reply_buffers',
+        'bot2.tasks.set_users_active',
+    )
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    # Priorities within a queue (Redis emulates them with sub-queues)
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+    # Unacked acks_late tasks are redelivered after this long, so it has to
+    # outlast the slowest one (the retention cleanup)
+    'visibility_timeout': int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 2 * 60 * 60)),
+}
+
+# Beat runs as several hot-standby replicas; the one holding the Redis lock
+# dispatches (bot2/beat.py). A dead leader is replaced within the TTL plus
+# one retry. A second dispatch of the same entry within the dedupe window
+# (half the interval for interval schedules) is dropped.
+CELERY_BEAT_SCHEDULER = 'bot2.beat:LeaderElectedScheduler'
+BEAT_LEADER_TTL_SECONDS = float(os.environ.get('BEAT_LEADER_TTL_SECONDS', 6))
+BEAT_LEADER_RETRY_SECONDS = float(os.environ.get('BEAT_LEADER_RETRY_SECONDS', 1))
+BEAT_DISPATCH_DEDUPE_SECONDS = float(os.environ.get('BEAT_DISPATCH_DEDUPE_SECONDS', 55))
+
 # Note: Scheduled tasks are configured via the setup_schedules management command
 # which creates database-based schedules using django-celery-beat
 
@@ -0,0 +1,61 @@
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TOKEN_URL = "https://login.microsoftonline.com/botframework.com/oauth2/v2.0/token"
+TOKEN_CACHE_KEY = 'bot_framework:access_token'
+
+
+def cached_token():
+    """{'access_token', 'expires_at'} shared by every process, or None"""
+    try:
+        return cache.get(TOKEN_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не смог прочитать токен из кэша: {e}")
+        return None
+
+
+def get_access_token():
+    """Get access token from Microsoft, reusing the cached one until shortly before it expires"""
+    entry = cached_token()
+    if entry:
+        return entry['access_token']
+    import requests
+    try:
+        data = {
+            'grant_type': 'client_credentials',
+            'client_id': settings.BOT_FRAMEWORK_APP_ID,
+            'client_secret': settings.BOT_FRAMEWORK_APP_PASSWORD,
+            'scope': 'https://api.botframework.com/.default'
+        }
+        response = requests.post(TOKEN_URL, data=data, timeout=10)
+        if response.status_code != 200:
+            logger.error(f"Не смог получить доступ к токену: {response.status_code} - {response.text}")
+            return None
+        payload = response.json()
+    except Exception as e:
+        logger.error(f"Ошибка получения токена: {e}")
+        return None
+
+    expires_in = int(payload.get('expires_in', 3600))
+    entry = {'access_token': payload['access_token'], 'expires_at': time.time() + expires_in}
+    # Dropped from the cache a margin before it expires, so a send never
+    # starts with a token about to lapse
+    ttl = expires_in - settings.BOT_TOKEN_REFRESH_MARGIN_SECONDS
+    if ttl > 0:
+        try:
+            cache.set(TOKEN_CACHE_KEY, entry, ttl)
+        except Exception as e:
+            logger.warning(f"Не смог сохранить токен в кэш: {e}")
+    return entry['access_token']
+
+
+def invalidate_token():
+    """Forget the cached token after the connector rejected it"""
+    try:
+        cache.delete(TOKEN_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не смог удалить токен из кэша: {e}")
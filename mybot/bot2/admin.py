@@ -1,3 +1,260 @@
-from django.contrib import admin
+import base64
+import json
+from datetime import date
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.db.models import Max, Min, Q, QuerySet
+from django.utils.functional import cached_property
+from bot1.db_router import reporting
+from . import classifier, tasks
+from .models import TeamsUser, UserResponse
+from .search import search_query
 
-# Register your models here.
+CURSOR_VAR = 'cursor'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the planner's row estimate instead of COUNT(*).
+
+    Small results (under ADMIN_EXACT_COUNT_THRESHOLD by estimate) are still
+    counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = None
+        try:
+            plan = json.loads(self.object_list.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except Exception:
+            pass
+        if estimate is None or estimate < settings.ADMIN_EXACT_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+class CalendarDatesQuerySet(QuerySet):
+    """
+    dates() built from the indexed Min/Max of the field.
+
+    The admin date hierarchy calls dates(), which is a DISTINCT over every
+    matching row; buckets between the first and last date are enough to
+    drill down, and Min/Max are answered from the index of each partition.
+    """
+
+    def dates(self, field_name, kind, order='ASC'):
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = bounds['first'], bounds['last']
+        if not first:
+            return []
+        if kind == 'year':
+            buckets = [date(year, 1, 1) for year in range(first.year, last.year + 1)]
+        elif kind == 'month':
+            buckets = []
+            month = date(first.year, first.month, 1)
+            while month <= last:
+                buckets.append(month)
+                month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        else:
+            buckets = [date.fromordinal(day) for day in range(first.toordinal(), last.toordinal() + 1)]
+        return buckets if order == 'ASC' else buckets[::-1]
+
+
+def encode_cursor(values):
+    # Full isoformat: DjangoJSONEncoder would cut datetimes to milliseconds
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, fields):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return [field.to_python(value) for field, value in zip(fields, values, strict=True)]
+    except Exception:
+        raise IncorrectLookupParameters(f'Invalid cursor: {cursor}')
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Change list paged by "rows after the last one shown" instead of OFFSET.
+
+    Used while the list is in the admin's keyset_ordering; sorting by a
+    column or asking for a page number falls back to regular pagination.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.keyset_active = ORDER_VAR not in request.GET and PAGE_VAR not in request.GET
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    @cached_property
+    def keyset_fields(self):
+        return [
+            (self.lookup_opts.get_field(name.lstrip('-')), name.startswith('-'))
+            for name in self.model_admin.keyset_ordering
+        ]
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # A cursor only makes sense for the exact list it was taken from
+        if not new_params or CURSOR_VAR not in new_params:
+            remove = [*(remove or []), CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_ordering(self, request, queryset):
+        if self.keyset_active:
+            return list(self.model_admin.keyset_ordering)
+        return super().get_ordering(request, queryset)
+
+    def _after_cursor(self, values):
+        """Rows that sort after the cursor row in keyset_ordering"""
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.keyset_fields, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field.attname}__{lookup}': value})
+            equal &= Q(**{field.attname: value})
+        return condition
+
+    def get_results(self, request):
+        if not self.keyset_active:
+            return super().get_results(request)
+
+        queryset = self.queryset
+        if self.cursor:
+            values = decode_cursor(self.cursor, [field for field, _ in self.keyset_fields])
+            queryset = queryset.filter(self._after_cursor(values))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[:self.list_per_page + 1])
+        if len(rows) > self.list_per_page:
+            last = rows[self.list_per_page - 1]
+            self.next_cursor = encode_cursor([getattr(last, field.attname) for field, _ in self.keyset_fields])
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = bool(self.cursor or self.next_cursor)
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR])
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Shared settings for admins over large tables"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/bot2/keyset_change_list.html'
+    list_per_page = 50
+    keyset_ordering = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        # Browsing is read-only: render inside the block so the lazy
+        # querysets are evaluated on the replica too
+        with reporting():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+def _queue_in_chunks(task, ids, *args):
+    chunk_size = settings.ADMIN_ACTION_CHUNK_SIZE
+    for start in range(0, len(ids), chunk_size):
+        task.delay(ids[start:start + chunk_size], *args)
+
+
+@admin.register(TeamsUser)
+class TeamsUserAdmin(ScalableAdmin):
+    list_display = ('user_id', 'name', 'email', 'tenant_id', 'is_active', 'engagement_tier', 'deactivation_reason', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('=user_id', 'name', 'email')
+    ordering = ('-created_at', 'user_id')
+    keyset_ordering = ('-created_at', 'user_id')
+    readonly_fields = ('delivery_failures', 'deactivated_at', 'deactivation_reason', 'created_at', 'updated_at')
+    actions = ('activate_users', 'deactivate_users', 'resend_question')
+
+    @admin.action(description='Activate selected users (in background)')
+    def activate_users(self, request, queryset):
+        ids = list(queryset.values_list('user_id', flat=True))
+        _queue_in_chunks(tasks.set_users_active, ids, True)
+        self.message_user(request, f'Queued activation of {len(ids)} users', messages.SUCCESS)
+
+    @admin.action(description='Deactivate selected users (in background)')
+    def deactivate_users(self, request, queryset):
+        ids = list(queryset.values_list('user_id', flat=True))
+        _queue_in_chunks(tasks.set_users_active, ids, False)
+        self.message_user(request, f'Queued deactivation of {len(ids)} users', messages.SUCCESS)
+
+    @admin.action(description='Resend the current question to selected users (in background)')
+    def resend_question(self, request, queryset):
+        ids = list(queryset.filter(is_active=True).values_list('user_id', flat=True))
+        _queue_in_chunks(tasks.resend_question, ids)
+        self.message_user(request, f'Queued question for {len(ids)} active users', messages.SUCCESS)
+
+
+class CategoryFilter(admin.SimpleListFilter):
+    """Fixed choices, so the filter does not scan the table for distinct values"""
+    title = 'category'
+    parameter_name = 'category'
+
+    def lookups(self, request, model_admin):
+        return [('-', 'unclassified')] + [(category, category) for category in classifier.CATEGORIES]
+
+    def queryset(self, request, queryset):
+        if self.value() == '-':
+            return queryset.filter(category='')
+        if self.value():
+            return queryset.filter(category=self.value())
+        return queryset
+
+
+@admin.register(UserResponse)
+class UserResponseAdmin(ScalableAdmin):
+    list_display = ('user', 'question_date', 'question_time', 'category', 'short_text', 'response_time')
+    list_select_related = ('user',)
+    list_filter = (CategoryFilter,)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'question_date'
+    search_fields = ('response_text',)
+    search_help_text = 'Full-text search (Russian and English word forms)'
+    ordering = ('-question_date', '-id')
+    keyset_ordering = ('-question_date', '-id')
+    readonly_fields = ('response_time',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).defer('search_vector')
+        return CalendarDatesQuerySet(model=queryset.model, query=queryset.query, using=queryset._db)
+
+    def get_search_results(self, request, queryset, search_term):
+        # The GIN index instead of icontains over every row
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search_vector=search_query(search_term)), False
+
+    @admin.display(description='response', ordering='response_text')
+    def short_text(self, obj):
+        return obj.response_text[:80]
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import time as time_module
+from collections import defaultdict
+from datetime import timedelta
+from bot1.db_router import reporting
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, FloatField, Q, Sum, Window
+from django.db.models.functions import Cast, NullIf, Rank
+from .models import DailyUserStats, UserResponse
+from .slots import get_kazakhstan_time
+
+logger = logging.getLogger(__name__)
+
+
+def _rate(answered, sent):
+    """SQL expression for answered / sent (NULL when nothing was sent)"""
+    return Cast(answered, FloatField()) / NullIf(Cast(sent, FloatField()), 0.0)
+
+
+def _since(days):
+    return get_kazakhstan_time().date() - timedelta(days=days - 1)
+
+
+def _stats(days, tenant_id=None):
+    qs = DailyUserStats.objects.filter(date__gte=_since(days))
+    if tenant_id:
+        qs = qs.filter(user__tenant_id=tenant_id)
+    return qs
+
+
+def tenant_rates(days, tenant_id=None):
+    """Response rate per tenant, from the daily stats rows"""
+    rows = (
+        _stats(days, tenant_id)
+        .values(tenant=F('user__tenant_id'))
+        .annotate(
+            users=Count('user', distinct=True),
+            sent=Sum('questions_sent'),
+            answered_total=Sum('answered'),
+            rate=_rate(Sum('answered'), Sum('questions_sent')),
+        )
+        .order_by('tenant')
+    )
+    return list(rows)
+
+
+def slot_rates(days, tenant_id=None):
+    """Response rate per question slot (the only report that needs UserResponse rows)"""
+    qs = UserResponse.objects.filter(question_date__gte=_since(days))
+    if tenant_id:
+        qs = qs.filter(user__tenant_id=tenant_id)
+    answered = Count('id', filter=~Q(response_text=''))
+    rows = (
+        qs.values('question_time')
+        .annotate(sent=Count('id'), answered=answered, rate=_rate(answered, Count('id')))
+        .order_by('question_time')
+    )
+    return [
+        {**row, 'question_time': row['question_time'].strftime('%H:%M')}
+        for row in rows
+    ]
+
+
+def category_rates(days, tenant_id=None):
+    """Answers per activity category and tenant, with each category's share of the tenant's answers"""
+    qs = (
+        UserResponse.objects
+        .filter(question_date__gte=_since(days))
+        .exclude(response_text='')
+        .exclude(category='')
+    )
+    if tenant_id:
+        qs = qs.filter(user__tenant_id=tenant_id)
+    rows = list(
+        qs.values('category', tenant=F('user__tenant_id'))
+        .annotate(responses=Count('id'), users=Count('user', distinct=True))
+        .order_by('tenant', '-responses', 'category')
+    )
+    # At most a few rows per tenant, so the shares are cheap to finish here
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row['tenant']] += row['responses']
+    return [{**row, 'share': row['responses'] / totals[row['tenant']]} for row in rows]
+
+
+def participation(days, tenant_id=None):
+    """Per day: users asked, users who answered at least once, and the response rate"""
+    rows = (
+        _stats(days, tenant_id)
+        .values('date')
+        .annotate(
+            users_asked=Count('user', filter=Q(questions_sent__gt=0)),
+            users_answered=Count('user', filter=Q(answered__gt=0)),
+            sent=Sum('questions_sent'),
+            answered_total=Sum('answered'),
+            rate=_rate(Sum('answered'), Sum('questions_sent')),
+        )
+        .order_by('date')
+    )
+    return [{**row, 'date': row['date'].isoformat()} for row in rows]
+
+
+def non_responders(days, tenant_id=None, limit=20):
+    """Users with the most unanswered questions, ranked within their tenant"""
+    rows = (
+        _stats(days, tenant_id)
+        .values('user_id', name=F('user__name'), email=F('user__email'), tenant=F('user__tenant_id'))
+        .annotate(
+            sent=Sum('questions_sent'),
+            answered_total=Sum('answered'),
+            missed=Sum('questions_sent') - Sum('answered'),
+            rate=_rate(Sum('answered'), Sum('questions_sent')),
+        )
+        # Annotated separately so the window is not added to GROUP BY
+        .annotate(rank_in_tenant=Window(Rank(), partition_by=F('tenant'), order_by=F('missed').desc()))
+        .filter(sent__gt=0)
+        .order_by('-missed', 'user_id')[:limit]
+    )
+    return list(rows)
+
+
+REPORTS = {
+    'tenants': tenant_rates,
+    'slots': slot_rates,
+    'categories': category_rates,
+    'participation': participation,
+    'non_responders': non_responders,
+}
+
+
+def cached_report(name, **params):
+    """
+    Run a report, reusing the result computed in the current time bucket.
+
+    Buckets are ANALYTICS_CACHE_SECONDS wide, so dashboards refreshing within
+    a bucket get the same cached answer without touching the database.
+    """
+    bucket_seconds = settings.ANALYTICS_CACHE_SECONDS
+    bucket = int(time_module.time() // bucket_seconds)
+    params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    key = f'analytics:{name}:{params_key}:{bucket}'
+
+    try:
+        result = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Кэш аналитики недоступен: {e}")
+        result = None
+
+    if result is None:
+        with reporting():
+            result = {
+                'report': name,
+                'params': params,
+                'bucket_start': bucket * bucket_seconds,
+                'results': REPORTS[name](**params),
+            }
+        try:
+            cache.set(key, result, bucket_seconds)
+        except Exception as e:
+            logger.warning(f"Не смог сохранить отчет в кэш: {e}")
+    return result
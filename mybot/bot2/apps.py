@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class Bot2Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot2'
+
+    def ready(self):
+        # Connects the Celery signal handlers
+        from . import telemetry  # noqa: F401
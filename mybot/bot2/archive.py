@@ -0,0 +1,184 @@
+import gzip
+import json
+import logging
+import os
+import time as time_module
+from datetime import date, time
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+from . import partitions
+from .models import UserResponse
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ['id', 'user_id', 'question_date', 'question_time', 'response_text', 'response_time', 'category']
+
+
+def archive_path(day):
+    """Compressed JSONL file holding the archived rows of one question date"""
+    return (
+        Path(settings.RESPONSE_ARCHIVE_DIR)
+        / f'{day.year:04d}' / f'{day.month:02d}'
+        / f'responses-{day.isoformat()}.jsonl.gz'
+    )
+
+
+class ArchiveWriter:
+    """
+    Appends rows to per-date archive files, keeping one file open at a time.
+
+    Rows already in a date's file are skipped, so a run repeated after a
+    crash between writing and deleting does not archive them twice.
+    """
+
+    def __init__(self):
+        self._day = None
+        self._file = None
+        self._archived = set()
+
+    def write(self, rows):
+        for row in rows:
+            if row['question_date'] != self._day:
+                self._open(row['question_date'])
+            if row['id'] in self._archived:
+                continue
+            self._file.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+        if self._file:
+            self._file.flush()
+
+    def _open(self, day):
+        self.close()
+        path = archive_path(day)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._archived = existing_ids(path) if path.exists() else set()
+        # Appending adds a new gzip member, which readers handle transparently
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._day = day
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._day = None
+        self._archived = set()
+
+
+def existing_ids(path):
+    """
+    Ids already archived in path.
+
+    A file cut short by a crash mid-write is rewritten without its broken
+    tail (to a temporary file, then renamed over it), so it can be
+    appended to again.
+    """
+    ids, lines = set(), []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+            for line in archive_file:
+                if line.strip():
+                    ids.add(json.loads(line)['id'])
+                    lines.append(line)
+        return ids
+    except (EOFError, gzip.BadGzipFile, ValueError, KeyError) as e:
+        logger.warning(f"Archive {path} is damaged ({e}), keeping its {len(lines)} complete rows")
+
+    # A cut-off line never parses, so every line kept is a whole row
+    tmp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as repaired:
+        repaired.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+    os.replace(tmp_path, path)
+    return ids
+
+
+def stream_to_archive(queryset, chunk_size=None):
+    """
+    Archive the queryset's rows in (question_date, id) order.
+
+    Rows are read through a server-side cursor and written chunk by chunk;
+    the (id, question_date) keys of each chunk are yielded once the chunk is
+    safely on disk.
+    """
+    chunk_size = chunk_size or settings.RESPONSE_ARCHIVE_CHUNK_SIZE
+    rows = (
+        queryset
+        .order_by('question_date', 'id')
+        .values(*ARCHIVE_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    writer = ArchiveWriter()
+    try:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                writer.write(chunk)
+                yield [(r['id'], r['question_date']) for r in chunk]
+                chunk = []
+        if chunk:
+            writer.write(chunk)
+            yield [(r['id'], r['question_date']) for r in chunk]
+    finally:
+        writer.close()
+
+
+def delete_in_batches(keys, batch_size=None, pause=None):
+    """
+    Delete rows by (id, question_date) in short transactions with a pause in between.
+
+    The date range of each batch lets Postgres prune the partitions the
+    rows cannot be in.
+    """
+    batch_size = batch_size or settings.RESPONSE_DELETE_BATCH_SIZE
+    pause = settings.RESPONSE_DELETE_PAUSE_SECONDS if pause is None else pause
+    deleted = 0
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        dates = [question_date for _, question_date in batch]
+        deleted += UserResponse.objects.filter(
+            id__in=[response_id for response_id, _ in batch],
+            question_date__range=(min(dates), max(dates)),
+        ).delete()[0]
+        if pause:
+            time_module.sleep(pause)
+    return deleted
+
+
+def archive_expired_responses(cutoff):
+    """
+    Archive every response older than cutoff, then remove it.
+
+    Partitions that are entirely expired are archived and dropped whole; the
+    rest (the month the cutoff falls in, and the default partition) is
+    deleted in bounded batches.
+    """
+    archived = 0
+    for month, name in partitions.expired_partitions(cutoff):
+        month_rows = UserResponse.objects.filter(
+            question_date__gte=month,
+            question_date__lt=partitions.add_months(month, 1),
+        )
+        for keys in stream_to_archive(month_rows):
+            archived += len(keys)
+        partitions.drop_partition(name)
+
+    for keys in stream_to_archive(UserResponse.objects.filter(question_date__lt=cutoff)):
+        archived += len(keys)
+        delete_in_batches(keys)
+
+    logger.info(f"Archived {archived} responses older than {cutoff}")
+    return archived
+
+
+def read_archive(path):
+    """Yield UserResponse instances from an archive file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as archive_file:
+        for line in archive_file:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            row['question_date'] = date.fromisoformat(row['question_date'])
+            row['question_time'] = time.fromisoformat(row['question_time'])
+            row['response_time'] = parse_datetime(row['response_time'])
+            yield UserResponse(**row)
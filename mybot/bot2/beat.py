@@ -0,0 +1,121 @@
+"""
+Celery beat scheduler that can run as several hot-standby replicas.
+
+Every replica runs LeaderElectedScheduler; only the one holding the Redis
+leader lock dispatches. The leader renews the lock on every tick, a
+standby tries to take it every BEAT_LEADER_RETRY_SECONDS, so a dead leader
+is replaced within BEAT_LEADER_TTL_SECONDS plus one retry.
+
+A leader that stalls past its lock (a long pause, a network split) could
+still wake up mid-tick next to the new one, so every dispatch also claims
+a per-entry key first: a second dispatch of the same entry within its
+dedupe window is dropped instead of sent.
+"""
+import logging
+import os
+import socket
+import uuid
+from celery import schedules
+from django.conf import settings
+from django_celery_beat.schedulers import DatabaseScheduler
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY = 'hourlybot:beat:leader'
+DISPATCH_KEY = 'hourlybot:beat:dispatch:{name}'
+
+# KEYS[1] lock, ARGV[1] owner, ARGV[2] ttl in ms
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderElectedScheduler(DatabaseScheduler):
+    """DatabaseScheduler that only dispatches while it holds the leader lock"""
+
+    def __init__(self, *args, **kwargs):
+        self.instance_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.is_leader = False
+        super().__init__(*args, **kwargs)
+        # last_run_at is written after every dispatch, so a new leader
+        # continues from the last sent run instead of a minutes-old copy
+        self.sync_every_tasks = 1
+
+    @property
+    def lock_ttl_ms(self):
+        return int(settings.BEAT_LEADER_TTL_SECONDS * 1000)
+
+    def hold_leadership(self):
+        """Take or renew the leader lock; False means do not dispatch"""
+        try:
+            client = get_redis()
+            if self.is_leader:
+                held = bool(client.eval(RENEW_SCRIPT, 1, LEADER_KEY, self.instance_id, self.lock_ttl_ms))
+            else:
+                held = bool(client.set(LEADER_KEY, self.instance_id, nx=True, px=self.lock_ttl_ms))
+        except Exception as e:
+            logger.error(f"Beat leader lock unavailable: {e}")
+            held = False
+
+        if held and not self.is_leader:
+            logger.info(f"Beat {self.instance_id} is now the leader")
+            # Re-read every entry (and its last_run_at) from the database:
+            # the previous leader kept dispatching while this copy sat idle
+            self._initial_read = True
+            self._heap = None
+        elif self.is_leader and not held:
+            logger.warning(f"Beat {self.instance_id} lost leadership")
+            self._heap = None
+        self.is_leader = held
+        return held
+
+    def tick(self, *args, **kwargs):
+        if not self.hold_leadership():
+            return settings.BEAT_LEADER_RETRY_SECONDS
+        # Wake up often enough to renew the lock well before it expires
+        return min(super().tick(*args, **kwargs), settings.BEAT_LEADER_TTL_SECONDS / 3)
+
+    def dedupe_window(self, entry):
+        """Seconds during which a second dispatch of entry is a duplicate"""
+        schedule = entry.schedule
+        if isinstance(schedule, schedules.schedule):
+            return max(1, schedule.run_every.total_seconds() / 2)
+        # crontab and the rest fire at most once a minute
+        return settings.BEAT_DISPATCH_DEDUPE_SECONDS
+
+    def apply_async(self, entry, producer=None, advance=True, **kwargs):
+        try:
+            claimed = get_redis().set(
+                DISPATCH_KEY.format(name=entry.name), self.instance_id,
+                nx=True, px=int(self.dedupe_window(entry) * 1000),
+            )
+        except Exception as e:
+            # Without the claim a send could be a duplicate; skipping one
+            # run is the lesser harm
+            logger.error(f"Beat skipped {entry.name}, dispatch key unavailable: {e}")
+            return None
+        if not claimed:
+            logger.warning(f"Beat skipped {entry.name}: already dispatched by another instance")
+            return None
+        return super().apply_async(entry, producer=producer, advance=advance, **kwargs)
+
+    def close(self):
+        super().close()
+        if not self.is_leader:
+            return
+        # Hand over right away instead of after the lock expires
+        try:
+            get_redis().eval(RELEASE_SCRIPT, 1, LEADER_KEY, self.instance_id)
+        except Exception as e:
+            logger.warning(f"Could not release the beat leader lock: {e}")
+        self.is_leader = False
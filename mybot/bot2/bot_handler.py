@@ -1,23 +1,34 @@
 import logging
 import json
 from datetime import datetime, time
+from django.conf import settings
 from django.utils import timezone
 from asgiref.sync import sync_to_async
 from botbuilder.core import ActivityHandler, TurnContext, MessageFactory
 from botbuilder.schema import Activity, ActivityTypes, ChannelAccount
+from bot1.db_router import pin_to_primary
+from . import delivery
+from .commands import READ_COMMANDS, invalidate_user_commands, run_read_command, search_command
 from .models import TeamsUser, UserResponse
+from .reply_buffer import buffer_reply
+from .slots import resolve_open_slot
+from .user_context import UserContext, serialize_conversation_reference
 import pytz
 
 logger = logging.getLogger(__name__)
 
-def get_kazakhstan_time():
-    """Get current time in Kazakhstan timezone"""
-    kazakhstan_tz = pytz.timezone('Asia/Almaty')
-    return timezone.now().astimezone(kazakhstan_tz)
-
 class TeamsBot(ActivityHandler):
     """Simple Teams bot for hourly check-ins"""
     
+    # Commands that change the subscription, mapped to their handlers
+    WRITE_COMMANDS = {
+        'start': '_handle_start_command',
+        'stop': '_handle_stop_command',
+    }
+    
+    # Slash form only: an answer may well start with the word "search"
+    SEARCH_COMMAND = '/search'
+    
     def __init__(self):
         super().__init__()
     
@@ -30,48 +41,42 @@ class TeamsBot(ActivityHandler):
             
             # Store conversation reference in database for proactive messaging
             conversation_ref = turn_context.activity.get_conversation_reference()
-            conversation_ref_json = json.dumps(conversation_ref.serialize())
+            conversation_ref_json = serialize_conversation_reference(conversation_ref)
             
-            # Update or create user with conversation reference
-            user, created = await sync_to_async(TeamsUser.objects.get_or_create)(
-                user_id=user_id,
-                defaults={
-                    'name': user_name,
-                    'conversation_reference': conversation_ref_json
-                }
+            # Load the user once per turn; only changed fields are written back
+            user_ctx = await sync_to_async(UserContext.load)(
+                user_id,
+                turn_context.activity.from_property.name,
+                conversation_ref_json,
+                tenant_id=getattr(turn_context.activity.conversation, 'tenant_id', None)
             )
             
-            if not created:
-                # Update existing user's conversation reference
-                user.conversation_reference = conversation_ref_json
-                await sync_to_async(user.save)()
-            
             logger.info(f"Received message from {user_name} ({user_id}): {message_text}")
             
-            if message_text == "start":
-                await self._handle_start_command(turn_context, user_id, user_name)
-            elif message_text == "stop":
-                await self._handle_stop_command(turn_context, user_id)
+            command, _, arguments = message_text.partition(' ')
+            if message_text in self.WRITE_COMMANDS:
+                handler = getattr(self, self.WRITE_COMMANDS[message_text])
+                await handler(turn_context, user_ctx)
+                await sync_to_async(self._after_write)(user_id)
+            elif message_text in READ_COMMANDS:
+                await self._handle_read_command(turn_context, user_ctx, message_text)
+            elif command == self.SEARCH_COMMAND:
+                await self._handle_search_command(turn_context, user_ctx, arguments.strip())
             else:
-                await self._handle_regular_message(turn_context, user_id, message_text)
+                await self._handle_regular_message(turn_context, user_ctx, message_text)
                 
         except Exception as e:
             logger.error(f"Ошибка управление сообщением: {e}")
             await turn_context.send_activity("Извините, я наткнулся на проблему. Пожалуйста, попробуйте позже.")
     
-    async def _handle_start_command(self, turn_context: TurnContext, user_id: str, user_name: str):
+    async def _handle_start_command(self, turn_context: TurnContext, user_ctx: UserContext):
         """Handle the 'start' command"""
         try:
-            # Get or create user
-            user, created = await sync_to_async(TeamsUser.objects.get_or_create)(
-                user_id=user_id,
-                defaults={
-                    'name': user_name,
-                    'is_active': True
-                }
-            )
+            user = user_ctx.user
+            user_id = user.user_id
+            user_name = user.name
             
-            if created:
+            if user_ctx.created:
                 await turn_context.send_activity(
                     f"Доброго времени суток, {user_name}! 🎉\n\n"
                     "Я твой ежечасный отчет. Я буду спрашивать вас что вы делаете в:\n"
@@ -91,6 +96,7 @@ class TeamsBot(ActivityHandler):
                     "• 4:30 PM\n"
                     "• 5:00 PM\n\n"
                     "Просто отвечай на мои вопросы когда они появляются! 📝\n\n"
+                    "Команды: 'status', 'today', 'week', 'summary', '/search <слова>'.\n\n"
                     "Напишите 'stop' чтобы отписаться от моих вопросов."
                 )
                 logger.info(f"New user registered: {user_name} ({user_id})")
@@ -101,8 +107,7 @@ class TeamsBot(ActivityHandler):
                         "Напишите 'stop' чтобы отписаться."
                     )
                 else:
-                    user.is_active = True
-                    await sync_to_async(user.save)()
+                    await sync_to_async(user_ctx.reactivate)()
                     await turn_context.send_activity(
                         f"Добро пожаловать {user_name}! Вы теперь подписаны на мои ежечасные вопросы снова. 📋\n\n"
                         "Напиши 'stop' чтобы отписаться."
@@ -113,14 +118,14 @@ class TeamsBot(ActivityHandler):
             logger.error(f"Error in start command: {e}")
             await turn_context.send_activity("Извините, я не смог обработать вашу команду. Пожалуйста, попробуйте еще раз.")
     
-    async def _handle_stop_command(self, turn_context: TurnContext, user_id: str):
+    async def _handle_stop_command(self, turn_context: TurnContext, user_ctx: UserContext):
         """Handle the 'stop' command"""
         try:
-            user = await sync_to_async(TeamsUser.objects.filter(user_id=user_id).first)()
+            user = user_ctx.user
+            user_id = user.user_id
             
-            if user and user.is_active:
-                user.is_active = False
-                await sync_to_async(user.save)()
+            if user.is_active:
+                await sync_to_async(user_ctx.unsubscribe)(delivery.USER_STOP)
                 await turn_context.send_activity(
                     f"До свидания {user.name}! 👋\n\n"
                     "Вы отписаны от моих ежечасных вопросов. Я буду скучать :(\n\n"
@@ -128,6 +133,9 @@ class TeamsBot(ActivityHandler):
                 )
                 logger.info(f"User unsubscribed: {user.name} ({user_id})")
             else:
+                if user_ctx.deactivated_by_bot:
+                    # Otherwise the next message would resubscribe them
+                    await sync_to_async(user_ctx.unsubscribe)(delivery.USER_STOP)
                 await turn_context.send_activity(
                     "Вы не подписаны на мои ежечасные вопросы.\n\n"
                     "Напишите 'start' чтобы снова подписаться."
@@ -137,10 +145,35 @@ class TeamsBot(ActivityHandler):
             logger.error(f"Error in stop command: {e}")
             await turn_context.send_activity("Извините, я не смог обработать вашу команду. Пожалуйста, попробуйте еще раз.")
     
-    async def _handle_regular_message(self, turn_context: TurnContext, user_id: str, message_text: str):
+    async def _handle_read_command(self, turn_context: TurnContext, user_ctx: UserContext, command: str):
+        """Handle read-only commands (status, today, week, summary)"""
+        try:
+            text = await sync_to_async(run_read_command)(command, user_ctx.user)
+            await turn_context.send_activity(text)
+        except Exception as e:
+            logger.error(f"Error in {command} command: {e}")
+            await turn_context.send_activity("Извините, я не смог обработать вашу команду. Пожалуйста, попробуйте еще раз.")
+    
+    async def _handle_search_command(self, turn_context: TurnContext, user_ctx: UserContext, terms: str):
+        """Handle '/search <terms>' (not cached: the terms vary)"""
+        try:
+            text = await sync_to_async(search_command)(user_ctx.user, terms)
+            await turn_context.send_activity(text)
+        except Exception as e:
+            logger.error(f"Error in search command: {e}")
+            await turn_context.send_activity("Извините, я не смог выполнить поиск. Пожалуйста, попробуйте еще раз.")
+    
+    async def _handle_regular_message(self, turn_context: TurnContext, user_ctx: UserContext, message_text: str):
         """Handle regular messages (responses to questions)"""
         try:
-            user = await sync_to_async(TeamsUser.objects.filter(user_id=user_id, is_active=True).first)()
+            if user_ctx.deactivated_by_bot:
+                # Deactivated by the bot because messages did not arrive; the
+                # user just wrote with a fresh conversation reference, so
+                # subscribe them again
+                await sync_to_async(user_ctx.reactivate)()
+                await sync_to_async(invalidate_user_commands)(user_ctx.user_id)
+                logger.info(f"User reactivated after delivery failures: {user_ctx.user.name} ({user_ctx.user_id})")
+            user = user_ctx.user if user_ctx.user.is_active else None
             
             if not user:
                 await turn_context.send_activity(
@@ -149,56 +182,31 @@ class TeamsBot(ActivityHandler):
                 )
                 return
             
-            # Check if this is a response to today's question - USE KAZAKHSTAN TIME
-            today = get_kazakhstan_time().date()
-            current_time = get_kazakhstan_time().time()
-            
-            # Define question times (in Kazakhstan time)
-            question_times = [time(9, 0), time(9, 30), time(10, 0), time(10, 30), 
-                            time(10, 45), time(10, 50), time(11, 0), time(11, 30), 
-                            time(12, 0), time(12, 30), time(14, 0), time(14, 30), 
-                            time(15, 0), time(15, 30), time(16, 0), time(16, 30), 
-                            time(17, 0)]
+            # One Redis lookup resolves the slot; Postgres is only hit for the upsert
+            result = await sync_to_async(self._record_answer)(user.user_id, message_text)
             
-            # Find the most recent question time that has passed
-            target_question_time = None
-            for q_time in sorted(question_times, reverse=True):  # Check from latest to earliest
-                if current_time >= q_time:
-                    target_question_time = q_time
-                    break
-            
-            if target_question_time:
-                # Check if we already have a response for this time today
-                existing_response = await sync_to_async(
-                    UserResponse.objects.filter(
-                        user=user,
-                        question_time=target_question_time,
-                        question_date=today
-                    ).first
-                )()
+            if result:
+                target_question_time, created = result
                 
-                if existing_response:
-                    # Update existing response
-                    existing_response.response_text = message_text
-                    await sync_to_async(existing_response.save)()
+                if created is None:
+                    # Buffered for write-behind: not in the database yet
                     await turn_context.send_activity(
-                        f"✅ Обновил ваш ответ за {target_question_time.strftime('%I:%M %p')}:\n"
+                        f"✅ Принял ваш ответ за {target_question_time.strftime('%I:%M %p')}:\n"
                         f"\"{message_text}\"\n\n"
                         "Спасибо за ответ! :)"
                     )
-                else:
-                    # Create new response
-                    await sync_to_async(UserResponse.objects.create)(
-                        user=user,
-                        question_time=target_question_time,
-                        question_date=today,
-                        response_text=message_text
-                    )
+                elif created:
                     await turn_context.send_activity(
                         f"✅ Записал ваш ответ за {target_question_time.strftime('%I:%M %p')}:\n"
                         f"\"{message_text}\"\n\n"
                         "Спасибо за ответ! :) "
                     )
+                else:
+                    await turn_context.send_activity(
+                        f"✅ Обновил ваш ответ за {target_question_time.strftime('%I:%M %p')}:\n"
+                        f"\"{message_text}\"\n\n"
+                        "Спасибо за ответ! :)"
+                    )
             else:
                 await turn_context.send_activity(
                     "Спасибо за ответ! Я буду спрашивать вас о вашей активности в определенные часы.\n\n"
@@ -209,6 +217,32 @@ class TeamsBot(ActivityHandler):
             logger.error(f"Error handling regular message: {e}")
             await turn_context.send_activity("Извините, я не смог сохранить ваш ответ. Пожалуйста, попробуйте еще раз.")
     
+    def _record_answer(self, user_id: str, message_text: str):
+        """
+        Store the reply against the user's open slot, returns (slot time, created) or None.
+
+        created is None for a buffered reply: whether it is the slot's first
+        answer is only known once flush_reply_buffers has written it.
+        """
+        slot = resolve_open_slot(user_id)
+        if slot is None:
+            return None
+        question_date, question_time = slot
+        if settings.RESPONSE_WRITE_BEHIND and buffer_reply(user_id, question_date, question_time, message_text):
+            # Flushed to Postgres by flush_reply_buffers once the burst is over,
+            # which invalidates again; until then reads are not served from
+            # an answer cached before this reply
+            invalidate_user_commands(user_id)
+            return question_time, None
+        created = UserResponse.record(user_id, question_date, question_time, message_text)
+        self._after_write(user_id)
+        return question_time, created
+    
+    def _after_write(self, user_id: str):
+        """Keep the user's next reads fresh: drop cached command answers and pin reads to the primary"""
+        invalidate_user_commands(user_id)
+        pin_to_primary(user_id)
+    
     async def on_members_added_activity(self, members_added: list[ChannelAccount], turn_context: TurnContext):
         """Handle when users are added to the conversation"""
         for member in members_added:
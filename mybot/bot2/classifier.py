@@ -0,0 +1,253 @@
+"""
+Local activity classifier for responses.
+
+Each answer is first matched against keyword rules. If no rule fires, a
+small multinomial naive Bayes model trained on SEED_EXAMPLES decides, and
+answers it is unsure about become 'other'. Everything runs in-process with
+plain dicts, fast enough to tag several thousand answers a second, and
+needs no network.
+"""
+import hashlib
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from django.conf import settings
+from .models import UserResponse
+
+logger = logging.getLogger(__name__)
+
+OTHER = 'other'
+
+CATEGORIES = [
+    'meeting', 'coding', 'review', 'testing', 'support',
+    'docs', 'planning', 'learning', 'break', OTHER,
+]
+
+# What users see in their summaries
+LABELS = {
+    'meeting': 'Встречи',
+    'coding': 'Разработка',
+    'review': 'Ревью',
+    'testing': 'Тестирование',
+    'support': 'Поддержка',
+    'docs': 'Документация',
+    'planning': 'Планирование',
+    'learning': 'Обучение',
+    'break': 'Перерывы',
+    OTHER: 'Другое',
+}
+
+# Word prefixes per category; Russian stems cover the inflected forms
+RULES = [
+    ('break', r'обед|перерыв|перекус|кофе|отдых|отош[её]л|lunch|break\b|coffee|rest\b'),
+    ('meeting', r'созвон|встреч|митинг|совещан|планерк|стендап|дейли|звон|meeting|call\b|sync|standup|stand-up|daily|1:1'),
+    ('review', r'ревью|ревьюю|код.?ревью|смотрю pr|review|pull request|pr\b|merge request|mr\b'),
+    ('testing', r'тест|тестир|автотест|qa\b|test|testing|regression'),
+    ('support', r'поддержк|инцидент|обращени|тикет|заявк|пользовател|клиент|support|incident|ticket|helpdesk|customer'),
+    ('docs', r'документ|доку|описани|инструкц|отч[её]т|docs|documentation|readme|wiki|confluence|report'),
+    ('planning', r'планир|оценк|задач[аи] на|бэклог|спринт|декомпоз|planning|estimate|backlog|sprint|grooming|roadmap'),
+    ('learning', r'изуча|уч[уи]сь|обучени|курс|читаю статью|вебинар|learning|course|studying|tutorial|webinar'),
+    ('coding', r'пишу код|код|кодинг|разработ|программ|фикс|баг|рефактор|деплой|релиз|фич|coding|code|develop|implement|fix|bug|refactor|deploy|release|feature'),
+]
+COMPILED_RULES = [(category, re.compile(rf'\b(?:{pattern})', re.IGNORECASE)) for category, pattern in RULES]
+
+# Short labelled answers the fallback model is trained on
+SEED_EXAMPLES = {
+    'meeting': [
+        'обсуждаем с командой', 'разговор с руководителем', 'общаемся по проекту', 'синхронизация с коллегами',
+        'talking to the team', 'discussion with manager', 'weekly sync with product',
+    ],
+    'coding': [
+        'делаю задачу', 'пишу сервис', 'верстаю страницу', 'настраиваю api', 'миграции базы данных',
+        'working on the backend', 'writing the api endpoint', 'building the new screen', 'database migration',
+    ],
+    'review': [
+        'смотрю изменения коллег', 'проверяю мерж', 'комментирую изменения',
+        'looking at changes from colleagues', 'approving changes',
+    ],
+    'testing': [
+        'проверяю сборку', 'прогоняю сценарии', 'воспроизвожу ошибку',
+        'checking the build', 'running scenarios', 'reproducing the issue',
+    ],
+    'support': [
+        'отвечаю на вопросы', 'помогаю коллеге', 'разбираю проблему у клиента', 'консультирую',
+        'answering questions', 'helping a colleague', 'handling user issue',
+    ],
+    'docs': [
+        'пишу текст', 'оформляю страницу', 'заполняю таблицу', 'составляю письмо',
+        'writing notes', 'updating the spec', 'filling in the spreadsheet', 'writing an email',
+    ],
+    'planning': [
+        'расставляю приоритеты', 'составляю план', 'разбираю задачи', 'думаю над архитектурой',
+        'prioritizing tasks', 'making a plan', 'thinking about architecture',
+    ],
+    'learning': [
+        'читаю книгу', 'смотрю лекцию', 'разбираюсь в новой технологии',
+        'reading a book', 'watching a lecture', 'exploring new technology',
+    ],
+    'break': [
+        'ем', 'пью чай', 'иду домой', 'в дороге', 'отдыхаю', 'прогулка',
+        'eating', 'having tea', 'commuting', 'walking', 'away from keyboard',
+    ],
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STEM_LENGTH = 5
+
+
+def tokenize(text):
+    """Lowercase words plus a crude prefix stem for long (inflected) words"""
+    features = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if len(word) < 2:
+            continue
+        features.append(word)
+        if len(word) > STEM_LENGTH:
+            features.append(word[:STEM_LENGTH] + '~')
+    return features
+
+
+def rule_category(text):
+    """Category whose rules match most often, or None"""
+    hits = Counter()
+    for category, pattern in COMPILED_RULES:
+        matched = len(pattern.findall(text))
+        if matched:
+            hits[category] += matched
+    if not hits:
+        return None
+    # Ties go to the category listed first in RULES
+    best = max(hits.values())
+    return next(category for category, _ in RULES if hits.get(category) == best)
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over bag-of-words features, with Laplace smoothing"""
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.log_prior = {}
+        self.log_likelihood = {}
+        self.log_unseen = {}
+
+    def fit(self, examples):
+        """examples: {category: [text, ...]}"""
+        counts = {category: Counter() for category in examples}
+        for category, texts in examples.items():
+            for text in texts:
+                counts[category].update(tokenize(text))
+        vocabulary = set().union(*counts.values())
+        total_docs = sum(len(texts) for texts in examples.values())
+
+        for category, texts in examples.items():
+            denominator = sum(counts[category].values()) + self.alpha * len(vocabulary)
+            self.log_prior[category] = math.log(len(texts) / total_docs)
+            self.log_likelihood[category] = {
+                token: math.log((count + self.alpha) / denominator)
+                for token, count in counts[category].items()
+            }
+            self.log_unseen[category] = math.log(self.alpha / denominator)
+        self.vocabulary = vocabulary
+        return self
+
+    def predict(self, text):
+        """(category, posterior probability), or (None, 0.0) when no feature is known"""
+        features = [token for token in tokenize(text) if token in self.vocabulary]
+        if not features:
+            return None, 0.0
+        scores = {}
+        for category, prior in self.log_prior.items():
+            likelihood = self.log_likelihood[category]
+            unseen = self.log_unseen[category]
+            scores[category] = prior + sum(likelihood.get(token, unseen) for token in features)
+        best = max(scores, key=scores.get)
+        # Softmax of the winning score, computed stably
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+
+_model = None
+
+
+def get_model():
+    """Fallback model, trained once per process"""
+    global _model
+    if _model is None:
+        _model = NaiveBayes().fit(SEED_EXAMPLES)
+    return _model
+
+
+def classify(text, min_confidence=None):
+    """Category for one answer"""
+    if min_confidence is None:
+        min_confidence = settings.CLASSIFIER_MIN_CONFIDENCE
+    category = rule_category(text)
+    if category:
+        return category
+    category, probability = get_model().predict(text)
+    if category is None or probability < min_confidence:
+        return OTHER
+    return category
+
+
+def text_digest(text):
+    """Matches Postgres md5(response_text), used to detect edits during a run"""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def classify_pending(batch_size=None, since=None):
+    """
+    Tag every answered, unclassified response, batch by batch.
+
+    Pending rows are read through the partial index in (question_date, id)
+    order and written back with one UPDATE per batch. Returns how many rows
+    were tagged.
+    """
+    batch_size = batch_size or settings.CLASSIFIER_BATCH_SIZE
+    pending = UserResponse.objects.filter(category='').exclude(response_text='')
+    if since:
+        pending = pending.filter(question_date__gte=since)
+
+    tagged = 0
+    last_key = None
+    while True:
+        qs = pending
+        if last_key:
+            # Keyset paging, so rows skipped because they were edited meanwhile are not read again
+            last_date, last_id = last_key
+            qs = qs.filter(question_date__gte=last_date).exclude(question_date=last_date, id__lte=last_id)
+        batch = list(
+            qs.order_by('question_date', 'id')
+            .values_list('id', 'question_date', 'response_text')[:batch_size]
+        )
+        if not batch:
+            break
+
+        updates = [
+            (response_id, question_date, text_digest(text), classify(text))
+            for response_id, question_date, text in batch
+        ]
+        tagged += UserResponse.set_categories(updates)
+        last_id, last_date, _ = batch[-1]
+        last_key = last_date, last_id
+        if len(batch) < batch_size:
+            break
+
+    if tagged:
+        logger.info(f"Classified {tagged} responses")
+    return tagged
+
+
+def label(category):
+    """Russian name of a category"""
+    return LABELS.get(category, category)
+
+
+def category_breakdown(responses):
+    """Ordered [(category, count)] for a list of UserResponse objects"""
+    counts = defaultdict(int)
+    for response in responses:
+        if response.response_text:
+            counts[response.category or OTHER] += 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,171 @@
+import logging
+from datetime import timedelta
+from bot1.db_router import reporting
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from . import classifier
+from .models import DailyUserStats, UserResponse
+from .search import search_responses
+from .slots import get_kazakhstan_time
+
+logger = logging.getLogger(__name__)
+
+# Per day, so an answer cached just before midnight is not served for the new day
+COMMAND_CACHE_KEY = 'cmd:{user_id}:{date}:{command}'
+
+
+def _answered(user):
+    return UserResponse.objects.filter(user=user).exclude(response_text='')
+
+
+def status_command(user):
+    """Subscription state and today's progress"""
+    today = get_kazakhstan_time().date()
+    stats = DailyUserStats.objects.filter(user=user, date=today).first()
+    answered = stats.answered if stats else 0
+    asked = stats.questions_sent if stats else 0
+    state = "активна ✅" if user.is_active else "не активна ⏸️"
+    return (
+        f"📋 Подписка: {state}\n\n"
+        f"Сегодня отвечено: {answered} из {asked}"
+    )
+
+
+def today_command(user):
+    """All answers recorded today"""
+    today = get_kazakhstan_time().date()
+    rows = (
+        _answered(user)
+        .filter(question_date=today)
+        .order_by('question_time')
+        .values_list('question_time', 'response_text')
+    )
+    if not rows:
+        return "Сегодня у вас пока нет ответов."
+    lines = [f"{q_time.strftime('%H:%M')} — {text}" for q_time, text in rows]
+    return "📝 Ваши ответы за сегодня:\n\n" + "\n".join(lines)
+
+
+def week_command(user):
+    """Answers per day for the last 7 days"""
+    today = get_kazakhstan_time().date()
+    start = today - timedelta(days=6)
+    counts = dict(
+        DailyUserStats.objects
+        .filter(user=user, date__gte=start)
+        .values_list('date', 'answered')
+    )
+    lines = []
+    for offset in range(7):
+        day = start + timedelta(days=offset)
+        lines.append(f"{day.strftime('%d.%m')} — {counts.get(day, 0)}")
+    return "📅 Ответов за неделю:\n\n" + "\n".join(lines)
+
+
+def summary_command(user):
+    """Totals, response rate and reply speed for the last 30 days"""
+    start = get_kazakhstan_time().date() - timedelta(days=30)
+    stats = DailyUserStats.objects.filter(user=user, date__gte=start).aggregate(
+        total=Sum('questions_sent'),
+        answered=Sum('answered'),
+        latency=Sum('total_reply_latency'),
+    )
+    total = stats['total'] or 0
+    answered = stats['answered'] or 0
+    rate = min(100, round(100 * answered / total)) if total else 0
+    lines = [
+        "📊 За последние 30 дней:\n",
+        f"Вопросов: {total}",
+        f"Ответов: {answered}",
+        f"Процент ответов: {rate}%",
+    ]
+    if answered:
+        lines.append(f"Среднее время ответа: {round(stats['latency'] / answered / 60)} мин")
+        categories = (
+            _answered(user)
+            .filter(question_date__gte=start)
+            .exclude(category='')
+            .values_list('category')
+            .annotate(count=Count('id'))
+            .order_by('-count', 'category')[:5]
+        )
+        if categories:
+            lines.append("\nЧем занимались: " + ", ".join(f"{classifier.label(category)} ({count})" for category, count in categories))
+    return "\n".join(lines)
+
+
+# Read-only commands, answered from the per-user cache
+READ_COMMANDS = {
+    'status': status_command,
+    'today': today_command,
+    'week': week_command,
+    'summary': summary_command,
+}
+
+
+SEARCH_COMMAND_LIMIT = 10
+
+
+def search_command(user, terms):
+    """
+    Best matching answers of the user's own for the last 7 days.
+
+    Colleagues' answers are never shown in chat; tenant-wide search is only
+    available to staff through the search view.
+    """
+    if not terms:
+        return "Напишите, что искать: например '/search release'."
+    start = get_kazakhstan_time().date() - timedelta(days=6)
+    with reporting(user_id=user.user_id):
+        rows, has_next = search_responses(
+            terms,
+            start=start,
+            user_id=user.user_id,
+            page_size=SEARCH_COMMAND_LIMIT,
+        )
+    if not rows:
+        return f"🔎 По запросу \"{terms}\" в ваших ответах ничего не найдено за последнюю неделю."
+    lines = [
+        f"{row['question_date'].strftime('%d.%m')} {row['question_time'].strftime('%H:%M')} — {row['response_text'][:200]}"
+        for row in rows
+    ]
+    if has_next:
+        lines.append(f"\nПоказаны первые {SEARCH_COMMAND_LIMIT}, уточните запрос.")
+    return f"🔎 Найдено в ваших ответах по запросу \"{terms}\":\n\n" + "\n".join(lines)
+
+
+def run_read_command(command, user):
+    """Answer a read command, computing it only on a cache miss"""
+    today = get_kazakhstan_time().date().isoformat()
+    key = COMMAND_CACHE_KEY.format(user_id=user.user_id, date=today, command=command)
+    try:
+        text = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Кэш недоступен: {e}")
+        text = None
+    if text is None:
+        # Pinned to the primary for a while after the user's own writes
+        with reporting(user_id=user.user_id):
+            text = READ_COMMANDS[command](user)
+        try:
+            cache.set(key, text, settings.COMMAND_CACHE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Не смог сохранить ответ команды в кэш: {e}")
+    return text
+
+
+def invalidate_user_commands(*user_ids):
+    """Drop cached read-command answers after the user's data changed"""
+    today = get_kazakhstan_time().date().isoformat()
+    keys = [
+        COMMAND_CACHE_KEY.format(user_id=user_id, date=today, command=command)
+        for user_id in user_ids
+        for command in READ_COMMANDS
+    ]
+    if not keys:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning(f"Не смог сбросить кэш команд: {e}")
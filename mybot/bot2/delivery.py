@@ -0,0 +1,112 @@
+"""
+Delivery outcomes of proactive messages and automatic deactivation.
+
+A send is either delivered, failed for good (the bot was removed or the
+conversation deleted: the connector answers 403/404) or failed for now
+(connector errors). Users with a permanent failure are deactivated right
+away; transient failures are counted per user and DELIVERY_FAILURE_LIMIT
+of them in a row deactivate too. A delivered message resets the count,
+and writing to the bot again reactivates the users deactivated here (but
+not those who typed 'stop').
+
+Failures on our side - a rejected token, throttling, no answer from the
+connector at all - are never held against users, and neither are any
+failures of a batch in which nothing was delivered: that is an outage
+(or the bot's own registration being rejected with 403), not a dead
+conversation.
+"""
+import logging
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from . import metrics
+from .commands import invalidate_user_commands
+from .models import TeamsUser
+
+logger = logging.getLogger(__name__)
+
+DELIVERED, PERMANENT, TRANSIENT = 'delivered', 'permanent', 'transient'
+# Say nothing about the user: the bot's own token was rejected, the bot
+# is sending too fast, or the request never got an answer
+UNAUTHORIZED, THROTTLED, NOT_SENT = 'unauthorized', 'throttled', 'not_sent'
+
+# Connector answers that no retry will change
+PERMANENT_STATUSES = {403: 'forbidden', 404: 'conversation_not_found'}
+
+# TeamsUser.deactivation_reason. Users deactivated for one of AUTO_REASONS
+# are resubscribed by their next message; the others stay unsubscribed
+NO_REFERENCE, INVALID_REFERENCE = 'no_conversation_reference', 'invalid_conversation_reference'
+TOO_MANY_FAILURES = 'too_many_failures'
+AUTO_REASONS = {*PERMANENT_STATUSES.values(), NO_REFERENCE, INVALID_REFERENCE, TOO_MANY_FAILURES}
+USER_STOP, ADMIN = 'user_stop', 'admin'
+
+
+def classify(status_code):
+    """(outcome, reason) for an HTTP status of the connector"""
+    if status_code in (200, 201):
+        return DELIVERED, ''
+    if status_code in PERMANENT_STATUSES:
+        return PERMANENT, PERMANENT_STATUSES[status_code]
+    if status_code == 401:
+        return UNAUTHORIZED, 'unauthorized'
+    if status_code == 429:
+        return THROTTLED, 'throttled'
+    return TRANSIENT, f'http_{status_code}'
+
+
+def record_results(results):
+    """
+    Apply the outcomes of a batch of sends in a few bulk updates.
+
+    results maps user_id -> (outcome, reason); returns the ids deactivated.
+    """
+    by_outcome = {}
+    for user_id, (outcome, reason) in results.items():
+        by_outcome.setdefault(outcome, {}).setdefault(reason, []).append(user_id)
+    for outcome, reasons in by_outcome.items():
+        metrics.incr('message_deliveries_total', {'outcome': outcome}, sum(map(len, reasons.values())))
+
+    now = timezone.now()
+    deactivated = []
+    try:
+        delivered = [user_id for ids in by_outcome.get(DELIVERED, {}).values() for user_id in ids]
+        if delivered:
+            # Only rows that had failures are written
+            TeamsUser.objects.filter(user_id__in=delivered, delivery_failures__gt=0).update(delivery_failures=0)
+
+        permanent = by_outcome.get(PERMANENT, {})
+        transient = [user_id for ids in by_outcome.get(TRANSIENT, {}).values() for user_id in ids]
+        if not delivered and (permanent or transient):
+            failed = sum(map(len, permanent.values())) + len(transient)
+            logger.warning(f"Nothing delivered in a batch of {len(results)}, {failed} failures not held against users")
+            return []
+
+        for reason, ids in permanent.items():
+            deactivated += _deactivate(TeamsUser.objects.filter(user_id__in=ids), reason, now)
+
+        if transient:
+            TeamsUser.objects.filter(user_id__in=transient).update(delivery_failures=F('delivery_failures') + 1)
+            exhausted = TeamsUser.objects.filter(
+                user_id__in=transient, delivery_failures__gte=settings.DELIVERY_FAILURE_LIMIT,
+            )
+            deactivated += _deactivate(exhausted, TOO_MANY_FAILURES, now)
+    except Exception as e:
+        # Bookkeeping only; the messages have already been sent
+        logger.error(f"Не смог записать результаты доставки: {e}")
+        return []
+
+    if deactivated:
+        invalidate_user_commands(*deactivated)
+        metrics.incr('users_auto_deactivated_total', amount=len(deactivated))
+    return deactivated
+
+
+def _deactivate(queryset, reason, now):
+    ids = list(queryset.filter(is_active=True).values_list('user_id', flat=True))
+    if not ids:
+        return []
+    TeamsUser.objects.filter(user_id__in=ids, is_active=True).update(
+        is_active=False, deactivated_at=now, deactivation_reason=reason, updated_at=now,
+    )
+    logger.warning(f"Deactivated {len(ids)} unreachable users ({reason})")
+    return ids
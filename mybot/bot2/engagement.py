@@ -0,0 +1,79 @@
+"""
+Adaptive question frequency.
+
+Every active user has an engagement tier that decides which slots they are
+asked at: every slot, the slots on the hour, or twice a day. Once a day the
+tiers are recomputed from the answer rate of the last
+ENGAGEMENT_WINDOW_DAYS (DailyUserStats): a user answering less than
+ENGAGEMENT_MIN_ANSWER_RATE moves one tier down. Only delivered questions
+count, so failed sends never look like a user ignoring the bot. Any answer puts the user
+back on every slot at once (UserResponse.record and append_many).
+"""
+import logging
+from datetime import time, timedelta
+from django.conf import settings
+from django.db import connection
+from .models import DailyUserStats, TeamsUser
+from .slots import QUESTION_TIMES
+
+logger = logging.getLogger(__name__)
+
+FULL, HOURLY, TWICE_DAILY = 0, 1, 2
+
+# Slots each tier is asked at
+TIER_TIMES = {
+    FULL: set(QUESTION_TIMES),
+    HOURLY: {t for t in QUESTION_TIMES if t.minute == 0},
+    TWICE_DAILY: {time(10, 0), time(15, 0)},
+}
+
+
+def due_tiers(slot_time):
+    """Tiers whose users are asked at slot_time"""
+    return sorted(tier for tier, times in TIER_TIMES.items() if slot_time in times)
+
+
+def update_tiers(today):
+    """
+    Recompute the tiers from the answer rate of the days before today.
+
+    Users asked fewer than ENGAGEMENT_MIN_QUESTIONS times in the window keep
+    their tier. Returns {tier: users moved to it}.
+    """
+    start = today - timedelta(days=settings.ENGAGEMENT_WINDOW_DAYS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH rates AS (
+                SELECT user_id, sum(answered)::float / sum(questions_sent) AS rate
+                FROM {DailyUserStats._meta.db_table}
+                WHERE date >= %(start)s AND date < %(today)s
+                GROUP BY user_id
+                HAVING sum(questions_sent) >= %(min_questions)s
+            ),
+            tiers AS (
+                SELECT u.user_id,
+                       CASE WHEN r.rate < %(min_rate)s THEN LEAST(u.engagement_tier + 1, %(lowest)s)
+                            ELSE %(full)s
+                       END AS tier
+                FROM {TeamsUser._meta.db_table} u
+                JOIN rates r USING (user_id)
+                WHERE u.is_active
+            )
+            UPDATE {TeamsUser._meta.db_table} u
+            SET engagement_tier = t.tier
+            FROM tiers t
+            WHERE u.user_id = t.user_id AND u.engagement_tier <> t.tier
+            RETURNING t.tier
+            """,
+            {
+                'start': start, 'today': today,
+                'min_questions': settings.ENGAGEMENT_MIN_QUESTIONS,
+                'min_rate': settings.ENGAGEMENT_MIN_ANSWER_RATE,
+                'lowest': max(TIER_TIMES), 'full': FULL,
+            }
+        )
+        moved = {}
+        for (tier,) in cursor.fetchall():
+            moved[tier] = moved.get(tier, 0) + 1
+    return moved
@@ -0,0 +1,72 @@
+import csv
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from bot1.db_router import read_db_alias
+from .models import UserResponse
+
+EXPORT_FIELDS = [
+    'user_id', 'user_name', 'user_email', 'tenant_id',
+    'question_date', 'question_time', 'response_text', 'category', 'response_time',
+]
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def export_rows(start=None, end=None, tenant_id=None, user_id=None, chunk_size=None):
+    """
+    Responses joined with their user, as dicts in (question_date, question_time, id) order.
+
+    Rows come from a server-side cursor chunk_size at a time, so memory use
+    does not depend on the size of the export. The alias is picked here and
+    not through reporting(), because streamed responses are consumed after
+    the view has returned.
+    """
+    qs = UserResponse.objects.using(read_db_alias())
+    if start:
+        qs = qs.filter(question_date__gte=start)
+    if end:
+        qs = qs.filter(question_date__lte=end)
+    if tenant_id:
+        qs = qs.filter(user__tenant_id=tenant_id)
+    if user_id:
+        qs = qs.filter(user_id=user_id)
+
+    return (
+        qs.order_by('question_date', 'question_time', 'id')
+        .values(
+            'user_id', 'question_date', 'question_time', 'response_text', 'category', 'response_time',
+            user_name=F('user__name'), user_email=F('user__email'), tenant_id=F('user__tenant_id'),
+        )
+        .iterator(chunk_size=chunk_size or settings.RESPONSE_EXPORT_CHUNK_SIZE)
+    )
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps({field: row[field] for field in EXPORT_FIELDS}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_lines(export_format, rows):
+    if export_format == 'csv':
+        return csv_lines(rows)
+    if export_format == 'jsonl':
+        return jsonl_lines(rows)
+    raise ValueError(f"Unknown export format: {export_format}")
@@ -0,0 +1,197 @@
+"""
+Readiness probes for the web process.
+
+A daemon thread runs the probes in the background and keeps the last
+results in memory, so the readiness endpoint only reads a dict however
+often the load balancer polls. Each probe is cut off after
+HEALTH_PROBE_TIMEOUT_SECONDS; a failed critical probe makes the process
+not ready, the others only show up as warnings.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.db import connections
+from .access_token import cached_token
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+OK, WARN, FAIL = 'ok', 'warn', 'fail'
+
+_lock = threading.Lock()
+_state = {'pid': None, 'thread': None, 'checks': {}, 'running': {}, 'updated_at': None, 'payload': None, 'ready': False}
+_broker = None
+
+
+def probe_database():
+    connection = connections['default']
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    finally:
+        # Back to the pool; this thread never runs a request
+        connection.close()
+    return OK, None
+
+
+def probe_redis():
+    get_redis().ping()
+    return OK, None
+
+
+def broker_queue_keys():
+    """Redis list keys of every Celery queue, including the priority sub-queues"""
+    options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+    sep = options.get('sep', '\x06\x16')
+    queues = {settings.CELERY_TASK_DEFAULT_QUEUE} | {route['queue'] for route in settings.CELERY_TASK_ROUTES.values()}
+    return {
+        queue: [queue if step == 0 else f'{queue}{sep}{step}' for step in options.get('priority_steps', [0])]
+        for queue in sorted(queues)
+    }
+
+
+def probe_broker():
+    global _broker
+    if _broker is None:
+        import redis
+        timeout = settings.HEALTH_PROBE_TIMEOUT_SECONDS
+        _broker = redis.Redis.from_url(
+            settings.CELERY_BROKER_URL, socket_timeout=timeout, socket_connect_timeout=timeout,
+        )
+    keys = broker_queue_keys()
+    pipe = _broker.pipeline(transaction=False)
+    for queue_keys in keys.values():
+        for key in queue_keys:
+            pipe.llen(key)
+    lengths = iter(pipe.execute())
+    depth = {queue: sum(next(lengths) for _ in queue_keys) for queue, queue_keys in keys.items()}
+    backlog = {queue: n for queue, n in depth.items() if n > settings.HEALTH_MAX_QUEUE_DEPTH}
+    return (WARN if backlog else OK), depth
+
+
+def probe_token():
+    entry = cached_token()
+    if not entry:
+        # Fetched on the next send; only a problem if it keeps failing
+        return WARN, 'no cached token'
+    return OK, {'expires_in': int(entry['expires_at'] - time.time())}
+
+
+def probe_openai():
+    if not settings.OPENAI_API_KEY:
+        return WARN, 'not configured'
+    import requests
+    response = requests.get(
+        'https://api.openai.com/v1/models',
+        headers={'Authorization': f'Bearer {settings.OPENAI_API_KEY}'},
+        timeout=settings.HEALTH_PROBE_TIMEOUT_SECONDS,
+    )
+    if response.status_code == 200:
+        return OK, None
+    if response.status_code in (401, 403):
+        return FAIL, f'HTTP {response.status_code}'
+    return WARN, f'HTTP {response.status_code}'
+
+
+# name -> (probe, critical, seconds between runs)
+PROBES = {
+    'database': (probe_database, True, lambda: settings.HEALTH_PROBE_INTERVAL_SECONDS),
+    'redis': (probe_redis, True, lambda: settings.HEALTH_PROBE_INTERVAL_SECONDS),
+    'broker': (probe_broker, True, lambda: settings.HEALTH_PROBE_INTERVAL_SECONDS),
+    'token': (probe_token, False, lambda: settings.HEALTH_PROBE_INTERVAL_SECONDS),
+    # A real API call, so much less often
+    'openai': (probe_openai, False, lambda: settings.HEALTH_OPENAI_PROBE_INTERVAL_SECONDS),
+}
+
+
+def _run(probe):
+    started = time.monotonic()
+    error = None
+    try:
+        status, detail = probe()
+    except Exception as e:
+        # Only the type is published, the message (hosts, ports) goes to the log
+        status, detail, error = FAIL, type(e).__name__, str(e)
+    return {
+        'status': status, 'detail': detail, 'error': error,
+        'latency_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+def refresh(executor):
+    """Run the probes that are due, in parallel, and publish the new snapshot"""
+    now = time.monotonic()
+    checks = dict(_state['checks'])
+    running = _state['running']
+    for name, (probe, _, interval) in PROBES.items():
+        # A probe that hung past its timeout is not started again until it returns
+        if name in running and not running[name].done():
+            continue
+        if name not in checks or now - checks[name]['checked_at'] >= interval():
+            running[name] = executor.submit(_run, probe)
+        else:
+            running.pop(name, None)
+
+    deadline = now + settings.HEALTH_PROBE_TIMEOUT_SECONDS
+    for name, future in list(running.items()):
+        try:
+            result = future.result(timeout=max(0, deadline - time.monotonic()))
+            del running[name]
+        except FutureTimeout:
+            result = {
+                'status': FAIL, 'detail': 'timed out', 'error': None,
+                'latency_ms': settings.HEALTH_PROBE_TIMEOUT_SECONDS * 1000,
+            }
+        if result['status'] != OK and checks.get(name, {}).get('status') != result['status']:
+            logger.warning(f"Health probe {name}: {result['status']} ({result['error'] or result['detail']})")
+        checks[name] = {**result, 'checked_at': now}
+
+    ready = all(checks[name]['status'] != FAIL for name, (_, critical, _) in PROBES.items() if critical)
+    degraded = any(check['status'] != OK for check in checks.values())
+    payload = {
+        'status': 'not_ready' if not ready else 'degraded' if degraded else 'ready',
+        'checks': {
+            name: {key: value for key, value in check.items() if key not in ('checked_at', 'error')}
+            for name, check in checks.items()
+        },
+    }
+    _state.update(checks=checks, updated_at=time.monotonic(), payload=payload, ready=ready)
+
+
+def _loop():
+    executor = ThreadPoolExecutor(max_workers=len(PROBES), thread_name_prefix='health-probe')
+    while True:
+        try:
+            refresh(executor)
+        except Exception as e:
+            logger.error(f"Ошибка в health probes: {e}")
+        time.sleep(settings.HEALTH_PROBE_INTERVAL_SECONDS)
+
+
+def ensure_started():
+    """Start the probe thread in this process (after a fork the parent's thread is gone)"""
+    pid = os.getpid()
+    if _state['pid'] == pid and _state['thread'].is_alive():
+        return
+    with _lock:
+        if _state['pid'] == pid and _state['thread'].is_alive():
+            return
+        thread = threading.Thread(target=_loop, name='health-probes', daemon=True)
+        _state.update(pid=pid, thread=thread, checks={}, running={}, updated_at=None, payload=None, ready=False)
+        thread.start()
+
+
+def readiness():
+    """(ready, payload) from the last background refresh"""
+    ensure_started()
+    updated_at = _state['updated_at']
+    if updated_at is None:
+        return False, {'status': 'starting'}
+    # A snapshot nobody has refreshed for a while means the probe thread is stuck
+    age = time.monotonic() - updated_at
+    if age > settings.HEALTH_PROBE_INTERVAL_SECONDS * 3 + settings.HEALTH_PROBE_TIMEOUT_SECONDS:
+        return False, {**_state['payload'], 'status': 'stale', 'age_seconds': round(age, 1)}
+    return _state['ready'], _state['payload']
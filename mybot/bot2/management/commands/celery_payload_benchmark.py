@@ -0,0 +1,89 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from celery import uuid
+from kombu import Connection, Exchange, Producer, Queue
+from kombu.serialization import dumps, loads
+from kombu.utils.json import dumps as json_dumps
+from bot1.celery import app
+
+QUEUE = 'payload-benchmark'
+
+
+def fake_user_id(n):
+    # Teams ids are "29:" followed by a ~90 character opaque string
+    return f"29:1{n:08d}" + 'x' * 85
+
+
+class Command(BaseCommand):
+    help = 'Compare broker bytes and encode/decode time of task messages per serializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--serializers', nargs='+', default=['json', 'msgpack'])
+        parser.add_argument('--ids', type=int, default=settings.ADMIN_ACTION_CHUNK_SIZE,
+                            help='User ids per bulk admin message')
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--store-results', action='store_true',
+                            help='Count result backend writes for every task, as before ignore_result')
+
+    def handle(self, *args, **options):
+        ids = [fake_user_id(n) for n in range(options['ids'])]
+        messages = [
+            ('send_activity_questions', (), {}, None),
+            ('flush_reply_buffers', (), {}, 42),
+            ('send_message_to_user', (ids[0], 'Напоминание: ответьте, пожалуйста, на вопрос о текущей активности.'), {}, None),
+            ('set_users_active', (ids, False), {}, len(ids)),
+            ('resend_question', (ids,), {}, len(ids)),
+        ]
+
+        self.stdout.write(
+            f"{'task':<24} {'serializer':<10} {'body':>8} {'broker':>8} {'overhead':>9} "
+            f"{'result':>7} {'encode':>9} {'decode':>9}"
+        )
+        with Connection('memory://') as conn:
+            channel = conn.channel()
+            exchange = Exchange(QUEUE, type='direct')
+            Queue(QUEUE, exchange, routing_key=QUEUE)(channel).declare()
+            producer = Producer(channel)
+
+            for name, task_args, task_kwargs, result in messages:
+                task_name = f'bot2.tasks.{name}'
+                for serializer in options['serializers']:
+                    message = app.amqp.create_task_message(uuid(), task_name, task_args, task_kwargs)
+                    app.amqp.send_task_message(
+                        producer, task_name, message,
+                        serializer=serializer, exchange=exchange, routing_key=QUEUE, declare=[],
+                    )
+                    # What the Redis transport pushes onto the list: the
+                    # JSON envelope with the base64 encoded body
+                    broker_bytes = len(json_dumps(channel._get(QUEUE)))
+
+                    content_type, encoding, body = dumps(message.body, serializer=serializer)
+                    encode = self._timed(options['iterations'], lambda: dumps(message.body, serializer=serializer))
+                    decode = self._timed(options['iterations'], lambda: loads(body, content_type, encoding, accept=[content_type]))
+
+                    self.stdout.write(
+                        f"{name:<24} {serializer:<10} {len(body):>8} {broker_bytes:>8} "
+                        f"{broker_bytes - len(body):>9} {self._result_bytes(task_name, result, serializer, options['store_results']):>7} "
+                        f"{encode:>7.1f}us {decode:>7.1f}us"
+                    )
+
+        self.stdout.write(
+            "\nbody: serialized args; broker: bytes stored per message; overhead: broker - body; "
+            "result: bytes written to the result backend (0 for ignore_result tasks)"
+        )
+
+    def _timed(self, iterations, func):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - started) / iterations * 1_000_000
+
+    def _result_bytes(self, task_name, result, serializer, store_results):
+        if app.tasks[task_name].ignore_result and not store_results:
+            return 0
+        meta = {
+            'status': 'SUCCESS', 'result': result, 'traceback': None,
+            'children': [], 'date_done': '2025-01-01T12:00:00.000000', 'task_id': uuid(),
+        }
+        return len(dumps(meta, serializer=serializer)[2])
@@ -0,0 +1,37 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from bot2.export import EXPORT_FORMATS, export_lines, export_rows
+
+class Command(BaseCommand):
+    help = 'Stream responses with user name and email as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv', help='Output format')
+        parser.add_argument('--start', type=date.fromisoformat, help='First question date (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last question date (YYYY-MM-DD)')
+        parser.add_argument('--tenant', help='Only users of this tenant id')
+        parser.add_argument('--user', help='Only this user id')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per round trip')
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError('--start must not be after --end')
+
+        rows = export_rows(
+            start=options['start'],
+            end=options['end'],
+            tenant_id=options['tenant'],
+            user_id=options['user'],
+            chunk_size=options['chunk_size'],
+        )
+        lines = export_lines(options['format'], rows)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+            self.stderr.write(self.style.SUCCESS(f'Exported responses to {options["output"]}'))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,47 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from bot2 import partitions
+from bot2.archive import read_archive
+from bot2.models import UserResponse
+
+class Command(BaseCommand):
+    help = 'Restore archived responses from compressed JSONL archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Archive files or directories to restore')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        files = []
+        for raw_path in options['paths']:
+            path = Path(raw_path)
+            if path.is_dir():
+                files.extend(sorted(path.rglob('*.jsonl.gz')))
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f'Path not found: {path}')
+
+        batch_size = options['batch_size']
+        total = 0
+        for path in files:
+            batch = []
+            for response in read_archive(path):
+                batch.append(response)
+                if len(batch) >= batch_size:
+                    total += self._insert(batch)
+                    batch = []
+            if batch:
+                total += self._insert(batch)
+            self.stdout.write(f'Restored {path}')
+
+        self.stdout.write(self.style.SUCCESS(f'Restored {total} responses from {len(files)} files'))
+        self.stdout.write(
+            'Note: rows older than RESPONSE_RETENTION_DAYS are archived again by the next cleanup.'
+        )
+
+    def _insert(self, batch):
+        # Old months need their partition back before rows can go in
+        partitions.ensure_month_partitions(partitions.month_start(r.question_date) for r in batch)
+        UserResponse.objects.bulk_create(batch, ignore_conflicts=True)
+        return len(batch)
@@ -1,6 +1,9 @@
+import json
 from django.core.management.base import BaseCommand
 from django_celery_beat.models import PeriodicTask, CrontabSchedule, IntervalSchedule
+from django.conf import settings
 from django.utils import timezone
+from bot2.slots import QUESTION_TIMES
 
 class Command(BaseCommand):
     help = 'Set up scheduled tasks for the activity bot'
@@ -15,42 +18,8 @@ class Command(BaseCommand):
         IntervalSchedule.objects.all().delete()
         self.stdout.write('Cleared existing tasks and schedules')
         
-        # Create interval-based schedule (every 30 minutes)
-        interval_schedule = IntervalSchedule.objects.create(
-            every=30,
-            period=IntervalSchedule.MINUTES,
-        )
-        
-        self.stdout.write('Created 30-minute interval schedule')
-        
-        # Create the periodic task for activity questions
-        activity_task = PeriodicTask.objects.create(
-            name='send-activity-questions-every-30-minutes',
-            task='bot2.tasks.send_activity_questions',
-            interval=interval_schedule,
-            enabled=True
-        )
-        
-        self.stdout.write('Created activity questions task (every 30 minutes)')
-        
         # Create specific time-based schedules for working hours only (9:00-17:00)
-        question_times = [
-            (9, 0),   # 9:00 AM
-            (9, 30),  # 9:30 AM
-            (10, 0),  # 10:00 AM
-            (10, 30), # 10:30 AM
-            (11, 0),  # 11:00 AM
-            (11, 30), # 11:30 AM
-            (12, 0),  # 12:00 PM
-            (12, 30), # 12:30 PM
-            (14, 0),  # 2:00 PM
-            (14, 30), # 2:30 PM
-            (15, 0),  # 3:00 PM
-            (15, 30), # 3:30 PM
-            (16, 0),  # 4:00 PM
-            (16, 30), # 4:30 PM
-            (17, 0),  # 5:00 PM
-        ]
+        question_times = [(t.hour, t.minute) for t in QUESTION_TIMES]
         
         for hour, minute in question_times:
             # Create the crontab schedule
@@ -67,10 +36,13 @@ class Command(BaseCommand):
             
             # Create the periodic task
             task_name = f'send-activity-question-{hour:02d}-{minute:02d}'
+            # The slot travels with the message, so a run delayed in the
+            # queue still asks the question it was scheduled for
             task = PeriodicTask.objects.create(
                 name=task_name,
                 task='bot2.tasks.send_activity_questions',
                 crontab=schedule,
+                kwargs=json.dumps({'slot': f'{hour:02d}:{minute:02d}'}),
                 enabled=True
             )
             
@@ -92,6 +64,7 @@ class Command(BaseCommand):
             name='send-daily-summary',
             task='bot2.tasks.send_daily_summary',
             crontab=summary_schedule,
+            kwargs=json.dumps({'slot': '17:00'}),
             enabled=True
         )
         
@@ -118,6 +91,77 @@ class Command(BaseCommand):
         
         self.stdout.write('Created cleanup task')
         
+        # Create daily stats reconciliation task (daily at 1:00 AM)
+        reconcile_schedule = CrontabSchedule.objects.create(
+            hour=1,
+            minute=0,
+            day_of_week='*',
+            day_of_month='*',
+            month_of_year='*',
+            timezone='Asia/Almaty'
+        )
+        
+        PeriodicTask.objects.create(
+            name='reconcile-daily-stats',
+            task='bot2.tasks.reconcile_daily_stats',
+            crontab=reconcile_schedule,
+            enabled=True
+        )
+        
+        self.stdout.write('Created daily stats reconciliation task (1:00 AM)')
+        
+        # Create engagement tier update (daily at 1:30 AM, after the reconciliation)
+        engagement_schedule = CrontabSchedule.objects.create(
+            hour=1,
+            minute=30,
+            day_of_week='*',
+            day_of_month='*',
+            month_of_year='*',
+            timezone='Asia/Almaty'
+        )
+        
+        PeriodicTask.objects.create(
+            name='update-engagement-tiers',
+            task='bot2.tasks.update_engagement_tiers',
+            crontab=engagement_schedule,
+            enabled=True
+        )
+        
+        self.stdout.write('Created engagement tier task (1:30 AM)')
+        
+        # Create write-behind flush task (only when write-behind is enabled)
+        if settings.RESPONSE_WRITE_BEHIND:
+            flush_schedule = IntervalSchedule.objects.create(
+                every=settings.RESPONSE_WRITE_BEHIND_FLUSH_SECONDS,
+                period=IntervalSchedule.SECONDS,
+            )
+            
+            PeriodicTask.objects.create(
+                name='flush-reply-buffers',
+                task='bot2.tasks.flush_reply_buffers',
+                interval=flush_schedule,
+                enabled=True
+            )
+            
+            self.stdout.write(
+                f'Created reply buffer flush task (every {settings.RESPONSE_WRITE_BEHIND_FLUSH_SECONDS} seconds)'
+            )
+        
+        # Create response classification task
+        classify_schedule = IntervalSchedule.objects.create(
+            every=settings.CLASSIFIER_INTERVAL_SECONDS,
+            period=IntervalSchedule.SECONDS,
+        )
+        
+        PeriodicTask.objects.create(
+            name='classify-responses',
+            task='bot2.tasks.classify_responses',
+            interval=classify_schedule,
+            enabled=True
+        )
+        
+        self.stdout.write(f'Created classification task (every {settings.CLASSIFIER_INTERVAL_SECONDS} seconds)')
+        
         # Create health check task (every hour)
         health_schedule = CrontabSchedule.objects.create(
             hour='*',
@@ -144,8 +188,11 @@ class Command(BaseCommand):
         )
         
         self.stdout.write('\n📋 Scheduled Tasks Summary:')
-        self.stdout.write('• Activity questions: Every 30 minutes (9:00-17:00)')
+        self.stdout.write('• Activity questions: every 30 minutes 9:00-17:00, except lunch')
         self.stdout.write('• Daily summary: 6:00 PM daily')
+        self.stdout.write('• Daily stats reconciliation: 1:00 AM daily')
+        self.stdout.write('• Engagement tiers: 1:30 AM daily')
         self.stdout.write('• Cleanup: 2:00 AM daily')
+        self.stdout.write(f'• Response classification: every {settings.CLASSIFIER_INTERVAL_SECONDS} seconds')
         self.stdout.write('• Health check: Every hour')
         self.stdout.write('\n🚀 Start the bot with: python start_celery.py') 
\ No newline at end of file
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from bot2 import metrics
+
+class Command(BaseCommand):
+    help = 'Print queue wait, runtime and outcome per Celery task from the recorded telemetry'
+
+    def handle(self, *args, **options):
+        counters = metrics.read_counters()
+        histograms = metrics.read_histograms()
+
+        outcomes = {}
+        for labels, value in counters.get('celery_tasks_total', {}).items():
+            fields = dict(part.split('=', 1) for part in labels.split(','))
+            task, state = fields['task'].strip('"'), fields['state'].strip('"')
+            outcomes.setdefault(task, {})[state] = int(value)
+        retries = {
+            labels.split('=', 1)[1].strip('"'): int(value)
+            for labels, value in counters.get('celery_task_retries_total', {}).items()
+        }
+
+        def task_of(labels):
+            return labels.split('=', 1)[1].strip('"')
+
+        waits = {task_of(labels): h for labels, h in histograms.get('celery_task_queue_wait_seconds', {}).items()}
+        runtimes = {task_of(labels): h for labels, h in histograms.get('celery_task_runtime_seconds', {}).items()}
+
+        tasks = sorted(set(outcomes) | set(waits) | set(runtimes))
+        if not tasks:
+            self.stdout.write('No task telemetry recorded yet.')
+            return
+
+        header = f"{'task':<40} {'ok':>7} {'failed':>7} {'retry':>6} {'wait p50':>9} {'wait p95':>9} {'run p50':>9} {'run p95':>9} {'run avg':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for task in tasks:
+            states = outcomes.get(task, {})
+            wait = waits.get(task)
+            runtime = runtimes.get(task)
+            self.stdout.write(
+                f"{task.removeprefix('bot2.tasks.'):<40} "
+                f"{states.get('SUCCESS', 0):>7} {states.get('FAILURE', 0):>7} {retries.get(task, 0):>6} "
+                f"{self._seconds(wait and metrics.quantile(wait, 0.5)):>9} "
+                f"{self._seconds(wait and metrics.quantile(wait, 0.95)):>9} "
+                f"{self._seconds(runtime and metrics.quantile(runtime, 0.5)):>9} "
+                f"{self._seconds(runtime and metrics.quantile(runtime, 0.95)):>9} "
+                f"{self._seconds(runtime and runtime['sum'] / runtime['count']):>9}"
+            )
+
+    def _seconds(self, value):
+        if value is None:
+            return '-'
+        return f'{value * 1000:.0f}ms' if value < 1 else f'{value:.1f}s'
@@ -0,0 +1,135 @@
+"""
+Process-independent metrics kept in Redis.
+
+Web processes and every Celery worker child write to the same two hashes,
+so one scrape of /bot/api/metrics/ sees the whole deployment. Counters and
+histograms are rendered in the Prometheus text format.
+"""
+import logging
+import math
+from collections import defaultdict
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = 'hourlybot:metrics:counters'
+HISTOGRAMS_KEY = 'hourlybot:metrics:histograms'
+
+# Seconds; wide enough for both sub-second sends and half-hour queue backlogs
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, math.inf)
+
+HELP = {
+    'celery_tasks_total': 'Finished Celery tasks by outcome',
+    'celery_task_failures_total': 'Failed Celery tasks by exception type',
+    'celery_task_retries_total': 'Celery task retries',
+    'celery_task_queue_wait_seconds': 'Time from publish (or ETA) until a worker started the task',
+    'celery_task_runtime_seconds': 'Time a worker spent running the task',
+    'scheduled_slot_lateness_seconds': 'Delay between a scheduled slot and the run that served it',
+    'scheduled_slots_late_total': 'Scheduled slots served later than SCHEDULE_ON_TIME_SECONDS',
+    'scheduled_slots_missed_total': 'Scheduled slots dropped because they were past their lateness window',
+    'message_deliveries_total': 'Proactive messages by delivery outcome',
+    'users_auto_deactivated_total': 'Users deactivated because messages could not be delivered',
+}
+
+SEP = '\t'
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _bucket_label(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def incr(name, labels=None, amount=1):
+    """Add to a counter"""
+    try:
+        get_redis().hincrbyfloat(COUNTERS_KEY, f'{name}{SEP}{format_labels(labels or {})}', amount)
+    except Exception as e:
+        logger.warning(f"Не смог записать метрику {name}: {e}")
+
+
+def observe(name, value, labels=None):
+    """Record one observation in a histogram"""
+    labels = format_labels(labels or {})
+    bound = next(bound for bound in BUCKETS if value <= bound)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hincrby(HISTOGRAMS_KEY, f'{name}{SEP}{labels}{SEP}{_bucket_label(bound)}', 1)
+        pipe.hincrbyfloat(HISTOGRAMS_KEY, f'{name}{SEP}{labels}{SEP}sum', value)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Не смог записать метрику {name}: {e}")
+
+
+def read_counters():
+    """{name: {labels: value}}"""
+    counters = defaultdict(dict)
+    for field, value in get_redis().hgetall(COUNTERS_KEY).items():
+        name, labels = field.split(SEP, 1)
+        counters[name][labels] = float(value)
+    return counters
+
+
+def read_histograms():
+    """{name: {labels: {'buckets': [(bound, cumulative count)], 'sum': float, 'count': int}}}"""
+    raw = defaultdict(lambda: defaultdict(dict))
+    for field, value in get_redis().hgetall(HISTOGRAMS_KEY).items():
+        name, labels, key = field.split(SEP, 2)
+        raw[name][labels][key] = float(value)
+
+    histograms = defaultdict(dict)
+    for name, series in raw.items():
+        for labels, values in series.items():
+            cumulative = 0
+            buckets = []
+            for bound in BUCKETS:
+                cumulative += int(values.get(_bucket_label(bound), 0))
+                buckets.append((bound, cumulative))
+            histograms[name][labels] = {'buckets': buckets, 'sum': values.get('sum', 0.0), 'count': cumulative}
+    return histograms
+
+
+def quantile(histogram, q):
+    """Estimate a quantile from cumulative buckets (linear within a bucket)"""
+    count = histogram['count']
+    if not count:
+        return None
+    rank = q * count
+    lower, previous = 0.0, 0
+    for bound, cumulative in histogram['buckets']:
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            in_bucket = cumulative - previous
+            return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 0)
+        lower, previous = bound, cumulative
+    return lower
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, series in sorted(read_counters().items()):
+        lines.append(f'# HELP {name} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for labels, value in sorted(series.items()):
+            lines.append(f'{name}{{{labels}}} {_number(value)}')
+
+    for name, series in sorted(read_histograms().items()):
+        lines.append(f'# HELP {name} {HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in sorted(series.items()):
+            prefix = f'{labels},' if labels else ''
+            for bound, cumulative in histogram['buckets']:
+                lines.append(f'{name}_bucket{{{prefix}le="{_bucket_label(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(histogram["sum"])}')
+            lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
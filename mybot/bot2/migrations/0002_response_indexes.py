@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='userresponse',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='teamsuser',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user_id'], name='teamsuser_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userresponse',
+            index=models.Index(fields=['question_date', 'user'], name='response_date_user_idx'),
+        ),
+    ]
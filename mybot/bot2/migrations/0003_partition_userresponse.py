@@ -0,0 +1,130 @@
+# Converts bot2_userresponse into a table partitioned by month on question_date.
+#
+# Postgres requires the partition key in every unique constraint, so the
+# primary key becomes (id, question_date); id stays an identity column and
+# remains unique in practice. Constraint and index names are carried over
+# from the old table so Django's migration state still matches.
+#
+# Offline step: stop the bot and the workers while it runs. Rows are
+# copied in batches of COPY_BATCH_SIZE, each in its own transaction
+# (atomic = False), so a large table does not hold one huge transaction
+# open; if the copy is interrupted, running migrate again resumes it.
+
+import re
+from datetime import date
+
+from django.db import migrations
+
+TABLE = 'bot2_userresponse'
+MONTHS_AHEAD = 3
+COPY_BATCH_SIZE = 50000
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def rebuild(schema_editor, partitioned):
+    old = f'{TABLE}_old'
+    with schema_editor.connection.cursor() as cursor:
+        # Left behind by an interrupted run: the new table exists already
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [old])
+        resuming = cursor.fetchone()[0]
+        if not resuming:
+            cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {old}')
+
+        cursor.execute(
+            """
+            SELECT conname, contype, pg_get_constraintdef(oid)
+            FROM pg_constraint WHERE conrelid = %s::regclass
+            """,
+            [old]
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT pg_get_indexdef(indexrelid)
+            FROM pg_index
+            WHERE indrelid = %s::regclass
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid)
+            """,
+            [old]
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+
+        if not resuming:
+            partition_clause = ' PARTITION BY RANGE (question_date)' if partitioned else ''
+            cursor.execute(
+                f'CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY){partition_clause}'
+            )
+
+            if partitioned:
+                cursor.execute(f'SELECT min(question_date) FROM {old}')
+                first = cursor.fetchone()[0] or date.today()
+                month = date(first.year, first.month, 1)
+                last = add_months(date(date.today().year, date.today().month, 1), MONTHS_AHEAD)
+                while month <= last:
+                    cursor.execute(
+                        f'CREATE TABLE {TABLE}_p{month.year:04d}{month.month:02d} PARTITION OF {TABLE} '
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                    )
+                    month = add_months(month, 1)
+                cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        # In id order, so the highest copied id is where a resumed copy continues
+        cursor.execute(f'SELECT coalesce(max(id), 0) FROM {TABLE}')
+        copied = cursor.fetchone()[0]
+        while True:
+            cursor.execute(
+                f"""
+                WITH batch AS (
+                    INSERT INTO {TABLE}
+                    SELECT * FROM {old} WHERE id > %s ORDER BY id LIMIT %s
+                    RETURNING id
+                )
+                SELECT count(*), max(id) FROM batch
+                """,
+                [copied, COPY_BATCH_SIZE]
+            )
+            count, last_id = cursor.fetchone()
+            if not count:
+                break
+            copied = last_id
+
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), coalesce(max(id), 0) + 1, false) FROM {TABLE}"
+        )
+        cursor.execute(f'DROP TABLE {old}')
+
+        primary_key = '(id, question_date)' if partitioned else '(id)'
+        for name, kind, definition in constraints:
+            if kind == 'p':
+                definition = f'PRIMARY KEY {primary_key}'
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        for definition in indexes:
+            # Indexes of a partitioned table are defined ON ONLY <table>
+            cursor.execute(re.sub(rf' ON (ONLY )?(\S+\.)?{old} ', f' ON {TABLE} ', definition))
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild(schema_editor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    # Every batch of the copy commits on its own
+    atomic = False
+
+    dependencies = [
+        ('bot2', '0002_response_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0003_partition_userresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('questions_sent', models.PositiveIntegerField(default=0)),
+                ('answered', models.PositiveIntegerField(default=0)),
+                ('first_answer_at', models.DateTimeField(blank=True, null=True)),
+                ('last_answer_at', models.DateTimeField(blank=True, null=True)),
+                ('total_reply_latency', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='bot2.teamsuser')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'user'], name='dailystats_date_user_idx')],
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:03
+#
+# Adding a stored generated column rewrites every partition of
+# bot2_userresponse once; run it outside the 9:00-17:30 question window.
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0004_daily_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userresponse',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('response_text', config='russian'), '||', django.contrib.postgres.search.SearchVector('response_text', config='english'), django.contrib.postgres.search.SearchConfig('russian')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='userresponse',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='response_search_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0005_response_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userresponse',
+            name='category',
+            field=models.CharField(blank=True, db_default='', default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='userresponse',
+            index=models.Index(condition=models.Q(('category', ''), models.Q(('response_text', ''), _negated=True)), fields=['question_date', 'id'], name='response_unclassified_idx'),
+        ),
+    ]
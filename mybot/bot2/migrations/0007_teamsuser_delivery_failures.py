@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0006_response_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teamsuser',
+            name='deactivated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='teamsuser',
+            name='deactivation_reason',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='teamsuser',
+            name='delivery_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot2', '0007_teamsuser_delivery_failures'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='teamsuser',
+            name='teamsuser_active_idx',
+        ),
+        migrations.AddField(
+            model_name='teamsuser',
+            name='engagement_tier',
+            field=models.PositiveSmallIntegerField(db_default=0, default=0),
+        ),
+        migrations.AddIndex(
+            model_name='teamsuser',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['engagement_tier', 'user_id'], name='teamsuser_active_tier_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models
 from django.utils import timezone
 
 class TeamsUser(models.Model):
@@ -9,9 +12,25 @@ class TeamsUser(models.Model):
     tenant_id = models.CharField(max_length=255, blank=True, null=True)
     is_active = models.BooleanField(default=True)
     conversation_reference = models.TextField(blank=True, null=True)  # Store conversation reference for proactive messaging
+    # Consecutive transient send failures; see bot2.delivery
+    delivery_failures = models.PositiveIntegerField(default=0)
+    # When and why the user was deactivated (see bot2.delivery)
+    deactivated_at = models.DateTimeField(blank=True, null=True)
+    deactivation_reason = models.CharField(max_length=40, blank=True, default='')
+    # Which slots the user is asked at, see bot2.engagement (0: every slot)
+    engagement_tier = models.PositiveSmallIntegerField(default=0, db_default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # The fan-out only ever reads active users of the tiers due at the slot
+            models.Index(
+                fields=['engagement_tier', 'user_id'], condition=models.Q(is_active=True),
+                name='teamsuser_active_tier_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.user_id})"
 
@@ -22,10 +41,358 @@ class UserResponse(models.Model):
     question_date = models.DateField()  # Date when question was asked
     response_text = models.TextField()
     response_time = models.DateTimeField(auto_now_add=True)
+    # Maintained by Postgres; answers are a mix of Russian and English
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('response_text', config='russian')
+            + SearchVector('response_text', config='english')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    # Activity category set by bot2.classifier; '' until classified
+    category = models.CharField(max_length=20, blank=True, default='', db_default='')
     
     class Meta:
         unique_together = ['user', 'question_time', 'question_date']
-        ordering = ['-question_date', '-question_time']
+        # No default ordering: every query that needs an order asks for it.
+        # question_date leads the composite index, so it also serves the
+        # retention range scan on its own.
+        indexes = [
+            models.Index(fields=['question_date', 'user'], name='response_date_user_idx'),
+            GinIndex(fields=['search_vector'], name='response_search_idx'),
+            # Work queue of the classifier: answered rows without a category
+            models.Index(
+                fields=['question_date', 'id'],
+                condition=models.Q(category='') & ~models.Q(response_text=''),
+                name='response_unclassified_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.name} - {self.question_date} {self.question_time} - {self.response_text[:50]}"
+
+    @classmethod
+    def create_placeholders(cls, user_ids, question_date, question_time):
+        """
+        Create empty rows for a slot's questions, before they are sent.
+
+        Users that already have a row for the slot are skipped. Returns the
+        ids of users a row was created for; see settle_placeholders.
+        """
+        if not user_ids:
+            return []
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, question_time, question_date, response_text, response_time)
+                SELECT user_id, %(time)s, %(date)s, '', %(now)s FROM unnest(%(user_ids)s::text[]) AS user_id
+                ON CONFLICT (user_id, question_time, question_date) DO NOTHING
+                RETURNING user_id
+                """,
+                {'user_ids': list(user_ids), 'date': question_date, 'time': question_time, 'now': timezone.now()}
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    @classmethod
+    def settle_placeholders(cls, question_date, question_time, delivered, failed):
+        """
+        Count the slot's delivered questions and drop the rest, in one statement.
+
+        Only questions that reached the user go into
+        DailyUserStats.questions_sent, so answer rates and engagement tiers
+        are not lowered by our own delivery failures. The unanswered
+        placeholders of failed sends are removed: reconcile counts rows as
+        questions, and the next run may ask those users again.
+        """
+        if not delivered and not failed:
+            return
+        table = cls._meta.db_table
+        stats_table = DailyUserStats._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH removed AS (
+                    DELETE FROM {table}
+                    WHERE user_id = ANY(%(failed)s::text[])
+                      AND question_date = %(date)s AND question_time = %(time)s
+                      AND response_text = ''
+                )
+                INSERT INTO {stats_table} AS s (user_id, date, questions_sent, answered, total_reply_latency)
+                SELECT user_id, %(date)s, 1, 0, 0 FROM unnest(%(delivered)s::text[]) AS user_id
+                ON CONFLICT (user_id, date) DO UPDATE
+                SET questions_sent = s.questions_sent + 1
+                """,
+                {
+                    'delivered': list(delivered), 'failed': list(failed),
+                    'date': question_date, 'time': question_time,
+                }
+            )
+
+    @classmethod
+    def record(cls, user_id, question_date, question_time, response_text):
+        """
+        Insert or overwrite the answer for a slot in one statement.
+
+        Runs a single INSERT ... ON CONFLICT DO UPDATE, so concurrent replies
+        for the same slot cannot race each other; the user's DailyUserStats
+        row and engagement tier are updated by the same statement. Returns
+        True when the slot had no answer before this call.
+        """
+        table = cls._meta.db_table
+        stats_table = DailyUserStats._meta.db_table
+        users_table = TeamsUser._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH new_row AS (
+                    -- The id an inserted row gets; an updated row keeps its own
+                    SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id
+                ),
+                upserted AS (
+                    INSERT INTO {table} AS existing (id, user_id, question_time, question_date, response_text, response_time)
+                    SELECT id, %(user_id)s, %(time)s, %(date)s, %(text)s, %(now)s FROM new_row
+                    ON CONFLICT (user_id, question_time, question_date) DO UPDATE
+                    SET response_text = EXCLUDED.response_text,
+                        -- New text needs a new category
+                        category = '',
+                        -- response_time stays the time of the first answer
+                        response_time = CASE
+                            WHEN existing.response_text = '' THEN EXCLUDED.response_time
+                            ELSE existing.response_time
+                        END
+                    -- Read from the row this statement wrote, not from a
+                    -- snapshot taken before it: of two concurrent replies the
+                    -- second one waits for the first and then sees its text
+                    RETURNING id, response_time = %(now)s AS first_answer
+                ),
+                outcome AS (
+                    SELECT u.id = n.id AS inserted, u.first_answer FROM upserted u, new_row n
+                ),
+                stats AS (
+                    INSERT INTO {stats_table} AS s
+                        (user_id, date, questions_sent, answered, first_answer_at, last_answer_at, total_reply_latency)
+                    SELECT
+                        %(user_id)s, %(date)s, inserted::int, first_answer::int,
+                        CASE WHEN first_answer THEN %(now)s END,
+                        CASE WHEN first_answer THEN %(now)s END,
+                        CASE WHEN first_answer THEN {reply_latency_sql('%(date)s', '%(time)s', '%(now)s')} ELSE 0 END
+                    FROM outcome
+                    ON CONFLICT (user_id, date) DO UPDATE
+                    SET questions_sent = s.questions_sent + EXCLUDED.questions_sent,
+                        answered = s.answered + EXCLUDED.answered,
+                        first_answer_at = LEAST(s.first_answer_at, EXCLUDED.first_answer_at),
+                        last_answer_at = GREATEST(s.last_answer_at, EXCLUDED.last_answer_at),
+                        total_reply_latency = s.total_reply_latency + EXCLUDED.total_reply_latency
+                ),
+                -- Answering puts the user back on every slot (engagement.FULL)
+                engaged AS (
+                    UPDATE {users_table} SET engagement_tier = 0
+                    WHERE user_id = %(user_id)s AND engagement_tier <> 0
+                )
+                SELECT first_answer FROM outcome
+                """,
+                {
+                    'user_id': user_id, 'date': question_date, 'time': question_time,
+                    'text': response_text, 'now': timezone.now(),
+                }
+            )
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def append_many(cls, rows):
+        """
+        Append buffered answers to their slots in one statement.
+
+        rows is a list of (user_id, question_date, question_time, text). Text
+        is appended to any answer already stored for the slot instead of
+        replacing it, DailyUserStats is updated for slots that get their
+        first answer and the users are put back on every slot.
+        """
+        if not rows:
+            return 0
+        table = cls._meta.db_table
+        stats_table = DailyUserStats._meta.db_table
+        users_table = TeamsUser._meta.db_table
+        now = timezone.now()
+        values = ', '.join(['(%s::text, %s::time, %s::date, %s::text, %s::timestamptz)'] * len(rows))
+        params = []
+        for user_id, question_date, question_time, text in rows:
+            params.extend([user_id, question_time, question_date, text, now])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH incoming AS (
+                    -- id is the one an inserted row gets, as in record()
+                    SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id, v.*
+                    FROM (VALUES {values}) AS v (user_id, question_time, question_date, response_text, response_time)
+                ),
+                upserted AS (
+                    INSERT INTO {table} AS existing (id, user_id, question_time, question_date, response_text, response_time)
+                    SELECT id, user_id, question_time, question_date, response_text, response_time FROM incoming
+                    ON CONFLICT (user_id, question_time, question_date) DO UPDATE
+                    SET response_text = CASE
+                            WHEN existing.response_text = '' THEN EXCLUDED.response_text
+                            ELSE existing.response_text || E'\\n' || EXCLUDED.response_text
+                        END,
+                        category = '',
+                        response_time = CASE
+                            WHEN existing.response_text = '' THEN EXCLUDED.response_time
+                            ELSE existing.response_time
+                        END
+                    -- As in record(): taken from the rows written here
+                    RETURNING id, user_id, question_time, question_date, response_time
+                ),
+                outcome AS (
+                    SELECT
+                        i.user_id, i.question_date, i.response_time,
+                        u.id = i.id AS inserted,
+                        u.response_time = i.response_time AS first_answer,
+                        {reply_latency_sql('i.question_date', 'i.question_time', 'i.response_time')} AS latency
+                    FROM incoming i
+                    JOIN upserted u USING (user_id, question_time, question_date)
+                ),
+                stats AS (
+                    INSERT INTO {stats_table} AS s
+                        (user_id, date, questions_sent, answered, first_answer_at, last_answer_at, total_reply_latency)
+                    SELECT
+                        user_id, question_date,
+                        count(*) FILTER (WHERE inserted),
+                        count(*) FILTER (WHERE first_answer),
+                        min(response_time) FILTER (WHERE first_answer),
+                        max(response_time) FILTER (WHERE first_answer),
+                        coalesce(sum(latency) FILTER (WHERE first_answer), 0)
+                    FROM outcome
+                    GROUP BY user_id, question_date
+                    ON CONFLICT (user_id, date) DO UPDATE
+                    SET questions_sent = s.questions_sent + EXCLUDED.questions_sent,
+                        answered = s.answered + EXCLUDED.answered,
+                        first_answer_at = LEAST(s.first_answer_at, EXCLUDED.first_answer_at),
+                        last_answer_at = GREATEST(s.last_answer_at, EXCLUDED.last_answer_at),
+                        total_reply_latency = s.total_reply_latency + EXCLUDED.total_reply_latency
+                ),
+                -- Answering puts the user back on every slot (engagement.FULL)
+                engaged AS (
+                    UPDATE {users_table} SET engagement_tier = 0
+                    WHERE user_id IN (SELECT user_id FROM incoming) AND engagement_tier <> 0
+                )
+                SELECT count(*) FROM upserted
+                """,
+                params
+            )
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def set_categories(cls, rows):
+        """
+        Store classifier output in one UPDATE.
+
+        rows is a list of (id, question_date, text_md5, category). A row is
+        only updated while it is still unclassified and its text still has
+        the classified digest, so an answer edited in the meantime is left
+        for the next run. Returns the number of rows updated.
+        """
+        if not rows:
+            return 0
+        table = cls._meta.db_table
+        values = ', '.join(['(%s::bigint, %s::date, %s::text, %s::text)'] * len(rows))
+        params = [value for row in rows for value in row]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} AS r
+                SET category = v.category
+                FROM (VALUES {values}) AS v (id, question_date, text_md5, category)
+                WHERE r.id = v.id
+                  AND r.question_date = v.question_date
+                  AND r.category = ''
+                  AND md5(r.response_text) = v.text_md5
+                """,
+                params
+            )
+            return cursor.rowcount
+
+
+def reply_latency_sql(date_sql, time_sql, answered_at_sql):
+    """SQL for the seconds between a slot's question and its answer (never negative)"""
+    return (
+        f"GREATEST(0, EXTRACT(EPOCH FROM {answered_at_sql} - "
+        f"((({date_sql})::date + ({time_sql})::time) AT TIME ZONE '{settings.TIME_ZONE}')))"
+    )
+
+
+class DailyUserStats(models.Model):
+    """
+    Per-user, per-day counters, kept up to date as questions are sent and
+    answered so reports read one row per day instead of raw responses.
+    """
+    user = models.ForeignKey(TeamsUser, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    questions_sent = models.PositiveIntegerField(default=0)
+    answered = models.PositiveIntegerField(default=0)
+    first_answer_at = models.DateTimeField(blank=True, null=True)
+    last_answer_at = models.DateTimeField(blank=True, null=True)
+    total_reply_latency = models.FloatField(default=0)  # Seconds, summed over answered questions
+
+    class Meta:
+        unique_together = ['user', 'date']
+        indexes = [
+            models.Index(fields=['date', 'user'], name='dailystats_date_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.date}: {self.answered}/{self.questions_sent}"
+
+    @property
+    def average_reply_latency(self):
+        """Average seconds from question to first answer, or None"""
+        if not self.answered:
+            return None
+        return self.total_reply_latency / self.answered
+
+    @property
+    def response_rate(self):
+        if not self.questions_sent:
+            return 0.0
+        return min(1.0, self.answered / self.questions_sent)
+
+    @classmethod
+    def reconcile(cls, start_date, end_date):
+        """
+        Recompute the rows for start_date..end_date from UserResponse.
+
+        Only rows that drifted are written. Returns how many were repaired.
+        """
+        table = cls._meta.db_table
+        responses_table = UserResponse._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} AS s
+                    (user_id, date, questions_sent, answered, first_answer_at, last_answer_at, total_reply_latency)
+                SELECT
+                    user_id, question_date,
+                    count(*),
+                    count(*) FILTER (WHERE response_text <> ''),
+                    min(response_time) FILTER (WHERE response_text <> ''),
+                    max(response_time) FILTER (WHERE response_text <> ''),
+                    coalesce(sum({reply_latency_sql('question_date', 'question_time', 'response_time')})
+                             FILTER (WHERE response_text <> ''), 0)
+                FROM {responses_table}
+                WHERE question_date BETWEEN %s AND %s
+                GROUP BY user_id, question_date
+                ON CONFLICT (user_id, date) DO UPDATE
+                SET questions_sent = EXCLUDED.questions_sent,
+                    answered = EXCLUDED.answered,
+                    first_answer_at = EXCLUDED.first_answer_at,
+                    last_answer_at = EXCLUDED.last_answer_at,
+                    total_reply_latency = EXCLUDED.total_reply_latency
+                WHERE (s.questions_sent, s.answered, s.first_answer_at, s.last_answer_at)
+                    IS DISTINCT FROM
+                    (EXCLUDED.questions_sent, EXCLUDED.answered, EXCLUDED.first_answer_at, EXCLUDED.last_answer_at)
+                   OR abs(s.total_reply_latency - EXCLUDED.total_reply_latency) > 1
+                """,
+                [start_date, end_date]
+            )
+            return cursor.rowcount
@@ -0,0 +1,184 @@
+"""
+Monthly range partitions of the UserResponse table.
+
+The table is partitioned by question_date (see migration 0003). Partitions
+are named <table>_pYYYYMM and cover one calendar month each; a DEFAULT
+partition catches anything outside the created ranges. Rows that landed
+there because their month's partition was missing are moved into it when
+it is created.
+"""
+import logging
+import re
+from datetime import date
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from .models import UserResponse
+from .slots import get_kazakhstan_time
+
+logger = logging.getLogger(__name__)
+
+TABLE = UserResponse._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_RE = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}{month.month:02d}'
+
+
+def create_partition_sql(month, table=TABLE):
+    """DDL for the partition holding the given month"""
+    return (
+        f'CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {table} '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def list_partitions():
+    """Monthly partitions as {month start: partition name}"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_partition(month):
+    """
+    Create the partition for month, moving its rows out of DEFAULT first.
+
+    Postgres refuses to create a partition while DEFAULT holds rows of its
+    range, so DEFAULT is detached, the partition created, the rows moved
+    and DEFAULT attached again, all in one transaction.
+    """
+    bounds = [month, add_months(month, 1)]
+    in_range = 'question_date >= %s AND question_date < %s'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})', bounds)
+        if not cursor.fetchone()[0]:
+            cursor.execute(create_partition_sql(month))
+            return 0
+
+        # search_vector is generated and cannot be inserted
+        columns = ', '.join(
+            field.column for field in UserResponse._meta.concrete_fields if not field.generated
+        )
+        # The foreign key checks of the moved rows are deferred by default,
+        # and ATTACH refuses to run with checks still pending
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(create_partition_sql(month))
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING {columns}
+            )
+            INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM moved
+            """,
+            bounds
+        )
+        moved = cursor.rowcount
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    logger.warning(f"Moved {moved} responses from {DEFAULT_PARTITION} into {partition_name(month)}")
+    return moved
+
+
+def ensure_month_partitions(months):
+    """Create the partitions for the given month starts that do not exist yet"""
+    existing = list_partitions()
+    created = []
+    for month in sorted(set(months)):
+        if month in existing:
+            continue
+        # One month failing must not keep the later ones from being created
+        try:
+            create_partition(month)
+        except DatabaseError as e:
+            logger.error(f"Не смог создать партицию {partition_name(month)}: {e}")
+            continue
+        created.append(partition_name(month))
+
+    if created:
+        logger.info(f"Created response partitions: {', '.join(created)}")
+    return created
+
+
+def default_partition_rows():
+    """Rows in DEFAULT, i.e. outside every monthly partition; should be 0"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {DEFAULT_PARTITION}')
+        return cursor.fetchone()[0]
+
+
+def ensure_partitions(start=None, months_ahead=None):
+    """Create monthly partitions from start's month up to months_ahead months ahead"""
+    if months_ahead is None:
+        months_ahead = settings.RESPONSE_PARTITIONS_AHEAD
+    today = get_kazakhstan_time().date()
+    month = month_start(start or today)
+    last = add_months(month_start(today), months_ahead)
+
+    months = []
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    created = ensure_month_partitions(months)
+
+    stray = default_partition_rows()
+    if stray:
+        logger.warning(f"{DEFAULT_PARTITION} holds {stray} responses outside every monthly partition")
+    return created
+
+
+def expired_partitions(cutoff):
+    """Partitions that end on or before cutoff, as [(month start, name)] oldest first"""
+    return [
+        (month, name)
+        for month, name in sorted(list_partitions().items())
+        if add_months(month, 1) <= cutoff
+    ]
+
+
+def drop_partition(name):
+    """Detach and drop a single partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+    logger.info(f"Dropped response partition {name}")
+
+
+def drop_partitions_before(cutoff):
+    """
+    Detach and drop every partition that ends on or before cutoff.
+
+    Cost depends on the number of partitions, not rows: nothing is scanned or
+    collected in Python.
+    """
+    dropped = []
+    for month, name in expired_partitions(cutoff):
+        drop_partition(name)
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,17 @@
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """Shared Redis client for bot state (connection pool is created lazily)"""
+    global _client
+    if _client is None:
+        import redis
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=2,
+            socket_connect_timeout=2,
+        )
+    return _client
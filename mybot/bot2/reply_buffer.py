@@ -0,0 +1,96 @@
+import logging
+import time as time_module
+from datetime import date, time
+from bot1.db_router import pin_to_primary
+from django.conf import settings
+from .commands import invalidate_user_commands
+from .models import UserResponse
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'hourlybot:reply_buffer:{user_id}:{date}:{time}'
+PENDING_KEY = 'hourlybot:reply_buffer:pending'
+
+# Buffered text is kept for a day at most, even if flushing stops
+BUFFER_TTL_SECONDS = 24 * 60 * 60
+
+
+def buffer_reply(user_id, question_date, question_time, text):
+    """Append a reply to the per-user, per-slot buffer, returns False if Redis is unavailable"""
+    key = BUFFER_KEY.format(
+        user_id=user_id,
+        date=question_date.isoformat(),
+        time=question_time.strftime('%H:%M'),
+    )
+    try:
+        pipe = get_redis().pipeline(transaction=True)
+        pipe.rpush(key, text)
+        pipe.expire(key, BUFFER_TTL_SECONDS)
+        # The score is the last append, so a burst keeps pushing the flush back
+        pipe.zadd(PENDING_KEY, {key: time_module.time()})
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.error(f"Не смог записать ответ в буфер Redis: {e}")
+        return False
+
+
+def parse_buffer_key(key):
+    """Split a buffer key back into (user_id, question_date, question_time)"""
+    prefix = 'hourlybot:reply_buffer:'
+    # user ids may contain ':' so the date and time are taken from the right
+    user_id, day, hour, minute = key[len(prefix):].rsplit(':', 3)
+    return user_id, date.fromisoformat(day), time(int(hour), int(minute))
+
+
+def flush_reply_buffers(batch_size=500):
+    """
+    Write buffers that have been quiet for the debounce window to Postgres.
+
+    Returns how many buffer keys were taken off the pending set, which is
+    what tells the caller whether more may be waiting; buffers that had
+    already expired or were empty count too.
+    """
+    client = get_redis()
+    cutoff = time_module.time() - settings.RESPONSE_WRITE_BEHIND_DEBOUNCE_SECONDS
+    keys = client.zrangebyscore(PENDING_KEY, '-inf', cutoff, start=0, num=batch_size)
+    if not keys:
+        return 0
+
+    # Take each buffer atomically; anything appended afterwards starts a new one
+    pipe = client.pipeline(transaction=True)
+    for key in keys:
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+    pipe.zrem(PENDING_KEY, *keys)
+    results = pipe.execute()
+
+    rows = []
+    taken = {}
+    for i, key in enumerate(keys):
+        texts = results[i * 2]
+        if not texts:
+            continue
+        taken[key] = texts
+        user_id, question_date, question_time = parse_buffer_key(key)
+        rows.append((user_id, question_date, question_time, '\n'.join(texts)))
+
+    try:
+        UserResponse.append_many(rows)
+    except Exception:
+        # Put the text back so the next flush retries it
+        pipe = client.pipeline(transaction=True)
+        for key, texts in taken.items():
+            pipe.lpush(key, *reversed(texts))
+            pipe.expire(key, BUFFER_TTL_SECONDS)
+            pipe.zadd(PENDING_KEY, {key: 0})
+        pipe.execute()
+        raise
+
+    flushed_users = {row[0] for row in rows}
+    invalidate_user_commands(*flushed_users)
+    for user_id in flushed_users:
+        pin_to_primary(user_id)
+    logger.info(f"Flushed {len(rows)} buffered replies from {len(keys)} buffers")
+    return len(keys)
@@ -0,0 +1,49 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from .models import UserResponse
+from .slots import get_kazakhstan_time
+
+
+def search_query(terms):
+    """Match the terms in either language, with web-search syntax ("quoted", or, -not)"""
+    return (
+        SearchQuery(terms, config='russian', search_type='websearch')
+        | SearchQuery(terms, config='english', search_type='websearch')
+    )
+
+
+def search_responses(terms, start=None, end=None, tenant_id=None, user_id=None, page=1, page_size=None):
+    """
+    Responses matching terms, best match first, one page at a time.
+
+    The @@ match is answered by the GIN index on search_vector; only matching
+    rows are ranked. Without start the search covers the last
+    SEARCH_DEFAULT_DAYS days, so partition pruning keeps it to a few months
+    of data. Returns (rows, has_next): one extra row is fetched instead of
+    counting every match.
+    """
+    page_size = page_size or settings.SEARCH_PAGE_SIZE
+    if start is None:
+        start = get_kazakhstan_time().date() - timedelta(days=settings.SEARCH_DEFAULT_DAYS - 1)
+
+    query = search_query(terms)
+    qs = UserResponse.objects.filter(search_vector=query, question_date__gte=start)
+    if end:
+        qs = qs.filter(question_date__lte=end)
+    if tenant_id:
+        qs = qs.filter(user__tenant_id=tenant_id)
+    if user_id:
+        qs = qs.filter(user_id=user_id)
+
+    offset = (page - 1) * page_size
+    rows = list(
+        qs.annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-question_date', '-question_time', 'id')
+        .values(
+            'user_id', 'question_date', 'question_time', 'response_text', 'rank',
+            user_name=F('user__name'),
+        )[offset:offset + page_size + 1]
+    )
+    return rows[:page_size], len(rows) > page_size
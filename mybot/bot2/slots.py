@@ -0,0 +1,117 @@
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from django.conf import settings
+from django.utils import timezone
+import pytz
+from .models import UserResponse
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Question slots in Kazakhstan time (no questions during lunch)
+QUESTION_TIMES = [
+    time(9, 0), time(9, 30),
+    time(10, 0), time(10, 30),
+    time(11, 0), time(11, 30),
+    time(12, 0), time(12, 30),
+    time(14, 0), time(14, 30),
+    time(15, 0), time(15, 30),
+    time(16, 0), time(16, 30),
+    time(17, 0),
+]
+
+SUMMARY_TIME = time(17, 0)
+
+OPEN_SLOT_KEY = 'hourlybot:open_slot:{user_id}'
+
+# Beat may publish a few milliseconds before the slot it fires for
+EARLY_PUBLISH_TOLERANCE = timedelta(seconds=5)
+
+
+def get_kazakhstan_time():
+    """Get current time in Kazakhstan timezone"""
+    kazakhstan_tz = pytz.timezone('Asia/Almaty')
+    return timezone.now().astimezone(kazakhstan_tz)
+
+
+def slot_at(moment):
+    """Most recent question slot at or before the given Kazakhstan time"""
+    current = moment.time()
+    for q_time in reversed(QUESTION_TIMES):
+        if current >= q_time:
+            return q_time
+    return None
+
+
+def scheduled_at(reference, slot=None):
+    """
+    Kazakhstan datetime of the run a scheduled task was meant for.
+
+    reference is when the run was due (its ETA or publish time). With slot
+    ('HH:MM', from the PeriodicTask kwargs) it is the latest such time at
+    or before reference, otherwise the question slot reference falls in.
+    """
+    kazakhstan_tz = pytz.timezone('Asia/Almaty')
+    reference = reference.astimezone(kazakhstan_tz) + EARLY_PUBLISH_TOLERANCE
+    if slot is None:
+        slot_time = slot_at(reference)
+        if slot_time is None:
+            return None
+    else:
+        hour, minute = map(int, slot.split(':'))
+        slot_time = time(hour, minute)
+    moment = kazakhstan_tz.localize(datetime.combine(reference.date(), slot_time))
+    if moment > reference:
+        moment = kazakhstan_tz.localize(datetime.combine(reference.date() - timedelta(days=1), slot_time))
+    return moment
+
+
+def publish_open_slots(user_ids, slot_date, slot_time):
+    """Mark slot_date/slot_time as the currently open slot for each user"""
+    if not user_ids:
+        return
+    value = json.dumps({'date': slot_date.isoformat(), 'time': slot_time.strftime('%H:%M')})
+    ttl = settings.OPEN_SLOT_TTL_SECONDS
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(OPEN_SLOT_KEY.format(user_id=user_id), value, ex=ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Не смог сохранить открытый слот в Redis: {e}")
+
+
+def resolve_open_slot(user_id):
+    """
+    Slot an incoming reply belongs to, as (date, time) or None.
+
+    The open slot published by the fan-out wins, so a late reply still lands
+    on the question the user was actually asked. When Redis has nothing
+    (expired or unavailable) the latest question the user got today is
+    looked up in Postgres, and only without one the schedule decides.
+    """
+    try:
+        raw = get_redis().get(OPEN_SLOT_KEY.format(user_id=user_id))
+    except Exception as e:
+        logger.warning(f"Redis недоступен, слот берется из расписания: {e}")
+        raw = None
+
+    if raw:
+        data = json.loads(raw)
+        hour, minute = map(int, data['time'].split(':'))
+        return date.fromisoformat(data['date']), time(hour, minute)
+
+    now = get_kazakhstan_time()
+    slot = slot_at(now)
+    if slot is None:
+        return None
+    # Users on a lower engagement tier are not asked at every slot
+    asked = (
+        UserResponse.objects
+        .filter(user_id=user_id, question_date=now.date(), question_time__lte=slot)
+        .order_by('-question_time')
+        .values_list('question_time', flat=True)
+        .first()
+    )
+    return now.date(), asked or slot
@@ -1,51 +1,52 @@
 import logging
+from collections import defaultdict
 from datetime import datetime, time, timedelta
+from django.db.models import Q
 from django.utils import timezone
 from celery import shared_task
-from .models import TeamsUser, UserResponse
+from bot1.db_router import reporting
+from .models import DailyUserStats, TeamsUser, UserResponse
+from . import archive, classifier, delivery, engagement, metrics, partitions, reply_buffer, telemetry
+from .access_token import get_access_token, invalidate_token
+from .commands import invalidate_user_commands
+from .slots import QUESTION_TIMES, SUMMARY_TIME, get_kazakhstan_time, publish_open_slots, scheduled_at, slot_at
 import pytz
 from django.conf import settings
 import json
-import requests
-import openai
 
 logger = logging.getLogger(__name__)
 
-def get_kazakhstan_time():
-    """Get current time in Kazakhstan timezone"""
-    kazakhstan_tz = pytz.timezone('Asia/Almaty')
-    return timezone.now().astimezone(kazakhstan_tz)
+def scheduled_run(request, slot=None):
+    """Slot a scheduled run is for: from its kwargs, else its ETA or publish time, else now"""
+    due = telemetry.due_at(request)
+    reference = datetime.fromtimestamp(due, tz=pytz.utc) if due is not None else get_kazakhstan_time()
+    return scheduled_at(reference, slot)
 
-def get_access_token():
-    """Get access token from Microsoft"""
-    try:
-        token_url = "https://login.microsoftonline.com/botframework.com/oauth2/v2.0/token"
-        data = {
-            'grant_type': 'client_credentials',
-            'client_id': settings.BOT_FRAMEWORK_APP_ID,
-            'client_secret': settings.BOT_FRAMEWORK_APP_PASSWORD,
-            'scope': 'https://api.botframework.com/.default'
-        }
-        response = requests.post(token_url, data=data, timeout=10)
-        if response.status_code == 200:
-            return response.json()['access_token']
-        logger.error(f"Не смог получить доступ к токену: {response.status_code} - {response.text}")
-    except Exception as e:
-        logger.error(f"Ошибка получения токена: {e}")
-    return None
+def within_deadline(task_name, scheduled, window):
+    """
+    True if the run for scheduled may still go out, recording how late it is.
 
-def is_question_time(current_time):
-    """Check if current time is a valid question time (every 30 minutes from 9:00 to 17:00)"""
-    start_time = time(9, 0)
-    end_time   = time(17, 0)
-    return start_time <= current_time <= end_time and current_time.minute in (0, 30)
+    A queue backlog delays a slot instead of dropping it, up to window
+    seconds; past that the slot is counted as missed.
+    """
+    lateness = (get_kazakhstan_time() - scheduled).total_seconds()
+    labels = {'task': task_name}
+    if lateness > window:
+        metrics.incr('scheduled_slots_missed_total', labels)
+        logger.error(f"{task_name}: slot {scheduled:%Y-%m-%d %H:%M} missed, {lateness:.0f}s late")
+        return False
+    metrics.observe('scheduled_slot_lateness_seconds', max(0.0, lateness), labels)
+    if lateness > settings.SCHEDULE_ON_TIME_SECONDS:
+        metrics.incr('scheduled_slots_late_total', labels)
+        logger.warning(f"{task_name}: slot {scheduled:%Y-%m-%d %H:%M} is {lateness:.0f}s late")
+    return True
 
 def send_message_via_http(user, message_text, access_token):
-    """Send message via HTTP request"""
+    """Send message via HTTP request; returns (outcome, reason), see bot2.delivery"""
+    if not user.conversation_reference:
+        logger.warning(f"Нет ссылки на чат для пользователя {user.name}")
+        return delivery.PERMANENT, delivery.NO_REFERENCE
     try:
-        if not user.conversation_reference:
-            logger.warning(f"Нет ссылки на чат для пользователя {user.name}")
-            return False
         conv_ref = json.loads(user.conversation_reference)
         activity = {
             "type": "message",
@@ -60,36 +61,56 @@ def send_message_via_http(user, message_text, access_token):
             f"{conv_ref['serviceUrl']}"
             f"/v3/conversations/{conv_ref['conversation']['id']}/activities"
         )
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type':  'application/json'
-        }
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Битая ссылка на чат для пользователя {user.name}: {e}")
+        return delivery.PERMANENT, delivery.INVALID_REFERENCE
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type':  'application/json'
+    }
+    try:
+        import requests
         resp = requests.post(url, headers=headers, json=activity, timeout=10)
-        if resp.status_code in (200, 201):
-            return True
-        logger.error(f"HTTP send failed: {resp.status_code} - {resp.text}")
     except Exception as e:
+        # Timeouts and connection errors are on our side of the connector
         logger.error(f"Ошибка отправки через HTTP: {e}")
-    return False
-
-# ——— Настройка OpenAI ———
-openai.api_key = settings.OPENAI_API_KEY
+        return delivery.NOT_SENT, type(e).__name__
+    outcome, reason = delivery.classify(resp.status_code)
+    if outcome == delivery.UNAUTHORIZED:
+        # The next send fetches a fresh token instead of reusing this one
+        invalidate_token()
+    if outcome != delivery.DELIVERED:
+        logger.error(f"HTTP send failed: {resp.status_code} - {resp.text}")
+    return outcome, reason
 
 def get_openai_summary(responses):
     """
-    Формируем prompt из списка UserResponse и запрашиваем у ChatGPT
-    краткое обобщение активности за день.
+    Запрашиваем у ChatGPT краткое обобщение активности за день.
+
+    В prompt уходят только категории ответов по слотам, сами тексты
+    ответов остаются у нас.
     """
-    lines = []
+    slots_by_category = defaultdict(list)
+    unanswered = 0
     for r in responses:
-        ts = r.question_time.strftime('%H:%M')
-        txt = r.response_text or "Нет ответа"
-        lines.append(f"{ts} — {txt}")
+        if r.response_text:
+            slots_by_category[r.category or classifier.OTHER].append(r.question_time.strftime('%H:%M'))
+        else:
+            unanswered += 1
+    lines = [
+        f"{classifier.label(category)}: {count} ({', '.join(slots_by_category[category])})"
+        for category, count in classifier.category_breakdown(responses)
+    ]
+    if unanswered:
+        lines.append(f"Без ответа: {unanswered}")
     prompt = (
         "Ты — ассистент, задача которого кратко и ясно обобщить активность пользователя за день.\n"
-        "Сформируй один абзац, где перечислишь основные моменты.\n\n"
-        "Данные:\n" + "\n".join(lines)
+        "Сформируй один абзац по распределению времени между видами работы.\n\n"
+        "Ответов по категориям (время вопросов в скобках):\n" + "\n".join(lines)
     )
+    # Imported here: only the summaries worker ever calls OpenAI
+    import openai
+    openai.api_key = settings.OPENAI_API_KEY
     resp = openai.chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[
@@ -102,42 +123,64 @@ def get_openai_summary(responses):
 
     return resp.choices[0].message.content.strip()
 
-@shared_task
-def send_activity_questions():
-    """Send activity questions to all active users at 30-minute intervals"""
+def settle_questions(day, slot_time, user_ids, results):
+    """Count the questions that reached user_ids and drop the placeholders of the rest"""
+    delivered = {user_id for user_id in user_ids if results.get(user_id, (None,))[0] == delivery.DELIVERED}
+    failed = set(user_ids) - delivered
+    UserResponse.settle_placeholders(day, slot_time, delivered, failed)
+    # Cached 'status' and 'summary' replies still show the old question count
+    invalidate_user_commands(*delivered)
+
+# Nobody waits on these tasks, so none of them stores a result: the return
+# values only show up in the worker log
+@shared_task(bind=True, ignore_result=True)
+def send_activity_questions(self, slot=None):
+    """Send the question of one 30-minute slot to the active users due at it"""
     try:
-        now     = get_kazakhstan_time()
-        current = now.time()
-        today   = now.date()
-        logger.info(f"Activity check at {now.strftime('%H:%M')}")
-        if not is_question_time(current):
+        scheduled = scheduled_run(self.request, slot)
+        if scheduled is None or scheduled.time() not in QUESTION_TIMES:
+            logger.info(f"No question slot for this run ({slot or 'no slot given'})")
+            return
+        logger.info(f"Activity questions for {scheduled:%Y-%m-%d %H:%M}")
+        if not within_deadline(self.name, scheduled, settings.QUESTION_LATENESS_WINDOW_SECONDS):
             return
 
-        users = TeamsUser.objects.filter(is_active=True)
-        if not users.exists():
-            logger.warning("No active users")
+        day, slot_time = scheduled.date(), scheduled.time()
+        # Users who stopped answering are asked less often; only the tiers
+        # due at this slot are loaded
+        users = list(TeamsUser.objects.filter(is_active=True, engagement_tier__in=engagement.due_tiers(slot_time)))
+        if not users:
+            logger.warning("No active users due at this slot")
             return
 
         token = get_access_token()
         if not token:
             return
 
+        # Only users without a row yet are asked, so a redelivered run does
+        # not ask anyone twice
+        created = set(UserResponse.create_placeholders([u.user_id for u in users], day, slot_time))
+        users = [u for u in users if u.user_id in created]
+
+        # Open the slot before sending so even the fastest reply is matched to
+        # it through Redis, without a DB lookup
+        publish_open_slots([u.user_id for u in users], day, slot_time)
+
         text = "Что вы делаете сейчас?"
+        results = {}
         for u in users:
             try:
-                UserResponse.objects.get_or_create(
-                    user=u,
-                    question_time=current,
-                    question_date=today,
-                    defaults={'response_text': ''}
-                )
-                send_message_via_http(u, text, token)
+                results[u.user_id] = send_message_via_http(u, text, token)
             except Exception as e:
                 logger.error(f"Error sending question to {u.name}: {e}")
+        # Unreachable users drop out of the next fan-out
+        delivery.record_results(results)
+        settle_questions(day, slot_time, created, results)
     except Exception as e:
         logger.error(f"Ошибка в send_activity_questions: {e}")
+        raise
 
-@shared_task
+@shared_task(ignore_result=True)
 def send_message_to_user(user_id: str, message_text: str):
     """Send a message to a specific user"""
     try:
@@ -146,65 +189,189 @@ def send_message_to_user(user_id: str, message_text: str):
             return
         token = get_access_token()
         if token:
-            send_message_via_http(user, message_text, token)
+            delivery.record_results({user.user_id: send_message_via_http(user, message_text, token)})
     except Exception as e:
         logger.error(f"Ошибка в send_message_to_user: {e}")
+        raise
 
-@shared_task
-def send_daily_summary():
+@shared_task(ignore_result=True)
+def set_users_active(user_ids, active):
+    """Activate or deactivate users in bulk (admin action)"""
+    try:
+        now = timezone.now()
+        users = TeamsUser.objects.filter(user_id__in=user_ids)
+        if active:
+            users = users.filter(is_active=False)
+            # A manual activation also gives unreachable users a fresh start
+            fields = {'delivery_failures': 0, 'deactivated_at': None, 'deactivation_reason': '', 'engagement_tier': engagement.FULL}
+        else:
+            # Users the bot deactivated are included, so their next message
+            # does not resubscribe them against the admin's decision
+            users = users.filter(Q(is_active=True) | Q(deactivation_reason__in=delivery.AUTO_REASONS))
+            fields = {'deactivated_at': now, 'deactivation_reason': delivery.ADMIN}
+        updated = users.update(is_active=active, updated_at=now, **fields)
+        invalidate_user_commands(*user_ids)
+        logger.info(f"Set is_active={active} for {updated} users")
+        return updated
+    except Exception as e:
+        logger.error(f"Ошибка в set_users_active: {e}")
+        raise
+
+@shared_task(ignore_result=True)
+def resend_question(user_ids):
+    """Ask the current slot's question again (admin action)"""
+    try:
+        users = list(TeamsUser.objects.filter(user_id__in=user_ids, is_active=True))
+        if not users:
+            return 0
+        token = get_access_token()
+        if not token:
+            return 0
+
+        now = get_kazakhstan_time()
+        slot = slot_at(now)
+        created = []
+        if slot is not None:
+            ids = [u.user_id for u in users]
+            created = UserResponse.create_placeholders(ids, now.date(), slot)
+            publish_open_slots(ids, now.date(), slot)
+
+        results = {u.user_id: send_message_via_http(u, "Что вы делаете сейчас?", token) for u in users}
+        delivery.record_results(results)
+        if created:
+            settle_questions(now.date(), slot, created, results)
+        sent = sum(1 for outcome, _ in results.values() if outcome == delivery.DELIVERED)
+        logger.info(f"Resent question to {sent} of {len(users)} users")
+        return sent
+    except Exception as e:
+        logger.error(f"Ошибка в resend_question: {e}")
+        raise
+
+@shared_task(bind=True, ignore_result=True)
+def send_daily_summary(self, slot=None):
     """Send AI summary to all active users at 17:00"""
     try:
-        now     = get_kazakhstan_time()
-        today = now.date()
-        current = now.time()
-        logger.info(f"AI summary check at {now.strftime('%H:%M')}")
-        if current.hour != 17 and current.minute != 0:
+        scheduled = scheduled_run(self.request, slot or SUMMARY_TIME.strftime('%H:%M'))
+        today = scheduled.date()
+        logger.info(f"AI summary for {today} (scheduled {scheduled:%H:%M})")
+        if not within_deadline(self.name, scheduled, settings.SUMMARY_LATENESS_WINDOW_SECONDS):
             return
 
-        users = TeamsUser.objects.filter(is_active=True)
-        if not users.exists():
-            logger.warning("No active users")
-            return
+        # Tag today's answers first, so the summaries can group them
+        classifier.classify_pending(since=today)
+
+        # Summary loading is a read-only workload and can use the replica
+        with reporting():
+            users = list(TeamsUser.objects.filter(is_active=True))
+            if not users:
+                logger.warning("No active users")
+                return
+
+            # One query for everyone's answers instead of two per user
+            responses_by_user = defaultdict(list)
+            day_responses = (
+                UserResponse.objects
+                .filter(question_date=today, user__is_active=True)
+                .order_by('user_id', 'question_time')
+            )
+            for r in day_responses:
+                responses_by_user[r.user_id].append(r)
 
         token = get_access_token()
         if not token:
             return
 
+        results = {}
         for u in users:
             try:
-                qs = u.responses.filter(question_date = today).order_by('question_time')
-                if not qs.exists():
+                responses = responses_by_user.get(u.user_id)
+                if not responses:
                     continue
-                ai_text = get_openai_summary(qs)
-                msg = f"📊 **Ежедневный отчёт для {u.name}**\n\n{ai_text}"
-                send_message_via_http(u, msg, token)
+                ai_text = get_openai_summary(responses)
+                breakdown = "\n".join(
+                    f"• {classifier.label(category)}: {count}" for category, count in classifier.category_breakdown(responses)
+                )
+                msg = f"📊 **Ежедневный отчёт для {u.name}**\n\n{ai_text}\n\n{breakdown}"
+                results[u.user_id] = send_message_via_http(u, msg, token)
             except Exception as e:
                 logger.error(f"Error sending AI summary to {u.name}: {e}")
+        delivery.record_results(results)
     except Exception as e:
         logger.error(f"Ошибка в send_ai_summary: {e}")
+        raise
 
 
-@shared_task
+@shared_task(ignore_result=True)
 def cleanup_old_responses():
-    """Task to clean up old responses (older than 30 days)"""
+    """Archive and remove expired responses, and create upcoming partitions"""
     try:
-        cutoff = get_kazakhstan_time().date() - timedelta(days=30)
-        deleted_count = UserResponse.objects.filter(question_date__lt=cutoff).delete()[0]
-        logger.info(f"Deleted {deleted_count} old responses")
-        return deleted_count
+        partitions.ensure_partitions()
+        cutoff = get_kazakhstan_time().date() - timedelta(days=settings.RESPONSE_RETENTION_DAYS)
+        archived = archive.archive_expired_responses(cutoff)
+        logger.info(f"Archived and removed {archived} old responses")
+        return archived
     except Exception as e:
         logger.error(f"Ошибка удаления старых ответов: {e}")
-        return 0
+        raise
+
+@shared_task(ignore_result=True)
+def reconcile_daily_stats(days=2):
+    """Repair drift in DailyUserStats for the last few days"""
+    try:
+        today = get_kazakhstan_time().date()
+        repaired = DailyUserStats.reconcile(today - timedelta(days=days - 1), today)
+        logger.info(f"Reconciled daily stats, {repaired} rows repaired")
+        return repaired
+    except Exception as e:
+        logger.error(f"Ошибка в reconcile_daily_stats: {e}")
+        raise
+
+@shared_task(ignore_result=True)
+def update_engagement_tiers():
+    """Back off the question frequency of users who stopped answering"""
+    try:
+        moved = engagement.update_tiers(get_kazakhstan_time().date())
+        logger.info(f"Engagement tiers updated: {moved or 'no changes'}")
+        return sum(moved.values())
+    except Exception as e:
+        logger.error(f"Ошибка в update_engagement_tiers: {e}")
+        raise
+
+@shared_task(ignore_result=True)
+def flush_reply_buffers():
+    """Flush write-behind reply buffers to Postgres in batches"""
+    try:
+        total = 0
+        while True:
+            # Counted in buffers, not rows: a batch of expired buffers
+            # writes nothing but more may be due behind it
+            taken = reply_buffer.flush_reply_buffers()
+            total += taken
+            if not taken:
+                break
+        return total
+    except Exception as e:
+        logger.error(f"Ошибка в flush_reply_buffers: {e}")
+        raise
+
+@shared_task(ignore_result=True)
+def classify_responses():
+    """Tag new and edited answers with an activity category"""
+    try:
+        return classifier.classify_pending()
+    except Exception as e:
+        logger.error(f"Ошибка в classify_responses: {e}")
+        raise
 
-@shared_task
+@shared_task(ignore_result=True)
 def health_check():
     """Health check task to verify bot is working"""
     try:
         now = get_kazakhstan_time()
         active = TeamsUser.objects.filter(is_active=True).count()
+        # The shared cached token: a new one is only fetched when it is due
         token_ok = bool(get_access_token())
         logger.info(f"Health: {now.strftime('%Y-%m-%d %H:%M')}, Users: {active}, Token OK: {token_ok}")
-        return {'timestamp': now.isoformat(), 'active_users': active, 'token': token_ok}
     except Exception as e:
         logger.error(f"Ошибка в health_check: {e}")
-        return None
+        raise
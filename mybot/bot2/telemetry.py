@@ -0,0 +1,82 @@
+"""
+Celery task telemetry, recorded into bot2.metrics through Celery signals.
+
+The publisher stamps every message with its publish time; the worker turns
+that into the queue wait when the task starts, then records the runtime and
+the outcome when it ends. Handlers are connected in Bot2Config.ready(), so
+both the web process (which publishes) and the workers have them.
+"""
+import logging
+import time
+from celery.signals import before_task_publish, task_failure, task_postrun, task_prerun, task_retry
+from django.utils.dateparse import parse_datetime
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_AT_HEADER = 'published_at'
+
+# task id -> start time, for the tasks running in this process
+_started = {}
+
+
+def _header(request, name):
+    value = getattr(request, name, None)
+    if value is None:
+        value = (getattr(request, 'headers', None) or {}).get(name)
+    return value
+
+
+def due_at(request):
+    """Epoch seconds a task was due to start: its ETA, or when it was published"""
+    published_at = _header(request, PUBLISHED_AT_HEADER)
+    if published_at is None:
+        return None
+    ready_at = float(published_at)
+    eta = getattr(request, 'eta', None)
+    if eta:
+        eta = parse_datetime(eta) if isinstance(eta, str) else eta
+        if eta is not None:
+            ready_at = max(ready_at, eta.timestamp())
+    return ready_at
+
+
+def queue_wait(request, started_at):
+    """Seconds the task waited for a worker, counted from its ETA when it had one"""
+    ready_at = due_at(request)
+    if ready_at is None:
+        return None
+    return max(0.0, started_at - ready_at)
+
+
+@before_task_publish.connect
+def stamp_publish_time(sender=None, headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+
+@task_prerun.connect
+def record_start(task_id=None, task=None, **kwargs):
+    started_at = time.time()
+    _started[task_id] = started_at
+    wait = queue_wait(task.request, started_at)
+    if wait is not None:
+        metrics.observe('celery_task_queue_wait_seconds', wait, {'task': task.name})
+
+
+@task_postrun.connect
+def record_finish(task_id=None, task=None, state=None, **kwargs):
+    started_at = _started.pop(task_id, None)
+    if started_at is not None:
+        metrics.observe('celery_task_runtime_seconds', time.time() - started_at, {'task': task.name})
+    metrics.incr('celery_tasks_total', {'task': task.name, 'state': state or 'UNKNOWN'})
+
+
+@task_failure.connect
+def record_failure(sender=None, exception=None, **kwargs):
+    metrics.incr('celery_task_failures_total', {'task': sender.name, 'exception': type(exception).__name__})
+
+
+@task_retry.connect
+def record_retry(sender=None, **kwargs):
+    metrics.incr('celery_task_retries_total', {'task': sender.name})
@@ -1,3 +1,1248 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from datetime import date, datetime, time, timedelta
+from time import monotonic, sleep
+import pytz
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+from django_celery_beat.schedulers import DatabaseScheduler
+from . import access_token, analytics, archive, beat, classifier, delivery, engagement, export, health, metrics, partitions, reply_buffer, search, slots, tasks
+from .admin import UserResponseAdmin
+from .commands import run_read_command, search_command
+from .models import DailyUserStats, TeamsUser, UserResponse
+from .user_context import UserContext
 
-# Create your tests here.
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the Redis commands the bot uses, with expiry.
+
+    Strings, lists and sorted sets; pipelines run their commands when
+    executed. Values are str, as with decode_responses=True.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _expires_at(self, seconds):
+        return monotonic() + seconds if seconds else None
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self._live(key)
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = (value, self._expires_at(px / 1000 if px else ex))
+        return True
+
+    def expire(self, key, seconds):
+        if self._live(key) is None:
+            return False
+        self.data[key] = (self.data[key][0], self._expires_at(seconds))
+        return True
+
+    def delete(self, *keys):
+        deleted = [key for key in keys if self._live(key) is not None]
+        for key in deleted:
+            del self.data[key]
+        return len(deleted)
+
+    def _list(self, key):
+        if self._live(key) is None:
+            self.data[key] = ([], None)
+        return self.data[key][0]
+
+    def rpush(self, key, *values):
+        items = self._list(key)
+        items.extend(values)
+        return len(items)
+
+    def lpush(self, key, *values):
+        items = self._list(key)
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    def lrange(self, key, start, end):
+        items = self._live(key) or []
+        return list(items[start:None if end == -1 else end + 1])
+
+    def zadd(self, key, mapping):
+        if self._live(key) is None:
+            self.data[key] = ({}, None)
+        scores = self.data[key][0]
+        added = sum(1 for member in mapping if member not in scores)
+        scores.update(mapping)
+        return added
+
+    def zrangebyscore(self, key, low, high, start=None, num=None):
+        low, high = float(low), float(high)
+        members = sorted(
+            (score, member) for member, score in (self._live(key) or {}).items() if low <= score <= high
+        )
+        members = [member for _, member in members]
+        if start is not None:
+            members = members[start:start + num]
+        return members
+
+    def zrem(self, key, *members):
+        scores = self._live(key) or {}
+        return sum(1 for member in members if scores.pop(member, None) is not None)
+
+    def eval(self, script, numkeys, key, owner, *args):
+        if self._live(key) != owner:
+            return 0
+        if script == beat.RENEW_SCRIPT:
+            self.data[key] = (owner, monotonic() + int(args[0]) / 1000)
+            return 1
+        if script == beat.RELEASE_SCRIPT:
+            return self.delete(key)
+        raise NotImplementedError(script)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class ScheduledTaskMixin:
+    """Runs the scheduled send tasks for a given slot with the connector, token and Redis mocked"""
+
+    def run_scheduled(self, task, day, slot_time, outcomes=None, patches=()):
+        """
+        Run task as if scheduled for day/slot_time; returns the send mock.
+
+        Sends are delivered unless outcomes maps a user id to another
+        (outcome, reason). patches are extra (target, attribute, value).
+        """
+        outcomes = outcomes or {}
+        scheduled = pytz.timezone('Asia/Almaty').localize(datetime.combine(day, slot_time))
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(tasks, 'scheduled_run', return_value=scheduled))
+            stack.enter_context(mock.patch.object(tasks, 'within_deadline', return_value=True))
+            stack.enter_context(mock.patch.object(tasks, 'get_access_token', return_value='token'))
+            stack.enter_context(mock.patch.object(tasks, 'publish_open_slots'))
+            stack.enter_context(mock.patch.object(delivery, 'metrics'))
+            for target, attribute, value in patches:
+                stack.enter_context(mock.patch.object(target, attribute, value))
+            send = stack.enter_context(mock.patch.object(
+                tasks, 'send_message_via_http',
+                side_effect=lambda user, text, token: outcomes.get(user.user_id, (delivery.DELIVERED, '')),
+            ))
+            task.run(slot_time.strftime('%H:%M'))
+        return send
+
+
+class HotPathQueryCountTests(ScheduledTaskMixin, TestCase):
+    """Query budgets for the paths hit on every message and every tick"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = TeamsUser.objects.create(
+            user_id='user-1',
+            name='Test User',
+            conversation_reference='{"serviceUrl": "https://example.com"}',
+        )
+
+    def test_load_unchanged_user_is_one_query(self):
+        with self.assertNumQueries(1):
+            UserContext.load('user-1', 'Test User', '{"serviceUrl": "https://example.com"}')
+
+    def test_load_changed_reference_writes_once(self):
+        with self.assertNumQueries(2):
+            ctx = UserContext.load('user-1', 'Test User', '{"serviceUrl": "https://other.example.com"}')
+        with self.assertNumQueries(0):
+            ctx.update(conversation_reference='{"serviceUrl": "https://other.example.com"}')
+
+    def test_record_is_one_query(self):
+        with self.assertNumQueries(1):
+            created = UserResponse.record('user-1', date(2025, 7, 18), time(9, 0), 'coding')
+        self.assertTrue(created)
+        with self.assertNumQueries(1):
+            created = UserResponse.record('user-1', date(2025, 7, 18), time(9, 0), 'still coding')
+        self.assertFalse(created)
+
+    def test_record_fills_placeholder(self):
+        UserResponse.objects.create(
+            user=self.user, question_date=date(2025, 7, 18), question_time=time(9, 30), response_text=''
+        )
+        self.assertTrue(UserResponse.record('user-1', date(2025, 7, 18), time(9, 30), 'meeting'))
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_read_command_is_cached(self):
+        with self.assertNumQueries(1):
+            run_read_command('today', self.user)
+        with self.assertNumQueries(0):
+            run_read_command('today', self.user)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_fan_out_refreshes_cached_status(self):
+        scheduled = pytz.timezone('Asia/Almaty').localize(datetime.combine(date(2025, 7, 18), time(9, 30)))
+        with mock.patch('bot2.commands.get_kazakhstan_time', return_value=scheduled):
+            self.assertIn('из 0', run_read_command('status', self.user))
+            self.run_scheduled(tasks.send_activity_questions, date(2025, 7, 18), time(9, 30))
+            self.assertIn('из 1', run_read_command('status', self.user))
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_read_command_cache_is_per_day(self):
+        almaty = pytz.timezone('Asia/Almaty')
+        with mock.patch('bot2.commands.get_kazakhstan_time', return_value=almaty.localize(datetime(2025, 7, 18, 23, 59))):
+            run_read_command('today', self.user)
+        with mock.patch('bot2.commands.get_kazakhstan_time', return_value=almaty.localize(datetime(2025, 7, 19, 0, 1))):
+            with self.assertNumQueries(1):
+                run_read_command('today', self.user)
+
+    def _add_users(self, count):
+        TeamsUser.objects.bulk_create([
+            TeamsUser(user_id=f'user-{i}', name=f'User {i}', conversation_reference='{"serviceUrl": "https://example.com"}')
+            for i in range(2, count + 2)
+        ])
+
+    def _fan_out_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.run_scheduled(tasks.send_activity_questions, date(2025, 7, 18), time(9, 30))
+        return len(ctx)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_fan_out_queries_do_not_grow_with_users(self):
+        # Users, placeholders, delivery bookkeeping, questions_sent
+        self.assertEqual(self._fan_out_queries(), 4)
+        UserResponse.objects.all().delete()
+        DailyUserStats.objects.all().delete()
+        self._add_users(20)
+        self.assertEqual(self._fan_out_queries(), 4)
+
+    def _summary_queries(self):
+        today = date(2025, 7, 18)
+        for user in TeamsUser.objects.all():
+            UserResponse.objects.create(user=user, question_date=today, question_time=time(9, 0), response_text='coding')
+        with CaptureQueriesContext(connection) as ctx:
+            send = self.run_scheduled(
+                tasks.send_daily_summary, today, time(17, 0),
+                patches=[(tasks, 'get_openai_summary', mock.Mock(return_value='summary'))],
+            )
+        self.assertEqual(send.call_count, TeamsUser.objects.count())
+        return len(ctx)
+
+    def test_summary_queries_do_not_grow_with_users(self):
+        # Pending answers and their categories, users, answers, delivery bookkeeping
+        self.assertEqual(self._summary_queries(), 5)
+        UserResponse.objects.all().delete()
+        self._add_users(20)
+        self.assertEqual(self._summary_queries(), 5)
+
+    @override_settings(RESPONSE_ARCHIVE_CHUNK_SIZE=1000, RESPONSE_DELETE_BATCH_SIZE=1000, RESPONSE_DELETE_PAUSE_SECONDS=0)
+    def test_retention_queries_do_not_grow_with_rows(self):
+        cutoff = date(2025, 7, 18)
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(RESPONSE_ARCHIVE_DIR=archive_dir):
+            counts = []
+            for rows in (1, 50):
+                UserResponse.objects.bulk_create([
+                    UserResponse(user=self.user, question_date=cutoff - timedelta(days=1 + i // 8), question_time=time(9 + i % 8, 0), response_text=f'answer {i}')
+                    for i in range(rows)
+                ], ignore_conflicts=True)
+                with CaptureQueriesContext(connection) as ctx:
+                    archive.archive_expired_responses(cutoff)
+                counts.append(len(ctx))
+                self.assertFalse(UserResponse.objects.filter(question_date__lt=cutoff).exists())
+        self.assertEqual(counts[0], counts[1])
+
+
+class ConcurrentRecordTests(TransactionTestCase):
+    """Concurrent replies to one slot are only counted once"""
+
+    def _record_in_thread(self, text):
+        try:
+            return UserResponse.record('user-1', date(2025, 7, 18), time(9, 0), text)
+        finally:
+            connections.close_all()
+
+    def test_second_reply_waits_and_is_not_first(self):
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        UserResponse.create_placeholders([user.user_id], date(2025, 7, 18), time(9, 0))
+        UserResponse.settle_placeholders(date(2025, 7, 18), time(9, 0), [user.user_id], [])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with transaction.atomic():
+                self.assertTrue(UserResponse.record('user-1', date(2025, 7, 18), time(9, 0), 'first'))
+                second = executor.submit(self._record_in_thread, 'second')
+                sleep(0.3)
+                # Blocked on the row lock of the first reply
+                self.assertFalse(second.done())
+            self.assertFalse(second.result(timeout=10))
+
+        stats = DailyUserStats.objects.get(user_id='user-1', date=date(2025, 7, 18))
+        self.assertEqual((stats.questions_sent, stats.answered), (1, 1))
+        self.assertEqual(UserResponse.objects.get(user_id='user-1').response_text, 'second')
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN plans for the hot filters must use an index and avoid sorting"""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = date(2025, 7, 18)
+        users = [
+            TeamsUser(user_id=f'user-{i}', name=f'User {i}', is_active=i % 2 == 0)
+            for i in range(20)
+        ]
+        TeamsUser.objects.bulk_create(users)
+        UserResponse.objects.bulk_create([
+            UserResponse(user=u, question_date=today - timedelta(days=d), question_time=time(9, 0), response_text='x')
+            for u in users
+            for d in range(5)
+        ])
+        cls.today = today
+
+    def setUp(self):
+        # Tiny test tables would always be seq-scanned otherwise
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+
+    def assertIndexPlan(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertNotIn('Sort', plan)
+        return plan
+
+    def test_active_users_due_at_slot(self):
+        tiers = engagement.due_tiers(time(9, 0))
+        plan = self.assertIndexPlan(TeamsUser.objects.filter(is_active=True, engagement_tier__in=tiers))
+        self.assertIn('teamsuser_active_tier_idx', plan)
+
+    def test_user_responses_today(self):
+        self.assertIndexPlan(UserResponse.objects.filter(user_id='user-2', question_date=self.today))
+
+    def test_summary_day_responses(self):
+        plan = UserResponse.objects.filter(
+            question_date=self.today, user__is_active=True,
+        ).order_by('user_id', 'question_time').explain()
+        self.assertNotIn('Seq Scan', plan)
+        # Rows come presorted by user; only each user's few answers are sorted
+        self.assertIn('question_date_user_id_idx', plan)
+        self.assertNotRegex(plan, r'(^|->)\s*Sort\s+\(')
+
+    def test_retention_range(self):
+        self.assertIndexPlan(UserResponse.objects.filter(question_date__lt=self.today - timedelta(days=2)))
+
+    def test_exists_has_no_order_by(self):
+        with self.assertNumQueries(1) as ctx:
+            UserResponse.objects.filter(question_date=self.today).exists()
+        self.assertNotIn('ORDER BY', ctx.captured_queries[0]['sql'])
+
+
+class PartitionTests(TestCase):
+    """UserResponse is range-partitioned by month"""
+
+    def setUp(self):
+        # Outside tests every statement commits on its own; here the deferred
+        # foreign key checks of the inserted rows would block DETACH/ATTACH
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_ensure_partitions_is_idempotent(self):
+        start = date(2024, 1, 1)
+        created = partitions.ensure_partitions(start=start, months_ahead=0)
+        self.assertIn(partitions.partition_name(start), created)
+        self.assertNotIn(partitions.partition_name(start), partitions.ensure_partitions(start=start, months_ahead=0))
+
+    def test_drop_partitions_before(self):
+        partitions.ensure_partitions(start=date(2024, 1, 1), months_ahead=0)
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        UserResponse.objects.create(user=user, question_date=date(2024, 1, 15), question_time=time(9, 0), response_text='old')
+        UserResponse.objects.create(user=user, question_date=date(2024, 2, 15), question_time=time(9, 0), response_text='kept')
+
+        with self.assertNumQueries(1 + 2 * 1):
+            dropped = partitions.drop_partitions_before(date(2024, 2, 20))
+
+        self.assertEqual(dropped, [partitions.partition_name(date(2024, 1, 1))])
+        self.assertEqual(list(UserResponse.objects.values_list('response_text', flat=True)), ['kept'])
+
+    def _partition_of(self, response_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text FROM {partitions.TABLE} WHERE id = %s', [response_id])
+            return cursor.fetchone()[0]
+
+    def test_rows_in_default_are_moved_into_new_partition(self):
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        # No partition for May 2023 yet: the row lands in DEFAULT
+        late = UserResponse.objects.create(user=user, question_date=date(2023, 5, 10), question_time=time(9, 0), response_text='late')
+        self.assertEqual(self._partition_of(late.id), partitions.DEFAULT_PARTITION)
+
+        created = partitions.ensure_month_partitions([date(2023, 5, 1)])
+
+        self.assertEqual(created, [partitions.partition_name(date(2023, 5, 1))])
+        self.assertEqual(self._partition_of(late.id), partitions.partition_name(date(2023, 5, 1)))
+        self.assertEqual(UserResponse.objects.get(id=late.id).response_text, 'late')
+        self.assertEqual(partitions.default_partition_rows(), 0)
+
+    def test_failed_month_does_not_block_later_months(self):
+        real = partitions.create_partition
+
+        def create(month):
+            if month == date(2023, 5, 1):
+                raise DatabaseError('boom')
+            return real(month)
+
+        with mock.patch.object(partitions, 'create_partition', side_effect=create):
+            created = partitions.ensure_month_partitions([date(2023, 5, 1), date(2023, 6, 1)])
+        self.assertEqual(created, [partitions.partition_name(date(2023, 6, 1))])
+
+
+class ArchiveTests(TestCase):
+    """Expired responses are archived before removal and can be restored"""
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(RESPONSE_ARCHIVE_DIR=archive_dir.name, RESPONSE_DELETE_PAUSE_SECONDS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Expired partitions are dropped; see PartitionTests.setUp
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_archive_then_restore(self):
+        partitions.ensure_partitions(start=date(2024, 1, 1), months_ahead=0)
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        for day in (date(2024, 1, 10), date(2024, 2, 5), date(2024, 2, 25)):
+            UserResponse.objects.create(user=user, question_date=day, question_time=time(9, 0), response_text=str(day))
+
+        archived = archive.archive_expired_responses(date(2024, 2, 20))
+
+        self.assertEqual(archived, 2)
+        self.assertEqual(list(UserResponse.objects.values_list('response_text', flat=True)), ['2024-02-25'])
+        self.assertTrue(archive.archive_path(date(2024, 1, 10)).exists())
+
+        call_command('restore_responses', os.path.dirname(archive.archive_path(date(2024, 1, 10)).parent), stdout=io.StringIO())
+        self.assertEqual(UserResponse.objects.count(), 3)
+
+
+    def _archived_ids(self, day):
+        return [response.id for response in archive.read_archive(archive.archive_path(day))]
+
+    def test_rerun_after_crash_does_not_archive_twice(self):
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        kept = UserResponse.objects.create(user=user, question_date=date(2024, 2, 5), question_time=time(9, 0), response_text='x')
+
+        # Written to the archive, then the worker died before deleting
+        with mock.patch.object(archive, 'delete_in_batches', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                archive.archive_expired_responses(date(2024, 2, 20))
+        self.assertEqual(self._archived_ids(date(2024, 2, 5)), [kept.id])
+
+        archive.archive_expired_responses(date(2024, 2, 20))
+        self.assertEqual(self._archived_ids(date(2024, 2, 5)), [kept.id])
+        self.assertFalse(UserResponse.objects.exists())
+
+    def test_damaged_archive_keeps_complete_rows(self):
+        path = archive.archive_path(date(2024, 2, 5))
+        path.parent.mkdir(parents=True)
+        row = {'id': 7, 'user_id': 'user-1', 'question_date': '2024-02-05', 'question_time': '09:00:00',
+               'response_text': 'x', 'response_time': '2024-02-05T09:01:00+06:00', 'category': ''}
+        with gzip.open(path, 'wt', encoding='utf-8') as archive_file:
+            archive_file.write(json.dumps(row) + '\n')
+        # A second member cut off mid-write
+        member = gzip.compress(json.dumps({**row, 'id': 8}).encode())
+        with open(path, 'ab') as archive_file:
+            archive_file.write(member[:len(member) // 2])
+
+        self.assertEqual(archive.existing_ids(path), {7})
+        self.assertEqual(self._archived_ids(date(2024, 2, 5)), [7])
+
+    def test_delete_is_pruned_by_date(self):
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        response = UserResponse.objects.create(user=user, question_date=date(2024, 2, 5), question_time=time(9, 0), response_text='x')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(archive.delete_in_batches([(response.id, response.question_date)]), 1)
+        delete_sql = next(query['sql'] for query in ctx if query['sql'].startswith('DELETE'))
+        self.assertIn('"question_date" BETWEEN', delete_sql)
+
+
+class DailyUserStatsTests(TestCase):
+    """Counters are maintained incrementally and agree with a full recount"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        cls.day = date(2025, 7, 18)
+
+    def test_incremental_matches_reconcile(self):
+        with self.assertNumQueries(1):
+            UserResponse.create_placeholders(['user-1'], self.day, time(9, 0))
+        UserResponse.create_placeholders(['user-1'], self.day, time(9, 30))
+        # Nothing is counted before the questions went out
+        self.assertFalse(DailyUserStats.objects.exists())
+        for slot_time in (time(9, 0), time(9, 30)):
+            with self.assertNumQueries(1):
+                UserResponse.settle_placeholders(self.day, slot_time, ['user-1'], [])
+        UserResponse.record('user-1', self.day, time(9, 0), 'coding')
+        UserResponse.record('user-1', self.day, time(9, 0), 'still coding')
+        UserResponse.append_many([('user-1', self.day, time(10, 0), 'meeting')])
+
+        stats = DailyUserStats.objects.get(user=self.user, date=self.day)
+        self.assertEqual(stats.questions_sent, 3)
+        self.assertEqual(stats.answered, 2)
+        self.assertIsNotNone(stats.first_answer_at)
+
+        self.assertEqual(DailyUserStats.reconcile(self.day, self.day), 0)
+
+    def test_failed_questions_are_not_counted(self):
+        TeamsUser.objects.create(user_id='user-2', name='Other User')
+        UserResponse.create_placeholders(['user-1', 'user-2'], self.day, time(9, 0))
+        UserResponse.settle_placeholders(self.day, time(9, 0), ['user-1'], ['user-2'])
+
+        self.assertEqual(list(DailyUserStats.objects.values_list('user_id', 'questions_sent')), [('user-1', 1)])
+        self.assertEqual(list(UserResponse.objects.values_list('user_id', flat=True)), ['user-1'])
+        self.assertEqual(DailyUserStats.reconcile(self.day, self.day), 0)
+
+    def test_reconcile_repairs_drift(self):
+        UserResponse.record('user-1', self.day, time(9, 0), 'coding')
+        DailyUserStats.objects.filter(user=self.user).update(answered=5)
+
+        self.assertEqual(DailyUserStats.reconcile(self.day, self.day), 1)
+        self.assertEqual(DailyUserStats.objects.get(user=self.user, date=self.day).answered, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, ANALYTICS_API_TOKEN='secret')
+class AnalyticsTests(TestCase):
+    """Tenant reports are aggregated in SQL and cached per bucket"""
+
+    @classmethod
+    def setUpTestData(cls):
+        day = analytics._since(1)
+        for user_id, tenant in (('user-1', 'tenant-a'), ('user-2', 'tenant-a'), ('user-3', 'tenant-b')):
+            TeamsUser.objects.create(user_id=user_id, name=user_id, tenant_id=tenant)
+        UserResponse.create_placeholders(['user-1', 'user-2', 'user-3'], day, time(9, 0))
+        UserResponse.settle_placeholders(day, time(9, 0), ['user-1', 'user-2', 'user-3'], [])
+        UserResponse.record('user-1', day, time(9, 0), 'coding')
+
+    def test_tenant_rates(self):
+        rows = {row['tenant']: row for row in analytics.tenant_rates(7)}
+        self.assertEqual(rows['tenant-a']['sent'], 2)
+        self.assertEqual(rows['tenant-a']['rate'], 0.5)
+        self.assertEqual(rows['tenant-b']['rate'], 0.0)
+
+    def test_report_is_cached(self):
+        with self.assertNumQueries(1):
+            analytics.cached_report('non_responders', days=7, tenant_id='tenant-a', limit=10)
+        with self.assertNumQueries(0):
+            result = analytics.cached_report('non_responders', days=7, tenant_id='tenant-a', limit=10)
+        self.assertEqual(result['results'][0]['user_id'], 'user-2')
+
+    def test_requires_token(self):
+        url = reverse('analytics_tenants')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+@override_settings(ANALYTICS_API_TOKEN='secret')
+class ExportTests(TestCase):
+    """Exports stream responses joined with their user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        day = date(2025, 7, 18)
+        TeamsUser.objects.create(user_id='user-1', name='Анна', email='anna@example.com', tenant_id='tenant-a')
+        TeamsUser.objects.create(user_id='user-2', name='Bob', tenant_id='tenant-b')
+        UserResponse.record('user-1', day, time(9, 0), 'coding, tests')
+        UserResponse.record('user-2', day, time(9, 0), 'meeting')
+
+    def test_command_csv(self):
+        out = io.StringIO()
+        call_command('export_responses', '--tenant', 'tenant-a', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(','), export.EXPORT_FIELDS)
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"coding, tests"', lines[1])
+
+    def test_view_streams_jsonl(self):
+        response = self.client.get(
+            reverse('export_responses'), {'format': 'jsonl', 'user': 'user-2'}, HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([row['response_text'] for row in rows], ['meeting'])
+        self.assertEqual(rows[0]['user_name'], 'Bob')
+
+
+@override_settings(ANALYTICS_API_TOKEN='secret')
+class SearchTests(TestCase):
+    """Full-text search matches Russian and English word forms"""
+
+    @classmethod
+    def setUpTestData(cls):
+        day = search.get_kazakhstan_time().date()
+        TeamsUser.objects.create(user_id='user-1', name='User 1', tenant_id='tenant-a')
+        TeamsUser.objects.create(user_id='user-2', name='User 2', tenant_id='tenant-a')
+        UserResponse.record('user-1', day, time(9, 0), 'Созвон с клиентами по релизу')
+        UserResponse.record('user-2', day, time(9, 0), 'Preparing the releases notes')
+        UserResponse.record('user-2', day, time(9, 30), 'lunch')
+
+    def test_russian_stemming(self):
+        rows, has_next = search.search_responses('клиент')
+        self.assertEqual([row['user_id'] for row in rows], ['user-1'])
+        self.assertFalse(has_next)
+
+    def test_english_stemming_and_paging(self):
+        rows, has_next = search.search_responses('release', page_size=1)
+        self.assertEqual([row['user_id'] for row in rows], ['user-2'])
+        self.assertFalse(has_next)
+
+    def test_chat_search_only_shows_own_answers(self):
+        colleague = TeamsUser.objects.get(user_id='user-2')
+        self.assertIn('ничего не найдено', search_command(colleague, 'клиент'))
+        own = search_command(TeamsUser.objects.get(user_id='user-1'), 'клиент')
+        self.assertIn('Созвон с клиентами', own)
+        self.assertNotIn('User 1', own)
+
+    def test_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+        plan = UserResponse.objects.filter(search_vector=search.search_query('release')).explain()
+        # Each partition has its own copy of response_search_idx
+        self.assertIn('_search_vector_idx', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_api(self):
+        response = self.client.get(reverse('search'), {'q': 'релиз'}, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+
+class ClassifierTests(TestCase):
+    """Answers are tagged in batches and re-tagged after edits"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        cls.day = date(2025, 7, 18)
+
+    def test_rules_and_model(self):
+        self.assertEqual(classifier.classify('Созвон с командой'), 'meeting')
+        self.assertEqual(classifier.classify('фикшу баг в оплате'), 'coding')
+        self.assertEqual(classifier.classify('код-ревью'), 'review')
+        self.assertEqual(classifier.classify('пью чай'), 'break')
+        self.assertEqual(classifier.classify('qwerty'), classifier.OTHER)
+
+    def test_classify_pending_in_batches(self):
+        UserResponse.create_placeholders(['user-1'], self.day, time(17, 0))
+        UserResponse.record('user-1', self.day, time(9, 0), 'обед')
+        UserResponse.record('user-1', self.day, time(9, 30), 'daily standup')
+        UserResponse.record('user-1', self.day, time(10, 0), 'refactoring the bot')
+
+        self.assertEqual(classifier.classify_pending(batch_size=2), 3)
+        self.assertEqual(
+            dict(UserResponse.objects.values_list('question_time', 'category')),
+            {time(9, 0): 'break', time(9, 30): 'meeting', time(10, 0): 'coding', time(17, 0): ''},
+        )
+
+        UserResponse.record('user-1', self.day, time(9, 0), 'code review')
+        self.assertEqual(UserResponse.objects.get(question_time=time(9, 0)).category, '')
+        self.assertEqual(classifier.classify_pending(), 1)
+        self.assertEqual(UserResponse.objects.get(question_time=time(9, 0)).category, 'review')
+
+    def test_summary_prompt_has_categories_not_answers(self):
+        UserResponse.create_placeholders(['user-1'], self.day, time(17, 0))
+        UserResponse.record('user-1', self.day, time(9, 0), 'созвон по секретному проекту')
+        UserResponse.record('user-1', self.day, time(9, 30), 'обед')
+        classifier.classify_pending()
+        responses = list(UserResponse.objects.order_by('question_time'))
+
+        completion = mock.Mock(choices=[mock.Mock(message=mock.Mock(content='Итог'))])
+        with mock.patch('openai.chat.completions.create', return_value=completion) as create:
+            self.assertEqual(tasks.get_openai_summary(responses), 'Итог')
+        prompt = create.call_args.kwargs['messages'][1]['content']
+        self.assertNotIn('секретн', prompt)
+        self.assertIn('Встречи: 1 (09:00)', prompt)
+        self.assertIn('Перерывы: 1 (09:30)', prompt)
+        self.assertIn('Без ответа: 1', prompt)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_summary_command_shows_labels(self):
+        day = slots.get_kazakhstan_time().date()
+        UserResponse.record('user-1', day, time(9, 0), 'обед')
+        classifier.classify_pending()
+        self.assertIn('Чем занимались: Перерывы (1)', run_read_command('summary', self.user))
+
+    def test_edited_rows_are_skipped(self):
+        UserResponse.record('user-1', self.day, time(9, 0), 'обед')
+        response = UserResponse.objects.get()
+        stale = [(response.id, self.day, classifier.text_digest('something else'), 'coding')]
+        self.assertEqual(UserResponse.set_categories(stale), 0)
+
+
+class AdminTests(TestCase):
+    """Change lists page by keyset and queue bulk actions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        user = TeamsUser.objects.create(user_id='user-1', name='Test User')
+        UserResponse.objects.bulk_create([
+            UserResponse(user=user, question_date=date(2025, 7, 1) + timedelta(days=i), question_time=time(10, 0), response_text='x')
+            for i in range(7)
+        ])
+        UserResponse.objects.create(user=user, question_date=date(2025, 7, 18), question_time=time(9, 0), response_text='answer 0')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def test_keyset_pages_cover_every_row(self):
+        url = reverse('admin:bot2_userresponse_changelist')
+        seen = []
+        params = {}
+        with mock.patch.object(UserResponseAdmin, 'list_per_page', 3):
+            while True:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                seen.extend(obj.pk for obj in response.context['cl'].result_list)
+                next_cursor = response.context['cl'].next_cursor
+                if not next_cursor:
+                    break
+                params = {'cursor': next_cursor}
+        self.assertEqual(sorted(seen), sorted(UserResponse.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_date_hierarchy_and_search(self):
+        url = reverse('admin:bot2_userresponse_changelist')
+        response = self.client.get(url, {'question_date__year': 2025, 'question_date__month': 7, 'q': 'answer'})
+        self.assertEqual([obj.response_text for obj in response.context['cl'].result_list], ['answer 0'])
+
+    def test_bulk_action_is_queued(self):
+        url = reverse('admin:bot2_teamsuser_changelist')
+        with mock.patch.object(tasks.set_users_active, 'delay') as delay:
+            self.client.post(url, {'action': 'deactivate_users', '_selected_action': ['user-1']})
+        delay.assert_called_once_with(['user-1'], False)
+        self.assertTrue(TeamsUser.objects.get(user_id='user-1').is_active)
+
+
+class MetricsTests(TestCase):
+    def test_quantile_interpolates_within_bucket(self):
+        histogram = {'buckets': [(0.1, 0), (0.5, 10), (1, 10)], 'sum': 3.0, 'count': 10}
+        self.assertAlmostEqual(metrics.quantile(histogram, 0.5), 0.3)
+        self.assertIsNone(metrics.quantile({'buckets': [], 'sum': 0, 'count': 0}, 0.5))
+
+    def test_render_prometheus(self):
+        redis = mock.Mock()
+        redis.hgetall.side_effect = lambda key: {
+            metrics.COUNTERS_KEY: {'celery_tasks_total\tstate="SUCCESS",task="bot2.tasks.cleanup"': '3'},
+            metrics.HISTOGRAMS_KEY: {
+                'celery_task_runtime_seconds\ttask="bot2.tasks.cleanup"\t0.5': '2',
+                'celery_task_runtime_seconds\ttask="bot2.tasks.cleanup"\tsum': '0.6',
+            },
+        }[key]
+        with mock.patch.object(metrics, 'get_redis', return_value=redis):
+            text = metrics.render_prometheus()
+        self.assertIn('celery_tasks_total{state="SUCCESS",task="bot2.tasks.cleanup"} 3', text)
+        self.assertIn('celery_task_runtime_seconds_bucket{task="bot2.tasks.cleanup",le="0.5"} 2', text)
+        self.assertIn('celery_task_runtime_seconds_count{task="bot2.tasks.cleanup"} 2', text)
+
+
+class CeleryPayloadTests(TestCase):
+    def test_routed_tasks_do_not_store_results(self):
+        from bot1.celery import app
+        for name in settings.CELERY_TASK_ROUTES:
+            if name != '*':
+                self.assertTrue(app.tasks[name].ignore_result, name)
+
+    def test_payload_benchmark_runs(self):
+        out = io.StringIO()
+        call_command('celery_payload_benchmark', ids=10, iterations=1, stdout=out)
+        self.assertIn('set_users_active', out.getvalue())
+        self.assertIn('msgpack', out.getvalue())
+
+
+class CeleryRoutingTests(TestCase):
+    def setUp(self):
+        from kombu.transport.redis import Channel
+        options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+        self.channel = Channel.__new__(Channel)
+        self.channel.priority_steps, self.channel.sep = options['priority_steps'], options['sep']
+        self.channel.global_keyprefix = ''
+        self.channel.active_fanout_queues = set()
+        self.channel.client = mock.Mock()
+
+    def _polled_keys(self, queue):
+        """Redis keys in the order a worker consuming queue pops them"""
+        self.channel._active_queues = [queue]
+        self.channel._queue_cycle = mock.Mock(consume=mock.Mock(return_value=[queue]))
+        self.channel._brpop_start()
+        return list(self.channel.client.connection.send_command.call_args.args[1:-1])
+
+    def _key(self, name):
+        """Queue and Redis key a task message is pushed onto"""
+        from bot1.celery import app
+        route = app.amqp.router.route(app.tasks[name]._get_exec_options(), name)
+        priority = self.channel._get_message_priority({'properties': {'priority': route.get('priority')}})
+        return route['queue'].name, self.channel._q_for_pri(route['queue'].name, priority)
+
+    def _pop_order(self, queue, names):
+        keys = self._polled_keys(queue)
+        for name in names:
+            self.assertEqual(self._key(name)[0], queue, name)
+        return sorted(names, key=lambda name: keys.index(self._key(name)[1]))
+
+    def test_adhoc_pop_order(self):
+        names = [
+            'bot2.tasks.set_users_active', 'bot1.celery.debug_task', 'bot2.tasks.resend_question',
+            'bot2.tasks.send_message_to_user', 'bot2.tasks.flush_reply_buffers',
+        ]
+        self.assertEqual(self._pop_order('adhoc', names), [
+            'bot2.tasks.flush_reply_buffers', 'bot2.tasks.resend_question', 'bot2.tasks.send_message_to_user',
+            # Unrouted tasks go ahead of bulk admin actions only
+            'bot1.celery.debug_task', 'bot2.tasks.set_users_active',
+        ])
+
+    def test_fanout_tick_is_polled_first(self):
+        queue, key = self._key('bot2.tasks.send_activity_questions')
+        self.assertEqual(queue, 'fanout')
+        self.assertEqual(self._polled_keys('fanout')[0], key)
+
+
+class HealthTests(TestCase):
+    def _probes(self, **statuses):
+        return {
+            name: (lambda status=status: (status, None), critical, lambda: 10)
+            for name, (status, critical) in statuses.items()
+        }
+
+    def test_warning_on_optional_probe_is_still_ready(self):
+        probes = self._probes(database=(health.OK, True), openai=(health.WARN, False))
+        with mock.patch.dict(health._state, checks={}, running={}), \
+                mock.patch.object(health, 'PROBES', probes), \
+                mock.patch.object(health, 'ensure_started'):
+            health.refresh(ThreadPoolExecutor(max_workers=2))
+            ready, payload = health.readiness()
+        self.assertTrue(ready)
+        self.assertEqual(payload['status'], 'degraded')
+
+    def test_failed_critical_probe_is_not_ready(self):
+        probes = self._probes(database=(health.FAIL, True), openai=(health.OK, False))
+        with mock.patch.dict(health._state, checks={}, running={}), \
+                mock.patch.object(health, 'PROBES', probes), \
+                mock.patch.object(health, 'ensure_started'):
+            health.refresh(ThreadPoolExecutor(max_workers=2))
+            response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'not_ready')
+
+    def test_access_token_is_cached(self):
+        reply = mock.Mock(status_code=200)
+        reply.json.return_value = {'access_token': 'abc', 'expires_in': 3599}
+        cache = {}
+        with mock.patch.object(access_token.cache, 'get', side_effect=cache.get), \
+                mock.patch.object(access_token.cache, 'set', side_effect=lambda key, value, ttl: cache.update({key: value})), \
+                mock.patch('requests.post', return_value=reply) as post:
+            self.assertEqual(access_token.get_access_token(), 'abc')
+            self.assertEqual(access_token.get_access_token(), 'abc')
+        self.assertEqual(post.call_count, 1)
+
+
+class Killed(BaseException):
+    """Stands in for the process dying: not caught by the scheduler like an Exception"""
+
+
+class OpenSlotTests(TestCase):
+    """Replies are matched to the question the user was asked, Redis first"""
+
+    DAY = date(2025, 7, 18)
+
+    def setUp(self):
+        TeamsUser.objects.create(user_id='user-1', name='Test User')
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(slots, 'get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _resolve_at(self, hour, minute):
+        now = pytz.timezone('Asia/Almaty').localize(datetime.combine(self.DAY, time(hour, minute)))
+        with mock.patch.object(slots, 'get_kazakhstan_time', return_value=now):
+            return slots.resolve_open_slot('user-1')
+
+    def test_open_slot_from_redis(self):
+        slots.publish_open_slots(['user-1'], self.DAY, time(9, 30))
+        # A late reply, after the next slot began, still goes to the question asked
+        with self.assertNumQueries(0):
+            self.assertEqual(self._resolve_at(10, 5), (self.DAY, time(9, 30)))
+
+    def test_expired_key_falls_back_to_last_question_asked(self):
+        UserResponse.create_placeholders(['user-1'], self.DAY, time(9, 30))
+        slots.publish_open_slots(['user-1'], self.DAY, time(9, 30))
+        self.redis.delete(slots.OPEN_SLOT_KEY.format(user_id='user-1'))
+        # Not asked at 10:00 (engagement tier), so the reply is for 09:30
+        self.assertEqual(self._resolve_at(10, 10), (self.DAY, time(9, 30)))
+
+    def test_redis_down_falls_back_to_last_question_asked(self):
+        UserResponse.create_placeholders(['user-1'], self.DAY, time(10, 0))
+        with mock.patch.object(slots, 'get_redis', side_effect=ConnectionError('redis down')):
+            slots.publish_open_slots(['user-1'], self.DAY, time(10, 30))
+            self.assertEqual(self._resolve_at(10, 40), (self.DAY, time(10, 0)))
+
+    def test_schedule_when_nothing_was_asked(self):
+        self.assertEqual(self._resolve_at(10, 40), (self.DAY, time(10, 30)))
+        self.assertIsNone(self._resolve_at(8, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, RESPONSE_WRITE_BEHIND=True, RESPONSE_WRITE_BEHIND_DEBOUNCE_SECONDS=0)
+class ReplyBufferTests(TestCase):
+    """Write-behind replies are merged per slot in Redis and flushed in one statement"""
+
+    DAY = date(2025, 7, 18)
+
+    def setUp(self):
+        TeamsUser.objects.create(user_id='29:user-1', name='Test User')
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(reply_buffer, 'get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key = reply_buffer.BUFFER_KEY.format(user_id='29:user-1', date='2025-07-18', time='09:30')
+
+    def _record(self, text):
+        from .bot_handler import TeamsBot
+        with mock.patch('bot2.bot_handler.resolve_open_slot', return_value=(self.DAY, time(9, 30))):
+            return TeamsBot()._record_answer('29:user-1', text)
+
+    def test_parse_buffer_key(self):
+        self.assertEqual(reply_buffer.parse_buffer_key(self.key), ('29:user-1', self.DAY, time(9, 30)))
+
+    def test_replies_are_merged_into_one_row(self):
+        with mock.patch('bot2.bot_handler.invalidate_user_commands') as invalidate:
+            for text in ('coding', 'still coding', 'done'):
+                # Not in the database yet, so neither new nor updated
+                self.assertEqual(self._record(text), (time(9, 30), None))
+        invalidate.assert_called_with('29:user-1')
+        self.assertFalse(UserResponse.objects.exists())
+
+        with mock.patch.object(UserResponse, 'append_many', wraps=UserResponse.append_many) as append_many:
+            self.assertEqual(reply_buffer.flush_reply_buffers(), 1)
+        append_many.assert_called_once_with([('29:user-1', self.DAY, time(9, 30), 'coding\nstill coding\ndone')])
+        self.assertEqual(UserResponse.objects.get().response_text, 'coding\nstill coding\ndone')
+        self.assertIsNone(self.redis.get(self.key))
+        self.assertEqual(reply_buffer.flush_reply_buffers(), 0)
+
+    def test_failed_flush_puts_text_back(self):
+        self._record('coding')
+        self._record('still coding')
+        with mock.patch.object(UserResponse, 'append_many', side_effect=DatabaseError('primary down')):
+            with self.assertRaises(DatabaseError):
+                reply_buffer.flush_reply_buffers()
+        self.assertEqual(self.redis.lrange(self.key, 0, -1), ['coding', 'still coding'])
+        self.assertEqual(self.redis.zrangebyscore(reply_buffer.PENDING_KEY, '-inf', '+inf'), [self.key])
+
+        reply_buffer.flush_reply_buffers()
+        self.assertEqual(UserResponse.objects.get().response_text, 'coding\nstill coding')
+
+    def test_expired_buffers_do_not_stop_the_flush(self):
+        # Pending, but the list itself has expired
+        self.redis.zadd(reply_buffer.PENDING_KEY, {self.key: 0})
+        self.assertEqual(reply_buffer.flush_reply_buffers(), 1)
+        self.assertEqual(reply_buffer.flush_reply_buffers(), 0)
+
+    def test_redis_unavailable_writes_directly(self):
+        with mock.patch.object(reply_buffer, 'get_redis', side_effect=ConnectionError('redis down')):
+            self.assertEqual(self._record('coding'), (time(9, 30), True))
+        self.assertEqual(UserResponse.objects.get().response_text, 'coding')
+
+
+class BeatLeaderTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(beat, 'get_redis', return_value=FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        every = IntervalSchedule.objects.create(every=30, period=IntervalSchedule.MINUTES)
+        # Overdue: a missing last_run_at counts as "just ran"
+        PeriodicTask.objects.create(
+            name='questions', task='bot2.tasks.send_activity_questions', interval=every,
+            last_run_at=timezone.now() - timedelta(hours=1),
+        )
+        self.sent = []
+
+        patcher = mock.patch.object(beat.LeaderElectedScheduler, 'producer', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _scheduler(self):
+        from bot1.celery import app
+        return beat.LeaderElectedScheduler(app=app)
+
+    @override_settings(BEAT_LEADER_TTL_SECONDS=1, BEAT_LEADER_RETRY_SECONDS=0.1)
+    def test_standby_takes_over_without_double_dispatch(self):
+        leader, standby = self._scheduler(), self._scheduler()
+        # Closing syncs to the database, which must still exist then
+        self.addCleanup(leader.close)
+        self.addCleanup(standby.close)
+
+        def send(scheduler, entry, producer=None, advance=True, **kwargs):
+            self.sent.append((scheduler.instance_id, entry.name))
+            if scheduler is leader:
+                # Dies after the message went out, before last_run_at is saved
+                raise Killed()
+
+        with mock.patch.object(DatabaseScheduler, 'apply_async', autospec=True, side_effect=send):
+            with self.assertRaises(Killed):
+                leader.tick()
+            self.assertTrue(leader.is_leader)
+
+            # The lock is still held: the standby must not dispatch
+            standby.tick()
+            self.assertFalse(standby.is_leader)
+
+            sleep(1.2)
+            for _ in range(3):
+                standby.tick()
+
+        self.assertTrue(standby.is_leader)
+        # "questions" looks due to the new leader too, but the dispatch key stops it
+        self.assertEqual(self.sent, [(leader.instance_id, 'questions')])
+
+
+class ScheduledRunTests(TestCase):
+    def _at(self, hour, minute, second=0, day=21):
+        return pytz.timezone('Asia/Almaty').localize(datetime(2025, 7, day, hour, minute, second))
+
+    def test_slot_comes_from_schedule_not_pickup_time(self):
+        request = mock.Mock(eta=None, published_at=self._at(9, 30).timestamp())
+        with mock.patch.object(tasks, 'get_kazakhstan_time', return_value=self._at(9, 47)):
+            self.assertEqual(tasks.scheduled_run(request, '09:30'), self._at(9, 30))
+            # Without kwargs the publish time decides, not the worker's clock
+            self.assertEqual(tasks.scheduled_run(request), self._at(9, 30))
+
+    def test_early_publish_and_previous_day(self):
+        self.assertEqual(slots.scheduled_at(self._at(9, 29, 59), '09:30'), self._at(9, 30))
+        self.assertEqual(slots.scheduled_at(self._at(1, 0), '17:00'), self._at(17, 0, day=20))
+        self.assertIsNone(slots.scheduled_at(self._at(8, 0)))
+
+    @override_settings(SCHEDULE_ON_TIME_SECONDS=60)
+    def test_late_slot_is_sent_and_expired_slot_is_counted_missed(self):
+        with mock.patch.object(tasks.metrics, 'incr') as incr, mock.patch.object(tasks.metrics, 'observe'):
+            with mock.patch.object(tasks, 'get_kazakhstan_time', return_value=self._at(10, 10)):
+                self.assertTrue(tasks.within_deadline('questions', self._at(10, 0), 25 * 60))
+            incr.assert_called_once_with('scheduled_slots_late_total', {'task': 'questions'})
+
+            incr.reset_mock()
+            with mock.patch.object(tasks, 'get_kazakhstan_time', return_value=self._at(10, 31)):
+                self.assertFalse(tasks.within_deadline('questions', self._at(10, 0), 25 * 60))
+            incr.assert_called_once_with('scheduled_slots_missed_total', {'task': 'questions'})
+
+
+@override_settings(CACHES=LOCMEM_CACHE, DELIVERY_FAILURE_LIMIT=3)
+class DeliveryTests(TestCase):
+    REFERENCE = json.dumps({
+        'bot': {'id': 'bot'}, 'user': {'id': 'u'}, 'conversation': {'id': 'c'},
+        'channelId': 'msteams', 'serviceUrl': 'https://example.com',
+    })
+
+    def setUp(self):
+        for n in range(3):
+            TeamsUser.objects.create(user_id=f'user-{n}', name=f'User {n}', conversation_reference=self.REFERENCE)
+        patcher = mock.patch.object(delivery, 'metrics')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _send(self, status_code):
+        user = TeamsUser.objects.get(user_id='user-0')
+        with mock.patch('requests.post', return_value=mock.Mock(status_code=status_code, text='')):
+            return tasks.send_message_via_http(user, 'hi', 'token')
+
+    def test_statuses_are_classified(self):
+        self.assertEqual(self._send(201)[0], delivery.DELIVERED)
+        self.assertEqual(self._send(403)[0], delivery.PERMANENT)
+        self.assertEqual(self._send(404)[0], delivery.PERMANENT)
+        self.assertEqual(self._send(429)[0], delivery.THROTTLED)
+        self.assertEqual(self._send(502)[0], delivery.TRANSIENT)
+        with mock.patch.object(tasks, 'invalidate_token') as invalidate:
+            self.assertEqual(self._send(401)[0], delivery.UNAUTHORIZED)
+        invalidate.assert_called_once()
+
+    def test_outage_is_not_held_against_users(self):
+        for _ in range(5):
+            # Nothing in the batch got through: the connector, not the users
+            delivery.record_results({
+                'user-0': (delivery.TRANSIENT, 'http_503'), 'user-1': (delivery.NOT_SENT, 'ConnectionError'),
+                'user-2': (delivery.THROTTLED, 'throttled'),
+            })
+        self.assertEqual(TeamsUser.objects.filter(is_active=True).count(), 3)
+        self.assertEqual(TeamsUser.objects.filter(delivery_failures__gt=0).count(), 0)
+
+    def test_connection_error_is_not_sent(self):
+        import requests
+        user = TeamsUser.objects.get(user_id='user-0')
+        with mock.patch('requests.post', side_effect=requests.ConnectionError('connector down')):
+            self.assertEqual(tasks.send_message_via_http(user, 'hi', 'token')[0], delivery.NOT_SENT)
+
+    def test_permanent_failures_deactivate_in_bulk(self):
+        deactivated = delivery.record_results({
+            'user-0': (delivery.PERMANENT, 'forbidden'),
+            'user-1': (delivery.PERMANENT, 'conversation_not_found'),
+            'user-2': (delivery.DELIVERED, ''),
+        })
+        self.assertEqual(sorted(deactivated), ['user-0', 'user-1'])
+        self.assertEqual(list(TeamsUser.objects.filter(is_active=True).values_list('user_id', flat=True)), ['user-2'])
+        self.assertEqual(TeamsUser.objects.get(user_id='user-1').deactivation_reason, 'conversation_not_found')
+
+    def test_batch_of_only_permanent_failures_deactivates_nobody(self):
+        # Every send rejected with 403: the bot's registration, not the users
+        deactivated = delivery.record_results({
+            f'user-{n}': (delivery.PERMANENT, 'forbidden') for n in range(3)
+        })
+        self.assertEqual(deactivated, [])
+        self.assertEqual(TeamsUser.objects.filter(is_active=True).count(), 3)
+
+    def test_consecutive_transient_failures_deactivate(self):
+        failing = {'user-0': (delivery.TRANSIENT, 'http_502'), 'user-1': (delivery.TRANSIENT, 'http_502')}
+        for _ in range(2):
+            delivery.record_results({**failing, 'user-2': (delivery.DELIVERED, '')})
+        # A delivered message resets the count
+        delivery.record_results({'user-1': (delivery.DELIVERED, '')})
+        delivery.record_results({**failing, 'user-2': (delivery.DELIVERED, '')})
+
+        user_0, user_1 = TeamsUser.objects.filter(user_id__in=['user-0', 'user-1']).order_by('user_id')
+        self.assertFalse(user_0.is_active)
+        self.assertEqual(user_0.deactivation_reason, 'too_many_failures')
+        self.assertTrue(user_1.is_active)
+        self.assertEqual(user_1.delivery_failures, 1)
+
+    def _forbidden(self, user_id):
+        """Deactivate user_id with a 403 in a batch that got through to user-1"""
+        delivery.record_results({user_id: (delivery.PERMANENT, 'forbidden'), 'user-1': (delivery.DELIVERED, '')})
+
+    def _message(self, text):
+        """Run one incoming message from user-0 through the bot"""
+        from .bot_handler import TeamsBot
+        turn_context = mock.Mock(send_activity=mock.AsyncMock())
+        activity = turn_context.activity
+        activity.text = text
+        activity.from_property.id, activity.from_property.name = 'user-0', 'User 0'
+        activity.conversation.tenant_id = None
+        activity.get_conversation_reference.return_value.serialize.return_value = json.loads(self.REFERENCE)
+        with mock.patch('bot2.bot_handler.resolve_open_slot', return_value=None):
+            async_to_sync(TeamsBot().on_message_activity)(turn_context)
+        return TeamsUser.objects.get(user_id='user-0')
+
+    def test_answer_starting_with_search_is_recorded(self):
+        with mock.patch('bot2.bot_handler.search_command', return_value='found') as search_command, \
+                mock.patch('bot2.bot_handler.TeamsBot._handle_regular_message') as regular:
+            self._message('search for the flaky test')
+            search_command.assert_not_called()
+            regular.assert_called_once()
+            self._message('/search release')
+        self.assertEqual(search_command.call_args.args[1], 'release')
+
+    def test_message_resubscribes_only_users_the_bot_deactivated(self):
+        self._forbidden('user-0')
+        self.assertTrue(self._message('working on the report').is_active)
+
+    def test_stop_after_auto_deactivation_is_kept(self):
+        self._forbidden('user-0')
+        self.assertEqual(self._message('stop').deactivation_reason, delivery.USER_STOP)
+        self.assertFalse(self._message('working on the report').is_active)
+        self.assertTrue(self._message('start').is_active)
+
+    def test_admin_deactivation_of_auto_deactivated_user_is_kept(self):
+        self._forbidden('user-0')
+        tasks.set_users_active(['user-0'], False)
+        self.assertEqual(TeamsUser.objects.get(user_id='user-0').deactivation_reason, delivery.ADMIN)
+        self.assertFalse(self._message('working on the report').is_active)
+
+    def test_reactivation_clears_failures(self):
+        self._forbidden('user-0')
+        ctx = UserContext.load('user-0', 'User 0', self.REFERENCE)
+        ctx.reactivate()
+        user = TeamsUser.objects.get(user_id='user-0')
+        self.assertTrue(user.is_active)
+        self.assertIsNone(user.deactivated_at)
+        self.assertEqual(user.deactivation_reason, '')
+
+
+@override_settings(ENGAGEMENT_WINDOW_DAYS=3, ENGAGEMENT_MIN_ANSWER_RATE=0.2, ENGAGEMENT_MIN_QUESTIONS=5)
+class EngagementTests(ScheduledTaskMixin, TestCase):
+    TODAY = date(2025, 7, 21)
+
+    def setUp(self):
+        for user_id, answered in (('quiet', 0), ('engaged', 10)):
+            TeamsUser.objects.create(user_id=user_id, name=user_id)
+            for d in range(1, 4):
+                DailyUserStats.objects.create(
+                    user_id=user_id, date=self.TODAY - timedelta(days=d), questions_sent=15, answered=answered,
+                )
+
+    def _tier(self, user_id):
+        return TeamsUser.objects.get(user_id=user_id).engagement_tier
+
+    def test_silent_users_back_off_one_tier_per_run(self):
+        self.assertEqual(engagement.update_tiers(self.TODAY), {engagement.HOURLY: 1})
+        self.assertEqual(self._tier('quiet'), engagement.HOURLY)
+        engagement.update_tiers(self.TODAY)
+        engagement.update_tiers(self.TODAY)
+        self.assertEqual(self._tier('quiet'), engagement.TWICE_DAILY)
+        self.assertEqual(self._tier('engaged'), engagement.FULL)
+
+    def test_answer_restores_every_slot(self):
+        TeamsUser.objects.filter(user_id='quiet').update(engagement_tier=engagement.TWICE_DAILY)
+        UserResponse.record('quiet', self.TODAY, time(10, 0), 'back')
+        self.assertEqual(self._tier('quiet'), engagement.FULL)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_failed_sends_do_not_lower_the_tier(self):
+        TeamsUser.objects.create(user_id='unreachable', name='unreachable')
+        failing = {'unreachable': (delivery.TRANSIENT, 'http_502')}
+        for d in range(1, 4):
+            for slot_time in (time(10, 0), time(11, 0)):
+                self.run_scheduled(tasks.send_activity_questions, self.TODAY - timedelta(days=d), slot_time, failing)
+        self.assertFalse(DailyUserStats.objects.filter(user_id='unreachable').exists())
+
+        engagement.update_tiers(self.TODAY)
+        self.assertEqual(self._tier('unreachable'), engagement.FULL)
+        self.assertEqual(self._tier('quiet'), engagement.HOURLY)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_fan_out_only_asks_due_tiers(self):
+        TeamsUser.objects.filter(user_id='quiet').update(engagement_tier=engagement.HOURLY)
+        self.assertEqual(engagement.due_tiers(time(9, 30)), [engagement.FULL])
+        self.assertEqual(engagement.due_tiers(time(10, 0)), [engagement.FULL, engagement.HOURLY, engagement.TWICE_DAILY])
+        send = self.run_scheduled(tasks.send_activity_questions, self.TODAY, time(9, 30))
+        self.assertEqual([call.args[0].user_id for call in send.call_args_list], ['engaged'])
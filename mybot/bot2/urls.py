@@ -4,5 +4,15 @@ from . import views
 urlpatterns = [
     path('messages/', views.messages, name='messages'),
     path('health/', views.health_check, name='health_check'),
+    path('health/live/', views.health_check, name='health_live'),
+    path('health/ready/', views.health_ready, name='health_ready'),
     path('test/', views.test_bot, name='test_bot'),
+    path('analytics/tenants/', views.analytics_tenants, name='analytics_tenants'),
+    path('analytics/slots/', views.analytics_slots, name='analytics_slots'),
+    path('analytics/categories/', views.analytics_categories, name='analytics_categories'),
+    path('analytics/participation/', views.analytics_participation, name='analytics_participation'),
+    path('analytics/non-responders/', views.analytics_non_responders, name='analytics_non_responders'),
+    path('export/responses/', views.export_responses, name='export_responses'),
+    path('search/', views.search, name='search'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ] 
\ No newline at end of file
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+from django.utils import timezone
+from . import delivery
+from .models import TeamsUser
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_conversation_reference(conversation_ref):
+    """Serialize a conversation reference without the per-message activity id"""
+    data = conversation_ref.serialize()
+    # activityId changes on every message but is not needed for proactive
+    # messaging, so keeping it would force a write on every turn
+    data.pop('activityId', None)
+    return json.dumps(data, sort_keys=True)
+
+
+def reference_hash(conversation_reference_json):
+    """Stable hash of a stored conversation reference"""
+    if not conversation_reference_json:
+        return None
+    return hashlib.sha1(conversation_reference_json.encode('utf-8')).hexdigest()
+
+
+class UserContext:
+    """
+    Per-turn view of a TeamsUser.
+
+    The user is loaded once per incoming activity and every later change
+    goes through this object, so only the fields that actually differ are
+    written back, and only when they differ.
+    """
+
+    def __init__(self, user, created=False):
+        self.user = user
+        self.created = created
+        self._reference_hash = reference_hash(user.conversation_reference)
+
+    @classmethod
+    def load(cls, user_id, user_name, conversation_reference_json, tenant_id=None):
+        """Load (or register) the user and refresh the stored reference if it changed"""
+        user, created = TeamsUser.objects.get_or_create(
+            user_id=user_id,
+            defaults={
+                'name': user_name or "Unknown User",
+                'conversation_reference': conversation_reference_json,
+                'tenant_id': tenant_id,
+            }
+        )
+        ctx = cls(user, created=created)
+        if not created:
+            fields = {'conversation_reference': conversation_reference_json}
+            if user_name:
+                fields['name'] = user_name
+            if tenant_id:
+                fields['tenant_id'] = tenant_id
+            ctx.update(**fields)
+        return ctx
+
+    @property
+    def user_id(self):
+        return self.user.user_id
+
+    def update(self, **fields):
+        """Write only the fields whose values differ from the loaded row"""
+        changed = []
+        for field, value in fields.items():
+            if field == 'conversation_reference':
+                new_hash = reference_hash(value)
+                if new_hash == self._reference_hash:
+                    continue
+                self._reference_hash = new_hash
+            elif getattr(self.user, field) == value:
+                continue
+            setattr(self.user, field, value)
+            changed.append(field)
+
+        if changed:
+            self.user.save(update_fields=changed + ['updated_at'])
+            logger.debug(f"Updated {', '.join(changed)} for user {self.user_id}")
+        return changed
+
+    def unsubscribe(self, reason):
+        """Deactivate for good: only 'start' or an admin subscribes again"""
+        return self.update(is_active=False, deactivated_at=timezone.now(), deactivation_reason=reason)
+
+    @property
+    def deactivated_by_bot(self):
+        """Deactivated because messages did not arrive, not by the user or an admin"""
+        return not self.user.is_active and self.user.deactivation_reason in delivery.AUTO_REASONS
+
+    def reactivate(self):
+        """Subscribe again at full frequency, forgetting any automatic deactivation"""
+        return self.update(
+            is_active=True, delivery_failures=0, deactivated_at=None, deactivation_reason='', engagement_tier=0,
+        )
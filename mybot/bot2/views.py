@@ -1,17 +1,21 @@
+import hmac
 import json
 import logging
-from django.http import JsonResponse, HttpResponse
+from functools import wraps
+from datetime import date
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
-from botbuilder.core import BotFrameworkAdapter, TurnContext, BotFrameworkAdapterSettings
-from botbuilder.schema import Activity
-from .bot_handler import TeamsBot
+from bot1.db_router import reporting
+from . import analytics, export, health, metrics
+from .search import search_responses
 
 logger = logging.getLogger(__name__)
 
 def get_adapter():
     """Create and configure the bot adapter"""
+    from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings
     app_id = getattr(settings, 'BOT_FRAMEWORK_APP_ID', '')
     app_password = getattr(settings, 'BOT_FRAMEWORK_APP_PASSWORD', '')
     
@@ -28,13 +32,25 @@ def get_adapter():
     
     return adapter
 
-# Create bot instance
-BOT = TeamsBot()
+# The botbuilder stack is imported with the first bot message, not by
+# every process that loads the URLconf
+_bot = None
+
+def get_bot():
+    """The bot instance, created on first use"""
+    global _bot
+    if _bot is None:
+        from .bot_handler import TeamsBot
+        _bot = TeamsBot()
+    return _bot
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def messages(request):
     """Handle incoming bot messages"""
+    from botbuilder.core import TurnContext
+    from botbuilder.schema import Activity
+
     if request.method == "POST":
         try:
             body = request.body.decode('utf-8')
@@ -70,6 +86,8 @@ def messages(request):
                 logger.error(f"Error creating adapter: {e}")
                 return JsonResponse({"error": "Bot adapter error"}, status=500)
             
+            bot = get_bot()
+
             # Get authorization header
             auth_header = request.headers.get('Authorization', '')
             logger.info(f"Authorization header: {auth_header[:50]}...")
@@ -80,11 +98,11 @@ def messages(request):
                     # For Teams, we need to handle authentication properly
                     if auth_header:
                         # Use the auth header if provided
-                        await adapter.process_activity(activity, auth_header, BOT.on_turn)
+                        await adapter.process_activity(activity, auth_header, bot.on_turn)
                     else:
                         # For development/testing, try without auth header
                         logger.warning("No authorization header provided, attempting to process without authentication")
-                        await adapter.process_activity(activity, "", BOT.on_turn)
+                        await adapter.process_activity(activity, "", bot.on_turn)
                     
                     logger.info("Successfully processed activity")
                     
@@ -98,7 +116,7 @@ def messages(request):
                         logger.info("Authentication failed, trying direct message processing...")
                         try:
                             # Direct message processing without authentication
-                            await BOT.on_message_activity(TurnContext(adapter, activity))
+                            await bot.on_message_activity(TurnContext(adapter, activity))
                             logger.info("Successfully processed message directly")
                         except Exception as direct_error:
                             logger.error(f"Direct processing also failed: {direct_error}")
@@ -127,9 +145,16 @@ def messages(request):
 @csrf_exempt
 @require_http_methods(["GET"])
 def health_check(request):
-    """Health check endpoint"""
+    """Liveness: the process answers requests, nothing else is checked"""
     return JsonResponse({"status": "healthy", "service": "Teams Bot"})
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def health_ready(request):
+    """Readiness: the last results of the background dependency probes"""
+    ready, payload = health.readiness()
+    return JsonResponse(payload, status=200 if ready else 503)
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def test_bot(request):
@@ -138,5 +163,161 @@ def test_bot(request):
         "status": "bot_ready",
         "app_id": getattr(settings, 'BOT_FRAMEWORK_APP_ID', ''),
         "endpoint": "/bot/api/messages/",
-        "health": "/bot/api/health/"
-    }) 
\ No newline at end of file
+        "health": "/bot/api/health/",
+        "ready": "/bot/api/health/ready/"
+    }) 
+
+def analytics_auth(view):
+    """Allow requests with the analytics bearer token or from a staff session"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = settings.ANALYTICS_API_TOKEN
+        auth_header = request.headers.get('Authorization', '')
+        if token and auth_header.startswith('Bearer '):
+            if hmac.compare_digest(auth_header[len('Bearer '):].encode('utf-8'), token.encode('utf-8')):
+                return view(request, *args, **kwargs)
+        elif request.user.is_authenticated and request.user.is_staff:
+            return view(request, *args, **kwargs)
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    return wrapper
+
+
+def _int_param(request, name, default, minimum=1, maximum=366):
+    try:
+        value = int(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer")
+    if not minimum <= value <= maximum:
+        raise ValueError(f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+def _date_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a YYYY-MM-DD date")
+
+
+def _report_response(request, name, **extra):
+    try:
+        params = {
+            'days': _int_param(request, 'days', 7),
+            'tenant_id': request.GET.get('tenant') or None,
+        }
+        for param, (default, maximum) in extra.items():
+            params[param] = _int_param(request, param, default, maximum=maximum)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(analytics.cached_report(name, **params))
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def analytics_tenants(request):
+    """Response rate per tenant"""
+    return _report_response(request, 'tenants')
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def analytics_slots(request):
+    """Response rate per question slot"""
+    return _report_response(request, 'slots')
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def analytics_categories(request):
+    """Answers per activity category"""
+    return _report_response(request, 'categories')
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def analytics_participation(request):
+    """Daily participation"""
+    return _report_response(request, 'participation')
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def analytics_non_responders(request):
+    """Users with the most unanswered questions"""
+    return _report_response(request, 'non_responders', limit=(20, 500))
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def export_responses(request):
+    """Stream responses as CSV or JSONL (?format=csv|jsonl&start=&end=&tenant=&user=)"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in export.EXPORT_FORMATS:
+        return JsonResponse({"error": f"'format' must be one of {', '.join(sorted(export.EXPORT_FORMATS))}"}, status=400)
+    try:
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    rows = export.export_rows(
+        start=start,
+        end=end,
+        tenant_id=request.GET.get('tenant') or None,
+        user_id=request.GET.get('user') or None,
+    )
+    response = StreamingHttpResponse(
+        export.export_lines(export_format, rows),
+        content_type=export.EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="responses.{export_format}"'
+    return response
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def search(request):
+    """Ranked full-text search over responses (?q=&start=&end=&tenant=&user=&page=&page_size=)"""
+    terms = request.GET.get('q', '').strip()
+    if not terms:
+        return JsonResponse({"error": "'q' is required"}, status=400)
+    try:
+        page = _int_param(request, 'page', 1, maximum=1000)
+        page_size = _int_param(request, 'page_size', settings.SEARCH_PAGE_SIZE, maximum=100)
+        start = _date_param(request, 'start')
+        end = _date_param(request, 'end')
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    with reporting():
+        rows, has_next = search_responses(
+            terms,
+            start=start,
+            end=end,
+            tenant_id=request.GET.get('tenant') or None,
+            user_id=request.GET.get('user') or None,
+            page=page,
+            page_size=page_size,
+        )
+    return JsonResponse({
+        'query': terms,
+        'page': page,
+        'page_size': page_size,
+        'has_next': has_next,
+        'results': rows,
+    })
+
+
+@require_http_methods(["GET"])
+@analytics_auth
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    try:
+        body = metrics.render_prometheus()
+    except Exception as e:
+        logger.error(f"Не смог собрать метрики: {e}")
+        return HttpResponse("metrics unavailable\n", status=503, content_type='text/plain')
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Startup import-time benchmark with a budget that CI can check
+
+    python importtime_budget.py             # report
+    python importtime_budget.py --check     # exit 1 if over budget
+    python importtime_budget.py --top 20    # also show the slowest imports
+
+Each target is started in a fresh interpreter under `python -X importtime`
+and the self times of every import are summed (median of --runs). The
+budget in importtime_budget.json gives, per target, the most milliseconds
+allowed and the modules that must not be imported at startup at all; the
+second check is what keeps heavy clients (OpenAI, botbuilder, requests)
+deferred to first use and does not depend on the speed of the machine.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGET_FILE = os.path.join(BASE_DIR, 'importtime_budget.json')
+
+# What each kind of process imports before it can do its work
+TARGETS = {
+    # Every management command
+    'manage': "import django; django.setup()",
+    # Worker and beat boot: Django setup plus task module autodiscovery
+    'worker': "from bot1.celery import app; app.loader.import_default_modules()",
+    'beat': (
+        "from bot1.celery import app; app.loader.import_default_modules(); "
+        "import django_celery_beat.schedulers"
+    ),
+    # The ASGI application with its URLconf loaded, as before the first request
+    'asgi': "import bot1.asgi; from django.urls import get_resolver; get_resolver().url_patterns",
+}
+
+
+def measure(code):
+    """(total milliseconds, {indented module name: cumulative microseconds}) for one run"""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'bot1.settings'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    total = 0
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total += int(self_us)
+        # Nested imports are indented under the module that imported them
+        modules[name.rstrip()[1:]] = int(cumulative_us)
+    return total / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='*', help=f"Any of: {', '.join(TARGETS)} (default: all)")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 when a budget is exceeded')
+    parser.add_argument('--top', type=int, default=0, help='Show the N slowest top-level imports per target')
+    args = parser.parse_args()
+    targets = args.targets or list(TARGETS)
+    unknown = [target for target in targets if target not in TARGETS]
+    if unknown:
+        parser.error(f"unknown target(s): {', '.join(unknown)}")
+
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)
+
+    failures = []
+    print(f"{'target':<8} {'median':>9} {'budget':>9}  forbidden imports")
+    for target in targets:
+        runs = [measure(TARGETS[target]) for _ in range(args.runs)]
+        median = statistics.median(total for total, _ in runs)
+        modules = runs[-1][1]
+        limits = budget.get(target, {})
+        max_ms = limits.get('max_ms')
+        forbidden = [
+            name for name in limits.get('forbidden', [])
+            if any(module.strip() == name or module.strip().startswith(name + '.') for module in modules)
+        ]
+        print(f"{target:<8} {median:>7.0f}ms {max_ms if max_ms is not None else '-':>7}ms  {', '.join(forbidden) or '-'}")
+
+        if max_ms is not None and median > max_ms:
+            failures.append(f"{target}: {median:.0f}ms > {max_ms}ms")
+        if forbidden:
+            failures.append(f"{target}: imports {', '.join(forbidden)} at startup")
+
+        if args.top:
+            top_level = {name: us for name, us in modules.items() if not name.startswith(' ')}
+            for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+                print(f"    {us / 1000:>8.1f}ms  {name}")
+
+    if failures:
+        print("\nOver budget:\n  " + "\n  ".join(failures))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 """
-Start Celery worker and beat scheduler for the Teams Bot
+Start Celery workers and the beat scheduler for the Teams Bot
+
+    python start_celery.py                  # every worker pool and beat
+    python start_celery.py fanout adhoc     # only these worker pools
+    python start_celery.py beat             # only beat
+
+Each profile is one worker consuming one queue (routes are in
+CELERY_TASK_ROUTES), so a slow summary or cleanup never delays the
+question fan-out.
 """
 
 import os
@@ -8,16 +16,36 @@ import sys
 import subprocess
 import time
 import signal
-import threading
 
-def start_celery_worker():
-    """Start the Celery worker"""
-    print("Starting Celery worker...")
+# queue -> worker options
+WORKER_PROFILES = {
+    # One tick every 30 minutes that must start on time: a dedicated pool,
+    # no prefetching, so a second tick never waits behind the first
+    'fanout': {'concurrency': 2, 'prefetch_multiplier': 1},
+    # Long OpenAI calls; recycle children to keep memory in check
+    'summaries': {'concurrency': 2, 'prefetch_multiplier': 1, 'max_tasks_per_child': 50},
+    # acks_late tasks: prefetch 1 so at most one task per child is redelivered
+    'maintenance': {'concurrency': 1, 'prefetch_multiplier': 1},
+    # Short sends and flushes; a little prefetch keeps throughput up
+    'adhoc': {'concurrency': 4, 'prefetch_multiplier': 4},
+}
+
+def start_celery_worker(queue):
+    """Start the Celery worker for one queue"""
+    options = WORKER_PROFILES[queue]
+    print(f"Starting Celery worker for '{queue}' queue...")
     cmd = [
         sys.executable, "-m", "celery", "-A", "bot1", "worker",
         "--loglevel=info",
-        "--concurrency=1"
+        f"--queues={queue}",
+        f"--hostname={queue}@%h",
+        f"--concurrency={os.environ.get(f'CELERY_{queue.upper()}_CONCURRENCY', options['concurrency'])}",
+        f"--prefetch-multiplier={options['prefetch_multiplier']}",
+        # Hand tasks only to idle children instead of queueing behind busy ones
+        "-O", "fair",
     ]
+    if 'max_tasks_per_child' in options:
+        cmd.append(f"--max-tasks-per-child={options['max_tasks_per_child']}")
     return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
 
 def start_celery_beat():
@@ -26,57 +54,69 @@ def start_celery_beat():
     cmd = [
         sys.executable, "-m", "celery", "-A", "bot1", "beat",
         "--loglevel=info",
-        "--scheduler=django_celery_beat.schedulers:DatabaseScheduler"
+        # Leader-elected DatabaseScheduler: safe to run on several hosts
+        "--scheduler=bot2.beat:LeaderElectedScheduler"
     ]
     return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
 
+def stop(processes):
+    """Terminate every process, killing the ones that do not stop in time"""
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    try:
+        for process in processes.values():
+            process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        print("Forcing process termination...")
+        for process in processes.values():
+            process.kill()
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
 def main():
-    """Main function to start both Celery processes"""
+    """Main function to start the requested Celery processes"""
+    names = sys.argv[1:] or [*WORKER_PROFILES, 'beat']
+    unknown = [name for name in names if name != 'beat' and name not in WORKER_PROFILES]
+    if unknown:
+        print(f"Unknown profile(s): {', '.join(unknown)}. Available: {', '.join(WORKER_PROFILES)}, beat")
+        sys.exit(2)
+
     print("Starting Teams Bot Celery Services...")
     print("=" * 50)
-    
+
     # Set Django settings
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bot1.settings')
-    
+    # docker stop sends SIGTERM; shut the children down the same way as Ctrl+C
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     # Start processes
-    worker_process = start_celery_worker()
-    beat_process = start_celery_beat()
-    
-    print(f"Celery worker PID: {worker_process.pid}")
-    print(f"Celery beat PID: {beat_process.pid}")
-    print("\nBoth processes started. Press Ctrl+C to stop.")
-    
+    processes = {}
+    for name in names:
+        processes[name] = start_celery_beat() if name == 'beat' else start_celery_worker(name)
+        print(f"Celery {name} PID: {processes[name].pid}")
+    print("\nAll processes started. Press Ctrl+C to stop.")
+
+    exit_code = 0
     try:
         # Wait for processes
         while True:
             time.sleep(1)
-            
+
             # Check if processes are still running
-            if worker_process.poll() is not None:
-                print("Celery worker stopped unexpectedly!")
+            stopped = [name for name, process in processes.items() if process.poll() is not None]
+            if stopped:
+                print(f"Celery {', '.join(stopped)} stopped unexpectedly!")
+                exit_code = 1
                 break
-                
-            if beat_process.poll() is not None:
-                print("Celery beat stopped unexpectedly!")
-                break
-                
+
     except KeyboardInterrupt:
         print("\nStopping Celery processes...")
-        
-        # Stop processes gracefully
-        worker_process.terminate()
-        beat_process.terminate()
-        
-        # Wait for processes to stop
-        try:
-            worker_process.wait(timeout=5)
-            beat_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            print("Forcing process termination...")
-            worker_process.kill()
-            beat_process.kill()
-        
-        print("Celery processes stopped.")
+
+    stop(processes)
+    print("Celery processes stopped.")
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()